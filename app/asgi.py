@@ -12,6 +12,7 @@ from loguru import logger
 from app.config import config
 from app.models.exception import HttpException
 from app.router import root_api_router
+from app.services import bgm_library, storage_manager
 from app.utils import utils
 
 
@@ -80,3 +81,7 @@ def shutdown_event():
 @app.on_event("startup")
 def startup_event():
     logger.info("startup event")
+    # new or changed songs are analysed in the background
+    utils.run_in_background(bgm_library.scan)
+    # caches that grew over their budget while the service was down are trimmed
+    storage_manager.schedule_eviction()
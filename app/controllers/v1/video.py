@@ -1,7 +1,9 @@
 import glob
+import json
 import os
 import pathlib
 import shutil
+import threading
 from typing import Union
 
 from fastapi import BackgroundTasks, Depends, Path, Request, UploadFile
@@ -14,11 +16,14 @@ from app.controllers import base
 from app.controllers.manager.memory_manager import InMemoryTaskManager
 from app.controllers.manager.redis_manager import RedisTaskManager
 from app.controllers.v1.base import new_router
+from app.models import const
 from app.models.exception import HttpException
 from app.models.schema import (
     AudioRequest,
     BgmRetrieveResponse,
     BgmUploadResponse,
+    RenderMode,
+    StorageStatsResponse,
     SubtitleRequest,
     TaskDeletionResponse,
     TaskQueryRequest,
@@ -26,6 +31,7 @@ from app.models.schema import (
     TaskResponse,
     TaskVideoRequest,
 )
+from app.services import bgm_library, storage_manager
 from app.services import state as sm
 from app.services import task as tm
 from app.utils import utils
@@ -50,6 +56,9 @@ if _enable_redis:
 else:
     task_manager = InMemoryTaskManager(max_concurrent_tasks=_max_concurrent_tasks)
 
+# a task is checked and marked as processing under the lock, it is only finalized once at a time
+_finalize_lock = threading.Lock()
+
 
 @router.post("/videos", response_model=TaskResponse, summary="Generate a short video")
 def create_video(
@@ -58,6 +67,41 @@ def create_video(
     return create_task(request, body, stop_at="video")
 
 
+@router.post(
+    "/tasks/{task_id}/finalize",
+    response_model=TaskResponse,
+    summary="Render a draft task at full quality",
+)
+def finalize_video(request: Request, task_id: str = Path(..., description="Task ID")):
+    request_id = base.get_task_id(request)
+    script_file = os.path.join(utils.task_dir(task_id), "script.json")
+    if not os.path.exists(script_file):
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+
+    with open(script_file, "r", encoding="utf-8") as f:
+        render_mode = json.load(f).get("params", {}).get("render_mode")
+    # a finalized task saves its script with the final render mode
+    if render_mode != RenderMode.draft.value:
+        raise HttpException(
+            task_id=task_id, status_code=400, message=f"{request_id}: task is not a draft or was already finalized"
+        )
+
+    with _finalize_lock:
+        task = sm.state.get_task(task_id)
+        if task and task.get("state") == const.TASK_STATE_PROCESSING:
+            raise HttpException(
+                task_id=task_id, status_code=409, message=f"{request_id}: task is still running"
+            )
+        # the draft's script, audio, subtitles, materials and seed are reused
+        sm.state.update_task(task_id)
+    task_manager.add_task(tm.finalize, task_id=task_id)
+    task = {"task_id": task_id, "request_id": request_id}
+    logger.success(f"Task finalizing: {utils.to_json(task)}")
+    return utils.get_response(200, task)
+
+
 @router.post("/subtitle", response_model=TaskResponse, summary="Generate subtitle only")
 def create_subtitle(
     background_tasks: BackgroundTasks, request: Request, body: SubtitleRequest
@@ -179,6 +223,13 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
     )
 
 
+@router.get(
+    "/storage", response_model=StorageStatsResponse, summary="Cache sizes, hit and eviction counters"
+)
+def get_storage_stats(request: Request):
+    return utils.get_response(200, storage_manager.get_stats())
+
+
 @router.get(
     "/musics", response_model=BgmRetrieveResponse, summary="Retrieve local BGM files"
 )
@@ -215,6 +266,8 @@ def upload_bgm_file(request: Request, file: UploadFile = File(...)):
             # If the file already exists, it will be overwritten
             file.file.seek(0)
             buffer.write(file.file.read())
+        # the new track is analysed and added to the bgm library in the background
+        bgm_library.add_track_in_background(save_path)
         response = {"file": save_path}
         return utils.get_response(200, response)
 
@@ -27,6 +27,11 @@ class VideoTransitionMode(str, Enum):
     slide_out = "SlideOut"
 
 
+class RenderMode(str, Enum):
+    final = "final"
+    draft = "draft"
+
+
 class VideoAspect(str, Enum):
     landscape = "16:9"
     portrait = "9:16"
@@ -116,6 +121,8 @@ class VideoParams(BaseModel):
     filter_intensity: Optional[float] = 0.5  # 滤镜强度：0.0-1.0
     enable_dynamic_effects: Optional[bool] = False  # 是否启用动态效果（缩放、平移等）
     transition_duration: Optional[float] = 1.0  # 转场持续时间（秒）
+    render_mode: Optional[RenderMode] = RenderMode.final.value  # 渲染模式：final 正式渲染，draft 低分辨率快速预览（无特效）
+    video_seed: Optional[int] = None  # 随机种子：为空时自动生成并记录在 script.json 中，相同种子可复现片段顺序和效果
 
     # 🎨 新增：AI素材生成参数
     ai_material_enabled: Optional[bool] = False  # 是否启用AI素材生成
@@ -322,3 +329,23 @@ class BgmUploadResponse(BaseResponse):
                 "data": {"file": "/VideoGenius/resource/songs/example.mp3"},
             },
         }
+
+
+class StorageStatsResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "cache_videos": {
+                        "hits": 12,
+                        "misses": 30,
+                        "evictions": 4,
+                        "evicted_bytes": 52428800,
+                        "size": 1073741824,
+                        "max_size": 10737418240,
+                    }
+                },
+            },
+        }
@@ -19,6 +19,7 @@ import hashlib
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # VideoGenius核心依赖
+from app.services import storage_manager
 from app.utils import utils
 from app.config import config
 from loguru import logger
@@ -952,26 +953,34 @@ class ImageGenerator:
     async def _save_image(self, image_data: bytes, image_id: str) -> Tuple[str, str]:
         """保存图片和缩略图"""
         
-        # 创建存储目录
-        storage_dir = Path("storage/generated_materials")
+        # 创建存储目录，目录大小由 storage_manager 按 LRU 控制
+        storage_dir = Path(utils.storage_dir("generated_materials"))
         storage_dir.mkdir(parents=True, exist_ok=True)
         
-        # 保存原图
+        # 先写入临时文件再重命名，清理线程不会看到写了一半的图片
         image_path = storage_dir / f"{image_id}.png"
-        with open(image_path, "wb") as f:
+        temp_path = storage_dir / f"{image_id}.png.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
             f.write(image_data)
+        os.replace(temp_path, image_path)
         
         # 生成缩略图
         thumbnail_path = storage_dir / f"{image_id}_thumb.png"
+        temp_path = storage_dir / f"{image_id}_thumb.png.{os.getpid()}.tmp"
         
         try:
             with Image.open(io.BytesIO(image_data)) as img:
                 img.thumbnail((256, 256), Image.Resampling.LANCZOS)
-                img.save(thumbnail_path, "PNG")
+                img.save(temp_path, "PNG")
+            os.replace(temp_path, thumbnail_path)
         except Exception as e:
             self.logger.warning(f"缩略图生成失败: {str(e)}")
+            if temp_path.exists():
+                temp_path.unlink()
             thumbnail_path = image_path  # 使用原图作为缩略图
         
+        storage_manager.touch([str(image_path)], hit=False)
+        storage_manager.schedule_eviction()
         return str(image_path), str(thumbnail_path)
 
 
@@ -0,0 +1,273 @@
+import glob
+import json
+import os
+import re
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import config
+from app.services import clip_cache, probe, renderer
+from app.utils import utils
+
+# tracks of the library, keyed by the absolute path of the source file
+_index: Optional[Dict[str, dict]] = None
+_index_lock = threading.Lock()
+# analysing and converting a track takes a few seconds, one track at a time
+_convert_lock = threading.Lock()
+# tracks analysed in the background right now, and the size and mtime of tracks
+# that failed, they are only tried again once the file changes
+_pending = set()
+_failed: Dict[str, tuple] = {}
+
+sample_rate = 44100
+channels = 2
+
+
+def library_dir() -> str:
+    d = utils.storage_dir("bgm_library")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def index_file() -> str:
+    return os.path.join(library_dir(), "index.json")
+
+
+def target_loudness() -> float:
+    """Integrated loudness (LUFS) all tracks are normalized to, `bgm_volume` is applied on top."""
+    return float(config.app.get("bgm_target_loudness", -14.0))
+
+
+def _load_index() -> Dict[str, dict]:
+    global _index
+    if _index is None:
+        _index = {}
+        try:
+            if os.path.isfile(index_file()):
+                with open(index_file(), "r", encoding="utf-8") as f:
+                    _index = json.load(f)
+        except Exception as e:
+            logger.warning(f"failed to load bgm library index, starting a new one: {str(e)}")
+            _index = {}
+    return _index
+
+
+def _save_index():
+    # write to a temp file first, a crash must not leave a truncated index behind
+    temp_file = f"{index_file()}.{os.getpid()}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(_index, f, ensure_ascii=False)
+    os.replace(temp_file, index_file())
+
+
+def measure_loudness(file_path: str) -> dict:
+    """Integrated loudness (LUFS) and true peak (dBTP) of an audio file, measured by the loudnorm filter."""
+    result = subprocess.run(
+        [
+            probe.get_ffmpeg_binary(), "-hide_banner", "-nostats", "-nostdin", "-i", file_path,
+            "-vn", "-af", "loudnorm=print_format=json", "-f", "null", "-",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+    )
+    output = result.stderr.decode("utf-8", errors="ignore")
+    match = re.search(r"\{[^{}]*\"input_i\"[^{}]*\}", output)
+    if result.returncode != 0 or not match:
+        raise ValueError(f"failed to measure loudness: {output.strip()[-500:]}")
+
+    data = json.loads(match.group(0))
+    return {
+        "loudness": float(data["input_i"]),
+        "true_peak": float(data["input_tp"]),
+    }
+
+
+def _is_fresh(entry: Optional[dict], stat: os.stat_result) -> bool:
+    return bool(
+        entry
+        and entry.get("size") == stat.st_size
+        and entry.get("mtime") == stat.st_mtime
+        and os.path.isfile(entry.get("normalized_file", ""))
+    )
+
+
+def add_track(file_path: str) -> dict:
+    """
+    Add a track to the library: probe it, measure its loudness and store a
+    decoded PCM copy with the gain that brings it to the target loudness.
+    Unchanged tracks are a lookup. Raises ValueError if the file can not be read.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    with _index_lock:
+        entry = _load_index().get(file_path)
+        if _is_fresh(entry, stat):
+            return entry
+
+    with _convert_lock:
+        # another thread may have added the track while this one waited
+        with _index_lock:
+            entry = _load_index().get(file_path)
+        if _is_fresh(entry, stat):
+            return entry
+        return _convert_track(file_path, stat)
+
+
+def _convert_track(file_path: str, stat: os.stat_result) -> dict:
+    media_info = probe.probe_media(file_path)
+    if not media_info.audio_streams:
+        raise ValueError(f"no audio stream: {file_path}")
+    loudness = measure_loudness(file_path)
+    # the gain is limited so that the loudest peak stays below -1 dBTP
+    gain = target_loudness() - loudness["loudness"]
+    gain = round(min(gain, -1.0 - loudness["true_peak"]), 2)
+
+    # copies are named by content, re-uploading the same file reuses its copy
+    normalized_file = os.path.join(library_dir(), f"{clip_cache.file_fingerprint(file_path)}.wav")
+    if not os.path.isfile(normalized_file):
+        temp_file = f"{normalized_file}.{os.getpid()}.tmp.wav"
+        try:
+            renderer.run_ffmpeg([
+                "-i", file_path, "-vn", "-af", f"volume={gain}dB",
+                "-ar", str(sample_rate), "-ac", str(channels), "-c:a", "pcm_s16le", temp_file,
+            ])
+            os.replace(temp_file, normalized_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    entry = {
+        "name": os.path.basename(file_path),
+        "file": file_path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "duration": media_info.duration,
+        "sample_rate": media_info.audio_streams[0].get("sample_rate", 0),
+        "channels": media_info.audio_streams[0].get("channels", 0),
+        "loudness": loudness["loudness"],
+        "true_peak": loudness["true_peak"],
+        "gain": gain,
+        "normalized_file": normalized_file,
+    }
+    with _index_lock:
+        index = _load_index()
+        previous = index.get(file_path) or {}
+        index[file_path] = entry
+        # an overwritten upload leaves the copy of its old content behind
+        orphan = previous.get("normalized_file", "")
+        if orphan and orphan != normalized_file and all(e.get("normalized_file") != orphan for e in index.values()):
+            if os.path.isfile(orphan):
+                os.remove(orphan)
+        try:
+            _save_index()
+        except Exception as e:
+            logger.warning(f"failed to save bgm library index: {str(e)}")
+    logger.info(f"added bgm track: {entry['name']}, {loudness['loudness']:.1f} LUFS, gain: {gain:+.1f} dB")
+    return entry
+
+
+def remove_track(file_path: str):
+    """Drop a track from the index, its normalized copy is removed when no other track uses it."""
+    file_path = os.path.abspath(file_path)
+    with _index_lock:
+        index = _load_index()
+        entry = index.pop(file_path, None)
+        if not entry:
+            return
+        shared = any(e.get("normalized_file") == entry.get("normalized_file") for e in index.values())
+        try:
+            _save_index()
+        except Exception as e:
+            logger.warning(f"failed to save bgm library index: {str(e)}")
+    if not shared and os.path.isfile(entry.get("normalized_file", "")):
+        os.remove(entry["normalized_file"])
+
+
+def scan(song_dir: str = "") -> List[dict]:
+    """
+    Bring the index in line with the songs directory: new and changed tracks
+    are added, tracks whose file is gone are dropped.
+    """
+    song_dir = song_dir or utils.song_dir()
+    files = [os.path.abspath(f) for f in glob.glob(os.path.join(song_dir, "*.mp3"))]
+    with _index_lock:
+        stale = [
+            file for file in _load_index()
+            if os.path.dirname(file) == os.path.abspath(song_dir) and file not in files
+        ]
+    for file in stale:
+        remove_track(file)
+
+    tracks = []
+    for file in files:
+        try:
+            tracks.append(add_track(file))
+        except Exception as e:
+            logger.warning(f"failed to add bgm track: {file}, {str(e)}")
+    logger.info(f"bgm library: {len(tracks)} tracks in {song_dir}")
+    return tracks
+
+
+def list_tracks(song_dir: str = "") -> List[dict]:
+    """Indexed tracks of the songs directory whose source file still exists."""
+    song_dir = os.path.abspath(song_dir or utils.song_dir())
+    with _index_lock:
+        entries = list(_load_index().values())
+    return [
+        entry
+        for entry in entries
+        if os.path.dirname(entry["file"]) == song_dir and os.path.isfile(entry["file"])
+    ]
+
+
+def get_track(file_path: str) -> Optional[dict]:
+    """
+    Index entry of a track. Returns None for tracks that are not indexed yet,
+    the caller uses the original file. Tracks of the songs directory are then
+    analysed in the background, a task never waits for the analysis.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    with _index_lock:
+        entry = _load_index().get(file_path)
+    if _is_fresh(entry, stat):
+        return entry
+    if os.path.dirname(file_path) == os.path.abspath(utils.song_dir()):
+        add_track_in_background(file_path)
+    return None
+
+
+def add_track_in_background(file_path: str):
+    """
+    Add a track in a background thread. A track is analysed once at a time,
+    and a track that failed is not tried again until its file changes.
+    """
+    file_path = os.path.abspath(file_path)
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return
+    signature = (stat.st_size, stat.st_mtime)
+    with _index_lock:
+        if file_path in _pending or _failed.get(file_path) == signature:
+            return
+        _pending.add(file_path)
+
+    def run():
+        try:
+            add_track(file_path)
+            with _index_lock:
+                _failed.pop(file_path, None)
+        except Exception as e:
+            with _index_lock:
+                _failed[file_path] = signature
+            logger.warning(f"failed to add bgm track: {file_path}, {str(e)}")
+        finally:
+            with _index_lock:
+                _pending.discard(file_path)
+
+    utils.run_in_background(run)
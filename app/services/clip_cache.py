@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Optional
+
+from loguru import logger
+
+from app.services import storage_manager
+from app.utils import utils
+
+_fingerprints = {}
+# bumped when the rendering of effects changes, clips rendered before are not reused
+key_version = 2
+
+
+def cache_dir() -> str:
+    d = utils.storage_dir("cache_clips")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def max_cache_size() -> int:
+    """Byte budget of the clip cache, 0 disables it. The budget is kept by storage_manager."""
+    return storage_manager.max_size("cache_clips")
+
+
+def is_enabled() -> bool:
+    return max_cache_size() > 0
+
+
+def file_fingerprint(file_path: str) -> str:
+    """
+    Content hash of a source file. Hashing whole stock videos is slow, the size
+    plus the head and tail of the file identify it well enough.
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+    if memo_key in _fingerprints:
+        return _fingerprints[memo_key]
+
+    chunk_size = 1024 * 1024
+    h = hashlib.md5(str(stat.st_size).encode("utf-8"))
+    with open(file_path, "rb") as f:
+        h.update(f.read(chunk_size))
+        if stat.st_size > chunk_size:
+            f.seek(max(stat.st_size - chunk_size, chunk_size))
+            h.update(f.read(chunk_size))
+
+    _fingerprints[memo_key] = h.hexdigest()
+    return _fingerprints[memo_key]
+
+
+def clip_key(
+    subclipped_item,
+    video_width: int,
+    video_height: int,
+    fps: int,
+    codec: str,
+    max_clip_duration: float,
+    fill_mode: str = "black",
+    intermediate_profile: str = "default",
+    engine: str = "ffmpeg",
+) -> str:
+    """
+    Cache key of a processed subclip, the clip file is a pure function of these
+    values. Both engines render the same effects, but not bit for bit, a clip
+    is only reused by the engine that rendered it.
+    """
+    data = [
+        key_version,
+        engine,
+        file_fingerprint(subclipped_item.file_path),
+        round(subclipped_item.start_time or 0, 3),
+        round(subclipped_item.end_time or subclipped_item.duration, 3),
+        video_width,
+        video_height,
+        fps,
+        codec,
+        max_clip_duration,
+        [list(effect) for effect in subclipped_item.effects],
+        fill_mode,
+        intermediate_profile,
+    ]
+    return hashlib.md5(json.dumps(data).encode("utf-8")).hexdigest()
+
+
+def _cache_file(key: str) -> str:
+    return os.path.join(cache_dir(), f"clip-{key}.mp4")
+
+
+def link_or_copy(src: str, dst: str):
+    # a hard link costs nothing, and deleting the task's temp file keeps the cached one
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def get(key: str, clip_file: str) -> bool:
+    """Place the cached clip at `clip_file`, returns False on a cache miss."""
+    cached_file = _cache_file(key)
+    if not os.path.isfile(cached_file):
+        return False
+    try:
+        link_or_copy(cached_file, clip_file)
+        # clips are also read by render worker processes, whose access times are
+        # never saved. The mtime tells the eviction pass of the main process about the use
+        os.utime(cached_file)
+    except OSError as e:
+        logger.warning(f"failed to read cached clip: {cached_file}, {str(e)}")
+        return False
+    storage_manager.touch([cached_file])
+    logger.debug(f"clip cache hit: {cached_file}")
+    return True
+
+
+def put(key: str, clip_file: str) -> Optional[str]:
+    """Store a rendered clip file, the least recently used clips are evicted by storage_manager."""
+    cached_file = _cache_file(key)
+    temp_file = f"{cached_file}.{os.getpid()}.tmp"
+    try:
+        link_or_copy(clip_file, temp_file)
+        os.replace(temp_file, cached_file)
+    except OSError as e:
+        logger.warning(f"failed to cache clip: {clip_file}, {str(e)}")
+        _remove_file(temp_file)
+        return None
+
+    storage_manager.touch([cached_file], hit=False)
+    storage_manager.schedule_eviction()
+    return cached_file
+
+
+def _remove_file(file: str) -> bool:
+    try:
+        os.remove(file)
+        return True
+    except OSError:
+        return False
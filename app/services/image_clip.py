@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+from typing import List, Tuple
+
+import numpy as np
+from loguru import logger
+from moviepy import VideoClip
+from PIL import Image
+
+from app.services import clip_cache
+
+# longest side of rendered image clips, the clips are scaled to the video resolution later
+max_clip_side = 1920
+
+
+def clip_size(width: int, height: int, max_side: int = max_clip_side) -> Tuple[int, int]:
+    """Output size of an image clip, the image size limited to `max_side` and rounded to even numbers."""
+    scale = min(1.0, max_side / max(width, height))
+    return max(int(width * scale) // 2 * 2, 2), max(int(height * scale) // 2 * 2, 2)
+
+
+def clip_key(
+    image_path: str,
+    duration: float,
+    fps: int,
+    codec: str,
+    zoom_start: float,
+    zoom_end: float,
+    pan_x: float,
+    pan_y: float,
+    preset: str = "",
+    encoder_params: List[str] = None,
+) -> str:
+    """Cache key of an image clip, the clip file is a pure function of the image content and these values."""
+    data = [
+        "image",
+        clip_cache.file_fingerprint(image_path),
+        max_clip_side,
+        round(duration, 3),
+        fps,
+        codec,
+        zoom_start,
+        zoom_end,
+        pan_x,
+        pan_y,
+        preset,
+        encoder_params or [],
+    ]
+    return hashlib.md5(json.dumps(data).encode("utf-8")).hexdigest()
+
+
+class KenBurns:
+    """
+    Frames of a zoom/pan over a still image. The image is scaled once to the
+    largest crop the zoom needs, each frame then only resamples a crop box of
+    that pre-scaled image. Box coordinates are fractional, so slow zooms do not
+    jitter the way integer crops do.
+
+    `pan_x`/`pan_y` in [-1, 1] move the focus from the center towards an edge
+    by the end of the clip.
+    """
+
+    def __init__(
+        self,
+        image: Image.Image,
+        size: Tuple[int, int],
+        duration: float,
+        zoom_start: float = 1.0,
+        zoom_end: float = 1.12,
+        pan_x: float = 0.0,
+        pan_y: float = 0.0,
+    ):
+        self.size = size
+        self.duration = duration
+        self.zoom_start = zoom_start
+        self.zoom_end = zoom_end
+        self.pan_x = pan_x
+        self.pan_y = pan_y
+        # at zoom z a frame shows size / z of the canvas, the canvas has the
+        # resolution of the most zoomed-in frame
+        max_zoom = max(zoom_start, zoom_end, 1.0)
+        canvas_size = (round(size[0] * max_zoom), round(size[1] * max_zoom))
+        self.canvas = image.convert("RGB").resize(canvas_size, Image.LANCZOS)
+
+    def crop_box(self, t: float) -> Tuple[float, float, float, float]:
+        progress = min(max(t / self.duration, 0.0), 1.0) if self.duration > 0 else 1.0
+        zoom = self.zoom_start + (self.zoom_end - self.zoom_start) * progress
+        # zooming out of the image is not possible, zoom factors below 1 show the whole image
+        zoom = max(zoom, 1.0)
+        canvas_w, canvas_h = self.canvas.size
+        box_w, box_h = canvas_w / zoom, canvas_h / zoom
+        center_x = canvas_w / 2 + self.pan_x * progress * (canvas_w - box_w) / 2
+        center_y = canvas_h / 2 + self.pan_y * progress * (canvas_h - box_h) / 2
+        left = min(max(center_x - box_w / 2, 0.0), canvas_w - box_w)
+        top = min(max(center_y - box_h / 2, 0.0), canvas_h - box_h)
+        return left, top, left + box_w, top + box_h
+
+    def __call__(self, t: float) -> np.ndarray:
+        frame = self.canvas.resize(self.size, Image.BILINEAR, box=self.crop_box(t))
+        return np.asarray(frame)
+
+
+def render_image_clip(
+    image_path: str,
+    output_file: str,
+    duration: float,
+    fps: int = 30,
+    codec: str = "libx264",
+    zoom_start: float = 1.0,
+    zoom_end: float = 1.12,
+    pan_x: float = 0.0,
+    pan_y: float = 0.0,
+    preset: str = "",
+    encoder_params: List[str] = None,
+) -> str:
+    """
+    Render a still image into a video clip with a Ken Burns zoom/pan. Clips are
+    stored in the clip cache, an image is only rendered once for the same parameters.
+    """
+    cache_key = None
+    if clip_cache.is_enabled():
+        cache_key = clip_key(
+            image_path, duration, fps, codec, zoom_start, zoom_end, pan_x, pan_y, preset, encoder_params
+        )
+        if clip_cache.get(cache_key, output_file):
+            return output_file
+
+    with Image.open(image_path) as image:
+        size = clip_size(*image.size)
+        frames = KenBurns(image, size, duration, zoom_start, zoom_end, pan_x, pan_y)
+
+    clip = VideoClip(frames, duration=duration)
+    temp_file = f"{output_file}.{os.getpid()}.tmp.mp4"
+    try:
+        clip.write_videofile(
+            temp_file,
+            fps=fps,
+            codec=codec,
+            audio=False,
+            preset=preset or "medium",
+            ffmpeg_params=encoder_params,
+            logger=None,
+        )
+        os.replace(temp_file, output_file)
+    finally:
+        clip.close()
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    logger.debug(f"rendered image clip: {image_path}, {size[0]}x{size[1]}, {duration}s")
+
+    if cache_key:
+        clip_cache.put(cache_key, output_file)
+    return output_file
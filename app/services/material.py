@@ -1,14 +1,20 @@
+import json
 import os
 import random
-from typing import List
-from urllib.parse import urlencode
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
+from urllib.parse import urlencode, urlparse
 
+import psutil
 import requests
 from loguru import logger
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from requests.adapters import HTTPAdapter
 
 from app.config import config
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import material_index, probe, storage_manager
 from app.utils import utils
 
 requested_count = 0
@@ -31,11 +37,146 @@ def get_api_key(cfg_key: str):
     return api_keys[requested_count % len(api_keys)]
 
 
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# search results of the stock APIs, keyed by provider, term, orientation and minimum duration
+_search_cache: Optional[dict] = None
+_search_cache_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    HTTP session shared by searches and downloads, connections to the APIs and
+    CDNs are kept alive instead of a new TCP/TLS handshake for every request.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = max(int(config.app.get("download_workers", 4) or 1), 8)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def search_cache_file() -> str:
+    return os.path.join(utils.storage_dir(create=True), "search_cache.json")
+
+
+def search_cache_ttl() -> float:
+    """Seconds a search result is reused, 0 disables the cache."""
+    return float(config.app.get("search_cache_ttl_hours", 24) or 0) * 3600
+
+
+def _load_search_cache() -> dict:
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = {}
+        try:
+            if os.path.isfile(search_cache_file()):
+                with open(search_cache_file(), "r", encoding="utf-8") as f:
+                    _search_cache = json.load(f)
+        except Exception as e:
+            logger.warning(f"failed to load search cache, starting a new one: {str(e)}")
+            _search_cache = {}
+    return _search_cache
+
+
+def _search_cache_key(provider: str, search_term: str, video_aspect: VideoAspect, minimum_duration: int) -> str:
+    # the selected renditions depend on the tolerance, results of another tolerance are not reused
+    return json.dumps([
+        provider, search_term.strip().lower(), VideoAspect(video_aspect).name, minimum_duration, resolution_tolerance(),
+    ])
+
+
+def get_cached_search(
+    provider: str, search_term: str, video_aspect: VideoAspect, minimum_duration: int
+) -> Optional[List[MaterialInfo]]:
+    """Results of the same search within the TTL, None if the API has to be asked."""
+    ttl = search_cache_ttl()
+    if ttl <= 0:
+        return None
+    key = _search_cache_key(provider, search_term, video_aspect, minimum_duration)
+    with _search_cache_lock:
+        entry = _load_search_cache().get(key)
+    if not entry or time.time() - entry["time"] > ttl:
+        return None
+    logger.info(f"using cached search results: {provider}, '{search_term}', {len(entry['items'])} videos")
+    return [MaterialInfo(**item) for item in entry["items"]]
+
+
+def cache_search(
+    provider: str, search_term: str, video_aspect: VideoAspect, minimum_duration: int, items: List[MaterialInfo]
+):
+    """Store the results of a successful search, expired entries are dropped."""
+    ttl = search_cache_ttl()
+    if ttl <= 0:
+        return
+    key = _search_cache_key(provider, search_term, video_aspect, minimum_duration)
+    now = time.time()
+    with _search_cache_lock:
+        cache = _load_search_cache()
+        for expired in [k for k, v in cache.items() if now - v["time"] > ttl]:
+            del cache[expired]
+        cache[key] = {
+            "time": now,
+            "items": [{"provider": i.provider, "url": i.url, "duration": i.duration} for i in items],
+        }
+        # write to a temp file first, a crash must not leave a truncated cache behind
+        temp_file = f"{search_cache_file()}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(temp_file, search_cache_file())
+        except Exception as e:
+            logger.warning(f"failed to save search cache: {str(e)}")
+
+
+def resolution_tolerance() -> float:
+    """How far (0-1) a rendition may be below the video resolution and still be used."""
+    return min(max(float(config.app.get("material_resolution_tolerance", 0.1) or 0), 0.0), 1.0)
+
+
+def select_rendition(
+    renditions: List[dict], video_width: int, video_height: int, tolerance: float = None
+) -> Optional[dict]:
+    """
+    Pick the cheapest rendition of a video that still covers the video
+    resolution. A rendition is sufficient if fitting it into the frame scales
+    it up by no more than `tolerance`. Sufficient renditions are scored by
+    their decode cost (pixels per second), then by their size in bytes.
+    Renditions are dicts with width, height and optionally fps and size.
+    Returns None if no rendition is large enough.
+    """
+    tolerance = resolution_tolerance() if tolerance is None else tolerance
+    candidates = []
+    for rendition in renditions:
+        w = int(rendition.get("width") or 0)
+        h = int(rendition.get("height") or 0)
+        if w <= 0 or h <= 0:
+            continue
+        # materials are scaled to fit the frame, the side that touches the frame decides the upscale
+        if max(w / video_width, h / video_height) < 1 - tolerance:
+            continue
+        fps = float(rendition.get("fps") or 30)
+        size = int(rendition.get("size") or 0)
+        candidates.append(((w * h * fps, size), rendition))
+    if not candidates:
+        return None
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+
 def search_videos_pexels(
     search_term: str,
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
 ) -> List[MaterialInfo]:
+    cached_items = get_cached_search("pexels", search_term, video_aspect, minimum_duration)
+    if cached_items is not None:
+        return cached_items
+
     aspect = VideoAspect(video_aspect)
     video_orientation = aspect.name
     video_width, video_height = aspect.to_resolution()
@@ -50,7 +191,7 @@ def search_videos_pexels(
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = get_session().get(
             query_url,
             headers=headers,
             proxies=config.proxy,
@@ -69,18 +210,20 @@ def search_videos_pexels(
             # check if video has desired minimum duration
             if duration < minimum_duration:
                 continue
-            video_files = v["video_files"]
-            # loop through each url to determine the best quality
-            for video in video_files:
-                w = int(video["width"])
-                h = int(video["height"])
-                if w == video_width and h == video_height:
-                    item = MaterialInfo()
-                    item.provider = "pexels"
-                    item.url = video["link"]
-                    item.duration = duration
-                    video_items.append(item)
-                    break
+            # hls playlists can not be downloaded as one file, only progressive mp4 files are used
+            video_files = [
+                f for f in v["video_files"] if f.get("file_type", "video/mp4") == "video/mp4" and f.get("link")
+            ]
+            video = select_rendition(video_files, video_width, video_height)
+            if not video:
+                logger.debug(f"no rendition covers {video_width}x{video_height}, skipping video: {v.get('url')}")
+                continue
+            item = MaterialInfo()
+            item.provider = "pexels"
+            item.url = video["link"]
+            item.duration = duration
+            video_items.append(item)
+        cache_search("pexels", search_term, video_aspect, minimum_duration, video_items)
         return video_items
     except Exception as e:
         logger.error(f"search videos failed: {str(e)}")
@@ -93,6 +236,10 @@ def search_videos_pixabay(
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
 ) -> List[MaterialInfo]:
+    cached_items = get_cached_search("pixabay", search_term, video_aspect, minimum_duration)
+    if cached_items is not None:
+        return cached_items
+
     aspect = VideoAspect(video_aspect)
 
     video_width, video_height = aspect.to_resolution()
@@ -109,7 +256,7 @@ def search_videos_pixabay(
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = get_session().get(
             query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
         )
         response = r.json()
@@ -124,19 +271,18 @@ def search_videos_pixabay(
             # check if video has desired minimum duration
             if duration < minimum_duration:
                 continue
-            video_files = v["videos"]
-            # loop through each url to determine the best quality
-            for video_type in video_files:
-                video = video_files[video_type]
-                w = int(video["width"])
-                # h = int(video["height"])
-                if w >= video_width:
-                    item = MaterialInfo()
-                    item.provider = "pixabay"
-                    item.url = video["url"]
-                    item.duration = duration
-                    video_items.append(item)
-                    break
+            # renditions are keyed by quality: large, medium, small, tiny
+            video_files = [f for f in v["videos"].values() if f.get("url")]
+            video = select_rendition(video_files, video_width, video_height)
+            if not video:
+                logger.debug(f"no rendition covers {video_width}x{video_height}, skipping video: {v.get('pageURL')}")
+                continue
+            item = MaterialInfo()
+            item.provider = "pixabay"
+            item.url = video["url"]
+            item.duration = duration
+            video_items.append(item)
+        cache_search("pixabay", search_term, video_aspect, minimum_duration, video_items)
         return video_items
     except Exception as e:
         logger.error(f"search videos failed: {str(e)}")
@@ -144,7 +290,118 @@ def search_videos_pixabay(
     return []
 
 
-def save_video(video_url: str, save_dir: str = "") -> str:
+# downloads running per host, hosts throttle or reset clients that open too many connections
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+download_chunk_size = 1024 * 1024
+
+# one download per video, in this process by a lock and across worker
+# processes by a claim file created next to the video
+_video_locks = {}
+_video_locks_lock = threading.Lock()
+
+
+def _host_slot(url: str) -> threading.Semaphore:
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        if host not in _host_slots:
+            limit = max(int(config.app.get("download_per_host", 3) or 1), 1)
+            _host_slots[host] = threading.BoundedSemaphore(limit)
+        return _host_slots[host]
+
+
+def _video_lock(video_path: str) -> threading.Lock:
+    with _video_locks_lock:
+        if video_path not in _video_locks:
+            _video_locks[video_path] = threading.Lock()
+        return _video_locks[video_path]
+
+
+def _claim(claim_path: str, cancel: threading.Event = None) -> bool:
+    """
+    Create the claim file of a download, waiting while another process holds
+    it. A claim whose process is gone is taken over. Returns False if cancelled.
+    """
+    while True:
+        try:
+            fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(claim_path, "r") as f:
+                    pid = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pid = 0
+            # the thread lock is held, a claim of this process was left by a crashed download.
+            # a claim without a pid may still be written, it is only taken over once it is old
+            if pid:
+                stale = pid == os.getpid() or not psutil.pid_exists(pid)
+            else:
+                try:
+                    stale = time.time() - os.path.getmtime(claim_path) > 60
+                except OSError:
+                    stale = False
+            if stale:
+                logger.debug(f"removing stale download claim: {claim_path}")
+                _remove(claim_path)
+                continue
+            if cancel is not None and cancel.is_set():
+                return False
+            time.sleep(1)
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+
+
+def _remove(file_path: str):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def _download(video_url: str, part_path: str, cancel: threading.Event = None) -> bool:
+    """
+    Stream `video_url` into `part_path`. A partial file left by an earlier
+    attempt is resumed with a Range request. Returns False if cancelled, the
+    partial file is kept for the next attempt.
+    """
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
+    }
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    with get_session().get(
+        video_url,
+        headers=headers,
+        proxies=config.proxy,
+        verify=False,
+        timeout=(60, 240),
+        stream=True,
+    ) as r:
+        if r.status_code == 416 and offset:
+            # the partial file already holds the whole video
+            return True
+        r.raise_for_status()
+        if offset and r.status_code != 206:
+            # the server ignored the range, start over
+            logger.debug(f"server does not support resuming, downloading again: {video_url}")
+            offset = 0
+        elif offset:
+            logger.info(f"resuming download at {offset} bytes: {video_url}")
+
+        with open(part_path, "ab" if offset else "wb") as f:
+            for chunk in r.iter_content(chunk_size=download_chunk_size):
+                if cancel is not None and cancel.is_set():
+                    return False
+                f.write(chunk)
+    return True
+
+
+def save_video(video_url: str, save_dir: str = "", cancel: threading.Event = None) -> str:
     if not save_dir:
         save_dir = utils.storage_dir("cache_videos")
 
@@ -159,31 +416,58 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     # if video already exists, return the path
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         logger.info(f"video already exists: {video_path}")
+        storage_manager.touch([video_path])
         return video_path
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-    }
+    # tasks finding the same video wait for the one downloading it
+    lock = _video_lock(video_path)
+    while not lock.acquire(timeout=1):
+        if cancel is not None and cancel.is_set():
+            return ""
+    try:
+        claim_path = f"{video_path}.lock"
+        if not _claim(claim_path, cancel):
+            return ""
+        try:
+            return _save_video(video_url, video_path, cancel)
+        finally:
+            _remove(claim_path)
+    finally:
+        lock.release()
 
-    # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
-                video_url,
-                headers=headers,
-                proxies=config.proxy,
-                verify=False,
-                timeout=(60, 240),
-            ).content
-        )
+
+def _save_video(video_url: str, video_path: str, cancel: threading.Event = None) -> str:
+    # downloaded by another task while this one waited
+    if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+        logger.info(f"video already exists: {video_path}")
+        storage_manager.touch([video_path])
+        return video_path
+
+    # if video does not exist, download it. chunks are written to a partial
+    # file that is renamed when complete, an interrupted download never leaves
+    # a truncated video behind and is resumed next time
+    part_path = f"{video_path}.part"
+    slot = _host_slot(video_url)
+    while not slot.acquire(timeout=1):
+        if cancel is not None and cancel.is_set():
+            return ""
+    try:
+        if cancel is not None and cancel.is_set():
+            return ""
+        if not _download(video_url, part_path, cancel):
+            logger.info(f"download cancelled: {video_url}")
+            return ""
+    finally:
+        slot.release()
+    os.replace(part_path, video_path)
 
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
-            fps = clip.fps
-            clip.close()
-            if duration > 0 and fps > 0:
+            # the probe result is cached, combine_videos reads it again without re-probing
+            media_info = probe.probe_media(video_path)
+            if media_info.duration > 0 and media_info.fps > 0:
+                storage_manager.touch([video_path], hit=False)
+                storage_manager.schedule_eviction()
                 return video_path
         except Exception as e:
             try:
@@ -203,23 +487,56 @@ def download_videos(
     audio_duration: float = 0.0,
     max_clip_duration: int = 5,
 ) -> List[str]:
+    # materials downloaded by earlier tasks for the same terms are used first,
+    # the network is only asked for the duration they do not cover
+    local_paths = []
+    local_urls = set()
+    total_duration = 0.0
+    for search_term in search_terms:
+        for row in material_index.find_materials(search_term, video_aspect, max_clip_duration):
+            if row["path"] not in local_paths:
+                local_paths.append(row["path"])
+                local_urls.add(row["url"])
+                total_duration += min(max_clip_duration, row["duration"])
+    # marked as used right away, the eviction of cache_videos keeps recently used files
+    storage_manager.touch(local_paths)
+    if video_contact_mode.value == VideoConcatMode.random.value:
+        random.shuffle(local_paths)
+    logger.info(f"found {len(local_paths)} local videos, duration: {total_duration} seconds")
+
+    if total_duration > audio_duration or config.app.get("material_offline", False):
+        if total_duration <= audio_duration:
+            logger.warning(f"offline mode: local videos do not cover the audio duration: {audio_duration} seconds")
+        material_index.touch(local_paths)
+        logger.success(f"using {len(local_paths)} local videos")
+        return local_paths
+
     valid_video_items = []
     valid_video_urls = []
+    video_terms = {}
     found_duration = 0.0
     search_videos = search_videos_pexels
     if source == "pixabay":
         search_videos = search_videos_pixabay
 
-    for search_term in search_terms:
-        video_items = search_videos(
+    # all terms are searched at once, the results are merged in the order of the terms
+    def search(search_term):
+        return search_videos(
             search_term=search_term,
             minimum_duration=max_clip_duration,
             video_aspect=video_aspect,
         )
+
+    search_workers = max(min(len(search_terms), int(config.app.get("search_workers", 4) or 1)), 1)
+    with ThreadPoolExecutor(max_workers=search_workers) as executor:
+        search_results = list(executor.map(search, search_terms))
+
+    for search_term, video_items in zip(search_terms, search_results):
         logger.info(f"found {len(video_items)} videos for '{search_term}'")
 
         for item in video_items:
-            if item.url not in valid_video_urls:
+            video_terms.setdefault(item.url, []).append(search_term)
+            if item.url not in valid_video_urls and item.url not in local_urls:
                 valid_video_items.append(item)
                 valid_video_urls.append(item.url)
                 found_duration += item.duration
@@ -227,7 +544,6 @@ def download_videos(
     logger.info(
         f"found total videos: {len(valid_video_items)}, required duration: {audio_duration} seconds, found duration: {found_duration} seconds"
     )
-    video_paths = []
 
     material_directory = config.app.get("material_directory", "").strip()
     if material_directory == "task":
@@ -238,27 +554,69 @@ def download_videos(
     if video_contact_mode.value == VideoConcatMode.random.value:
         random.shuffle(valid_video_items)
 
-    total_duration = 0.0
-    for item in valid_video_items:
-        try:
-            logger.info(f"downloading video: {item.url}")
-            saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
-            )
-            if saved_video_path:
-                logger.info(f"video saved: {saved_video_path}")
-                video_paths.append(saved_video_path)
-                seconds = min(max_clip_duration, item.duration)
-                total_duration += seconds
-                if total_duration > audio_duration:
-                    logger.info(
-                        f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
-                    )
-                    break
-        except Exception as e:
-            logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+    # a few videos are downloaded at once, new downloads start as others finish.
+    # once the downloaded videos cover the audio the running downloads are cancelled
+    workers = max(int(config.app.get("download_workers", 4) or 1), 1)
+    cancel = threading.Event()
+    saved_paths = {}
+    queue = iter(enumerate(valid_video_items))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+
+        def submit_next():
+            for index, item in queue:
+                logger.info(f"downloading video: {item.url}")
+                future = executor.submit(save_video, item.url, material_directory, cancel)
+                running[future] = (index, item)
+                return
+
+        for _ in range(workers):
+            submit_next()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item = running.pop(future)
+                try:
+                    saved_video_path = future.result()
+                except Exception as e:
+                    logger.error(f"failed to download video: {utils.to_json(item)} => {str(e)}")
+                    saved_video_path = ""
+                if saved_video_path:
+                    logger.info(f"video saved: {saved_video_path}")
+                    saved_paths[index] = saved_video_path
+                    index_material(saved_video_path, item, video_terms.get(item.url))
+                    total_duration += min(max_clip_duration, item.duration)
+                    if total_duration > audio_duration and not cancel.is_set():
+                        logger.info(
+                            f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
+                        )
+                        cancel.set()
+                if not cancel.is_set():
+                    submit_next()
+
+    # keep the order of the search results, sequential mode depends on it
+    video_paths = [saved_paths[index] for index in sorted(saved_paths)]
     logger.success(f"downloaded {len(video_paths)} videos")
-    return video_paths
+    material_index.touch(local_paths)
+    return local_paths + video_paths
+
+
+def index_material(video_path: str, item: MaterialInfo, terms: List[str] = None):
+    """Add a downloaded video to the material index, so later tasks find it offline."""
+    try:
+        # the probe result was cached when the download was checked
+        media_info = probe.probe_media(video_path)
+        material_index.add_material(
+            video_path,
+            provider=item.provider,
+            url=item.url,
+            duration=media_info.duration,
+            width=media_info.width,
+            height=media_info.height,
+            terms=terms,
+        )
+    except Exception as e:
+        logger.warning(f"failed to index material: {video_path}, {str(e)}")
 
 
 if __name__ == "__main__":
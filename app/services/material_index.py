@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, List
+
+from loguru import logger
+
+from app.models.schema import VideoAspect
+from app.utils import utils
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+_schema = """
+CREATE TABLE IF NOT EXISTS materials (
+    path TEXT PRIMARY KEY,
+    provider TEXT NOT NULL DEFAULT '',
+    url TEXT NOT NULL DEFAULT '',
+    duration REAL NOT NULL DEFAULT 0,
+    width INTEGER NOT NULL DEFAULT 0,
+    height INTEGER NOT NULL DEFAULT 0,
+    orientation TEXT NOT NULL DEFAULT '',
+    size INTEGER NOT NULL DEFAULT 0,
+    added REAL NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS materials_url ON materials (url);
+CREATE TABLE IF NOT EXISTS material_terms (
+    path TEXT NOT NULL REFERENCES materials (path) ON DELETE CASCADE,
+    term TEXT NOT NULL,
+    PRIMARY KEY (term, path)
+);
+"""
+
+
+def db_file() -> str:
+    return os.path.join(utils.storage_dir(create=True), "material_index.db")
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Open the index, every call gets its own connection, downloads register
+    materials from several threads. The schema is created on first use.
+    """
+    file = db_file()
+    conn = sqlite3.connect(file, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    with _schema_lock:
+        if file not in _schema_ready:
+            conn.executescript(_schema)
+            _schema_ready.add(file)
+    return conn
+
+
+def normalize_term(term: str) -> str:
+    return " ".join(term.lower().split())
+
+
+def get_orientation(width: int, height: int) -> str:
+    """Name of the VideoAspect a material of this size fits."""
+    if width > height:
+        return VideoAspect.landscape.name
+    if height > width:
+        return VideoAspect.portrait.name
+    return VideoAspect.square.name
+
+
+def add_material(
+    path: str,
+    provider: str,
+    url: str,
+    duration: float,
+    width: int,
+    height: int,
+    terms: List[str] = None,
+):
+    """Register a cached material file, or add the search terms that found it again."""
+    path = os.path.abspath(path)
+    now = time.time()
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            """
+            INSERT INTO materials (path, provider, url, duration, width, height, orientation, size, added, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                provider = excluded.provider, url = excluded.url, duration = excluded.duration,
+                width = excluded.width, height = excluded.height, orientation = excluded.orientation,
+                size = excluded.size, last_used = excluded.last_used
+            """,
+            (path, provider, url, duration, width, height, get_orientation(width, height), size, now, now),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO material_terms (path, term) VALUES (?, ?)",
+            [(path, normalize_term(term)) for term in terms or [] if term.strip()],
+        )
+
+
+def find_materials(
+    term: str,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    minimum_duration: float = 0,
+    provider: str = "",
+) -> List[Dict]:
+    """
+    Cached materials found by `term` before that fit the aspect and are at
+    least `minimum_duration` seconds long, the least recently used first.
+    Rows of deleted files are dropped.
+    """
+    query = """
+        SELECT m.* FROM materials m JOIN material_terms t ON t.path = m.path
+        WHERE t.term = ? AND m.orientation = ? AND m.duration >= ?
+    """
+    args = [normalize_term(term), VideoAspect(video_aspect).name, minimum_duration]
+    if provider:
+        query += " AND m.provider = ?"
+        args.append(provider)
+    query += " ORDER BY m.last_used, m.added"
+
+    with closing(_connect()) as conn, conn:
+        rows = [dict(row) for row in conn.execute(query, args)]
+        missing = [row["path"] for row in rows if not os.path.isfile(row["path"])]
+        if missing:
+            logger.info(f"removing {len(missing)} deleted materials from the index")
+            conn.executemany("DELETE FROM materials WHERE path = ?", [(path,) for path in missing])
+    return [row for row in rows if row["path"] not in missing]
+
+
+def touch(paths: List[str]):
+    """Mark materials as used by a task."""
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.executemany(
+            "UPDATE materials SET last_used = ? WHERE path = ?",
+            [(now, os.path.abspath(path)) for path in paths],
+        )
+
+
+def remove_material(path: str):
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM materials WHERE path = ?", (os.path.abspath(path),))
@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+from loguru import logger
+from moviepy import VideoFileClip
+from PIL import Image, ImageFilter, ImageOps
+
+# open readers, the most recently used one last
+_readers = OrderedDict()
+_lock = threading.Lock()
+max_open_readers = 4
+
+
+def fit_size(width: int, height: int, target_width: int, target_height: int) -> Tuple[int, int]:
+    """Largest size with the aspect ratio of `width` x `height` that fits into the target, rounded to even numbers."""
+    scale = min(target_width / width, target_height / height)
+    new_width = min(max(int(width * scale) // 2 * 2, 2), target_width)
+    new_height = min(max(int(height * scale) // 2 * 2, 2), target_height)
+    # keep the exact target size when the aspect ratios match
+    if abs(new_width - target_width) <= 2 and abs(new_height - target_height) <= 2:
+        return target_width, target_height
+    return new_width, new_height
+
+
+class FramePadder:
+    """
+    Pad decoded frames to `width` x `height`, the frame is centered on a black
+    canvas, or with fill_mode "blur" on a blurred copy of itself. The blurred
+    background is computed at 1/8 of the output resolution and upscaled.
+    Use it with `clip.image_transform(padder)`.
+    """
+
+    def __init__(self, width: int, height: int, fill_mode: str = "black"):
+        self.width = width
+        self.height = height
+        self.fill_mode = fill_mode
+        self._canvas = np.zeros((height, width, 3), dtype=np.uint8)
+
+    def background(self, frame: np.ndarray) -> np.ndarray:
+        if self.fill_mode != "blur":
+            return self._canvas.copy()
+        small_size = (max(self.width // 8, 1), max(self.height // 8, 1))
+        small = ImageOps.fit(Image.fromarray(frame), small_size, Image.BILINEAR)
+        small = small.filter(ImageFilter.BoxBlur(2))
+        return np.array(small.resize((self.width, self.height), Image.BILINEAR))
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        if (w, h) == (self.width, self.height):
+            return frame
+        h, w = min(h, self.height), min(w, self.width)
+        result = self.background(frame)
+        x, y = (self.width - w) // 2, (self.height - h) // 2
+        result[y:y + h, x:x + w] = frame[:h, :w]
+        return result
+
+
+def open_video(file_path: str, width: int, height: int) -> VideoFileClip:
+    """
+    Open a source video whose frames are decoded already scaled to `width` x `height`.
+    Readers are shared, subclips of the same file reuse one open decoder, and
+    consecutive subclips continue reading where the previous one stopped.
+    Clips returned here must not be closed by the caller, see `close_all`.
+    """
+    return _open(file_path, width, height, width, height, "black")
+
+
+def open_fitted_video(
+    file_path: str,
+    source_width: int,
+    source_height: int,
+    width: int,
+    height: int,
+    fill_mode: str = "black",
+) -> VideoFileClip:
+    """
+    Open a source video whose frames are decoded at exactly `width` x `height`.
+    Sources with another aspect ratio are scaled to fit and padded right after
+    decoding, see `FramePadder`, instead of compositing them over a background clip.
+    """
+    scaled_width, scaled_height = fit_size(source_width, source_height, width, height)
+    return _open(file_path, scaled_width, scaled_height, width, height, fill_mode)
+
+
+def _open(file_path: str, scaled_width: int, scaled_height: int, width: int, height: int, fill_mode: str):
+    if (scaled_width, scaled_height) == (width, height):
+        fill_mode = "black"
+    key = (os.path.abspath(file_path), scaled_width, scaled_height, width, height, fill_mode)
+    with _lock:
+        clip = _readers.get(key)
+        if clip is not None:
+            _readers.move_to_end(key)
+            return clip
+
+        # moviepy passes target_resolution to ffmpeg, frames are scaled by the decoder
+        # instead of decoding full resolution RGB frames and resizing them with PIL
+        clip = VideoFileClip(file_path, audio=False, target_resolution=(scaled_width, scaled_height))
+        if (scaled_width, scaled_height) != (width, height):
+            # the transformed clip shares the decoder, closing it closes the reader
+            clip = clip.image_transform(FramePadder(width, height, fill_mode))
+        _readers[key] = clip
+        logger.debug(f"opened material reader: {file_path}, {scaled_width}x{scaled_height}, output: {width}x{height}")
+
+        while len(_readers) > max_open_readers:
+            _, oldest = _readers.popitem(last=False)
+            _close(oldest)
+        return clip
+
+
+def close_all():
+    with _lock:
+        while _readers:
+            _, clip = _readers.popitem(last=False)
+            _close(clip)
+
+
+def _close(clip: VideoFileClip):
+    try:
+        clip.close()
+    except Exception as e:
+        logger.warning(f"failed to close material reader: {str(e)}")
@@ -0,0 +1,335 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from contextlib import closing
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+
+@dataclass
+class MediaInfo:
+    path: str = ""
+    size: int = 0
+    mtime: float = 0.0
+    duration: float = 0.0
+    fps: float = 0.0
+    width: int = 0
+    height: int = 0
+    codec: str = ""
+    pix_fmt: str = ""
+    time_base: str = ""
+    keyframes: int = 0
+    # the keyframe count takes a decoding pass, it is only known if it was asked for
+    keyframes_probed: bool = False
+    audio_streams: List[Dict] = field(default_factory=list)
+
+    @property
+    def has_video(self) -> bool:
+        return self.width > 0 and self.height > 0
+
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+_schema = """
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+# entries of deleted files are removed at most this often (seconds), it stats every entry
+prune_interval = 24 * 3600
+
+
+def db_file() -> str:
+    return os.path.join(utils.storage_dir(create=True), "probe_index.db")
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Open the index, every call gets its own connection. Worker processes probe
+    files at the same time, each result is written as one row.
+    """
+    file = db_file()
+    conn = sqlite3.connect(file, timeout=30)
+    with _schema_lock:
+        if file not in _schema_ready:
+            conn.executescript(_schema)
+            _schema_ready.add(file)
+    return conn
+
+
+def _is_indexed(file_path: str) -> bool:
+    """Temp files of tasks are probed once and deleted with the task, they are not stored."""
+    temp_dirs = [os.path.join(utils.storage_dir(), "tasks"), config.app.get("scratch_dir", "")]
+    for d in temp_dirs:
+        if d and file_path.startswith(os.path.abspath(d) + os.sep):
+            return False
+    return True
+
+
+def _get_entry(file_path: str, stat: os.stat_result) -> Optional[dict]:
+    """Stored entry of a file, None if there is none or the file changed since."""
+    if not _is_indexed(file_path):
+        return None
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT size, mtime, data FROM probes WHERE path = ?", (file_path,)).fetchone()
+    if not row or row[0] != stat.st_size or row[1] != stat.st_mtime:
+        return None
+    return json.loads(row[2])
+
+
+def _put_entry(file_path: str, entry: dict):
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            """
+            INSERT INTO probes (path, size, mtime, data) VALUES (?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, data = excluded.data
+            """,
+            (file_path, entry["size"], entry["mtime"], json.dumps(entry, ensure_ascii=False)),
+        )
+        _prune(conn)
+
+
+def _prune(conn: sqlite3.Connection):
+    now = time.time()
+    row = conn.execute("SELECT value FROM meta WHERE key = 'pruned'").fetchone()
+    if row and now - row[0] < prune_interval:
+        return
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pruned', ?)", (now,))
+    missing = [path for (path,) in conn.execute("SELECT path FROM probes") if not os.path.isfile(path)]
+    if missing:
+        logger.info(f"removing {len(missing)} deleted files from the probe index")
+        conn.executemany("DELETE FROM probes WHERE path = ?", [(path,) for path in missing])
+
+
+def get_ffmpeg_binary() -> str:
+    # moviepy already resolves IMAGEIO_FFMPEG_EXE / ffmpeg_path for us
+    from moviepy.config import FFMPEG_BINARY
+
+    return FFMPEG_BINARY
+
+
+def get_ffprobe_binary() -> str:
+    ffprobe_path = config.app.get("ffprobe_path", "")
+    if ffprobe_path and os.path.isfile(ffprobe_path):
+        return ffprobe_path
+
+    # ffprobe usually lives next to ffmpeg
+    ffmpeg_binary = get_ffmpeg_binary()
+    candidate = os.path.join(
+        os.path.dirname(ffmpeg_binary),
+        os.path.basename(ffmpeg_binary).replace("ffmpeg", "ffprobe"),
+    )
+    if candidate != ffmpeg_binary and os.path.isfile(candidate):
+        return candidate
+
+    return shutil.which("ffprobe") or ""
+
+
+def _run(cmd: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+    )
+
+
+def _parse_rate(rate: str) -> float:
+    try:
+        if "/" in rate:
+            num, den = rate.split("/")
+            return float(num) / float(den) if float(den) else 0.0
+        return float(rate)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _probe_with_ffprobe(ffprobe: str, file_path: str, info: MediaInfo, with_keyframes: bool):
+    result = _run([
+        ffprobe, "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams", file_path,
+    ])
+    if result.returncode != 0:
+        raise ValueError(result.stderr.decode("utf-8", errors="ignore").strip())
+
+    data = json.loads(result.stdout.decode("utf-8", errors="ignore") or "{}")
+    info.duration = float(data.get("format", {}).get("duration") or 0)
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and not info.has_video:
+            info.codec = stream.get("codec_name", "")
+            info.pix_fmt = stream.get("pix_fmt", "")
+            info.width = int(stream.get("width") or 0)
+            info.height = int(stream.get("height") or 0)
+            info.fps = _parse_rate(stream.get("avg_frame_rate") or stream.get("r_frame_rate"))
+            info.time_base = stream.get("time_base", "")
+            if not info.duration:
+                info.duration = float(stream.get("duration") or 0)
+        elif stream.get("codec_type") == "audio":
+            info.audio_streams.append({
+                "codec": stream.get("codec_name", ""),
+                "sample_rate": int(stream.get("sample_rate") or 0),
+                "channels": int(stream.get("channels") or 0),
+            })
+
+    if with_keyframes and info.has_video:
+        result = _run([
+            ffprobe, "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+            "-count_frames", "-show_entries", "stream=nb_read_frames",
+            "-print_format", "json", file_path,
+        ])
+        streams = json.loads(result.stdout.decode("utf-8", errors="ignore") or "{}").get("streams", [])
+        if streams:
+            info.keyframes = int(streams[0].get("nb_read_frames") or 0)
+            info.keyframes_probed = True
+
+
+def _probe_with_ffmpeg(file_path: str, info: MediaInfo, with_keyframes: bool):
+    # ffprobe is not always shipped (e.g. imageio-ffmpeg), parse the output of `ffmpeg -i` instead
+    output = _run([get_ffmpeg_binary(), "-hide_banner", "-i", file_path]).stderr.decode("utf-8", errors="ignore")
+    if "Stream #" not in output:
+        raise ValueError(output.strip()[-500:])
+
+    duration = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", output)
+    if duration:
+        h, m, sec = duration.groups()
+        info.duration = int(h) * 3600 + int(m) * 60 + float(sec)
+
+    for line in re.findall(r"Stream #\d+:\d+.*?: (Video|Audio): (.*)", output):
+        kind, desc = line
+        if kind == "Video" and not info.has_video:
+            codec = re.match(r"(\w+)", desc)
+            pix_fmt = re.search(r"\), (\w+)[(,]", desc) or re.search(r", (\w+)[(,]", desc)
+            size = re.search(r", (\d+)x(\d+)", desc)
+            fps = re.search(r", ([\d.]+)k? fps", desc) or re.search(r", ([\d.]+)k? tbr", desc)
+            tbn = re.search(r", ([\d.]+k?) tbn", desc)
+            info.codec = codec.group(1) if codec else ""
+            info.pix_fmt = pix_fmt.group(1) if pix_fmt else ""
+            if size:
+                info.width, info.height = int(size.group(1)), int(size.group(2))
+            info.fps = float(fps.group(1)) if fps else 0.0
+            info.time_base = f"1/{tbn.group(1)}" if tbn else ""
+        elif kind == "Audio":
+            codec = re.match(r"(\w+)", desc)
+            sample_rate = re.search(r", (\d+) Hz", desc)
+            info.audio_streams.append({
+                "codec": codec.group(1) if codec else "",
+                "sample_rate": int(sample_rate.group(1)) if sample_rate else 0,
+                "channels": 1 if "mono" in desc else 2,
+            })
+
+    if with_keyframes and info.has_video:
+        result = _run([
+            get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-skip_frame", "nokey",
+            "-i", file_path, "-map", "0:v:0", "-f", "null", "-",
+        ])
+        frames = re.findall(r"frame=\s*(\d+)", result.stderr.decode("utf-8", errors="ignore"))
+        if frames:
+            info.keyframes = int(frames[-1])
+            info.keyframes_probed = True
+
+
+def probe_media(file_path: str, use_cache: bool = True, with_keyframes: bool = False) -> MediaInfo:
+    """
+    Read duration, fps, resolution, codec and audio streams of a media file,
+    and with `with_keyframes` the keyframe count, which decodes the keyframes.
+    Results are cached by path, size and mtime in a persistent index, so
+    probing an unchanged file again is a lookup. Temp files of tasks are not cached.
+    Raises ValueError if the file can not be read.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+
+    if use_cache:
+        try:
+            entry = _get_entry(file_path, stat)
+        except Exception as e:
+            logger.warning(f"failed to read probe index: {str(e)}")
+            entry = None
+        if entry and (entry.get("keyframes_probed") or not with_keyframes):
+            return MediaInfo(**{k: v for k, v in entry.items() if k in MediaInfo.__dataclass_fields__})
+
+    info = MediaInfo(path=file_path, size=stat.st_size, mtime=stat.st_mtime)
+    ffprobe = get_ffprobe_binary()
+    if ffprobe:
+        _probe_with_ffprobe(ffprobe, file_path, info, with_keyframes)
+    else:
+        _probe_with_ffmpeg(file_path, info, with_keyframes)
+    logger.debug(f"probed media: {file_path}, duration: {info.duration:.2f}s, {info.width}x{info.height}, {info.fps:.2f} fps, codec: {info.codec}")
+
+    if use_cache and _is_indexed(file_path):
+        try:
+            # keep extra data stored alongside the probe result of the same file
+            _put_entry(file_path, {**(entry or {}), **asdict(info)})
+        except Exception as e:
+            logger.warning(f"failed to save probe index: {str(e)}")
+
+    return info
+
+
+def get_cached_data(file_path: str, key: str):
+    """
+    Data stored with the probe result of a file by `set_cached_data`, e.g. the
+    scene boundaries. Returns None if nothing was stored or the file changed.
+    """
+    file_path = os.path.abspath(file_path)
+    entry = _get_entry(file_path, os.stat(file_path))
+    return entry.get(key) if entry else None
+
+
+def set_cached_data(file_path: str, key: str, value):
+    """Store data computed from a file alongside its probe result, it is dropped when the file changes."""
+    file_path = os.path.abspath(file_path)
+    # make sure an up to date probe result exists, extra data is only kept with it
+    probe_media(file_path)
+    entry = _get_entry(file_path, os.stat(file_path))
+    if entry is None:
+        return
+    entry[key] = value
+    try:
+        _put_entry(file_path, entry)
+    except Exception as e:
+        logger.warning(f"failed to save probe index: {str(e)}")
+
+
+def keyframe_times(file_path: str) -> List[float]:
+    """Timestamps of the keyframes in the first video stream, they are not cached."""
+    ffprobe = get_ffprobe_binary()
+    if ffprobe:
+        result = _run([
+            ffprobe, "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+            "-show_entries", "frame=pts_time", "-of", "csv=p=0", file_path,
+        ])
+        output = result.stdout.decode("utf-8", errors="ignore")
+        times = re.findall(r"^\s*([\d.]+)", output, re.MULTILINE)
+    else:
+        result = _run([
+            get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-skip_frame", "nokey",
+            "-i", file_path, "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-",
+        ])
+        output = result.stderr.decode("utf-8", errors="ignore")
+        times = re.findall(r"pts_time:\s*([\d.]+)", output)
+    if result.returncode != 0:
+        raise ValueError(output.strip()[-500:])
+    return sorted(float(t) for t in times)
+
+
+def get_duration(file_path: str) -> float:
+    return probe_media(file_path).duration
@@ -0,0 +1,489 @@
+import os
+import subprocess
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.services import probe
+from app.services.utils import video_effects
+
+
+def get_ffmpeg_binary() -> str:
+    return probe.get_ffmpeg_binary()
+
+
+# x264 settings of intermediate files (clips, combined videos), they are only
+# decoded again by the next stage. profile name: (preset, extra encoder arguments)
+INTERMEDIATE_PROFILES = {
+    # libx264 defaults, the same as the final video
+    "default": ("", []),
+    # fastest preset at high quality, a keyframe every half second
+    "fast": ("ultrafast", ["-crf", "16", "-g", "15"]),
+    # every frame is a keyframe, cutting and seeking never decodes other frames
+    "intra": ("ultrafast", ["-crf", "12", "-g", "1"]),
+    # no generational loss, large files
+    "lossless": ("ultrafast", ["-qp", "0"]),
+}
+
+
+def intermediate_encoding(profile: str) -> Tuple[str, List[str]]:
+    """Preset and encoder arguments of an intermediate profile, unknown profiles use the defaults."""
+    if profile not in INTERMEDIATE_PROFILES:
+        logger.warning(f"unknown intermediate profile: {profile}, using default")
+        profile = "default"
+    preset, encoder_params = INTERMEDIATE_PROFILES[profile]
+    return preset, list(encoder_params)
+
+
+def run_ffmpeg(args: List[str]):
+    cmd = [get_ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error", *args]
+    logger.debug(f"running ffmpeg: {' '.join(cmd)}")
+    result = subprocess.run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+    )
+    if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="ignore").strip()
+        raise RuntimeError(f"ffmpeg exited with code {result.returncode}: {stderr[-2000:]}")
+
+
+def get_stream_params(file_path: str) -> Optional[dict]:
+    """
+    Read the parameters of the first video stream that must match for clips to
+    be joined without re-encoding: codec, pixel format, resolution, fps and timebase.
+    """
+    # temp clips are short-lived, keep them out of the persistent probe index
+    try:
+        info = probe.probe_media(file_path, use_cache=False)
+    except Exception as e:
+        logger.debug(f"failed to probe {file_path}: {str(e)}")
+        return None
+    if not (info.has_video and info.codec and info.fps and info.time_base):
+        return None
+
+    return {
+        "codec": info.codec,
+        "pix_fmt": info.pix_fmt,
+        "width": info.width,
+        "height": info.height,
+        "fps": info.fps,
+        "time_base": info.time_base,
+    }
+
+
+def can_concat_copy(files: List[str]) -> bool:
+    """Whether all files share the stream parameters required by the concat demuxer."""
+    reference = None
+    for file in files:
+        params = get_stream_params(file)
+        if params is None:
+            return False
+        if reference is None:
+            reference = params
+        elif params != reference:
+            logger.debug(f"stream parameters differ: {file} {params} != {reference}")
+            return False
+    return reference is not None
+
+
+def concat_copy(files: List[str], output_file: str, audio_file: str = "", duration: float = 0.0) -> str:
+    """
+    Join files with the concat demuxer, streams are copied without re-encoding.
+    With `audio_file` the audio stream is muxed in as it is, `duration` cuts
+    the output when the audio is longer than the video.
+    """
+    list_file = f"{output_file}.concat.txt"
+    with open(list_file, "w", encoding="utf-8") as f:
+        for file in files:
+            path = os.path.abspath(file).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+
+    audio_input = ["-i", audio_file] if audio_file else []
+    audio_map = ["-map", "1:a:0"] if audio_file else []
+    try:
+        run_ffmpeg(
+            [
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                list_file,
+                *audio_input,
+                "-map",
+                "0:v:0",
+                *audio_map,
+                "-c",
+                "copy",
+                *(["-t", f"{duration:.3f}"] if duration > 0 else []),
+                "-movflags",
+                "+faststart",
+                output_file,
+            ]
+        )
+    finally:
+        try:
+            os.remove(list_file)
+        except Exception:
+            pass
+
+    logger.info(f"joined {len(files)} clips without re-encoding: {output_file}")
+    return output_file
+
+
+def mix_audio(
+    voice_file: str,
+    output_file: str,
+    duration: float,
+    voice_volume: float = 1.0,
+    bgm_file: str = "",
+    bgm_volume: float = 0.2,
+    fade_out: float = 3.0,
+    codec: str = "aac",
+) -> str:
+    """
+    Mix the voice and the background music into one audio track of exactly
+    `duration` seconds. The music is looped by the demuxer and faded out at the
+    end, the voice is padded with silence. Everything runs in one ffmpeg
+    filtergraph, the track is encoded once and muxed into videos as it is.
+    """
+    input_args = ["-i", voice_file]
+    graph = [f"[0:a]volume={voice_volume},apad[voice]"]
+    if bgm_file:
+        input_args += ["-stream_loop", "-1", "-i", bgm_file]
+        fade_start = max(duration - fade_out, 0.0)
+        graph.append(f"[1:a]volume={bgm_volume},afade=t=out:st={fade_start:.3f}:d={fade_out}[bgm]")
+        graph.append("[voice][bgm]amix=inputs=2:duration=first:normalize=0[aout]")
+    else:
+        graph.append("[voice]anull[aout]")
+
+    run_ffmpeg(
+        [
+            *input_args,
+            "-filter_complex",
+            ";".join(graph),
+            "-map",
+            "[aout]",
+            "-vn",
+            "-c:a",
+            codec,
+            "-ar",
+            "44100",
+            "-ac",
+            "2",
+            "-t",
+            f"{duration:.3f}",
+            output_file,
+        ]
+    )
+    logger.info(f"mixed audio track: {output_file}, {duration:.2f}s, bgm: {bgm_file or 'none'}")
+    return output_file
+
+
+def build_fit_graph(input_label: str, output_label: str, width: int, height: int, fill_mode: str = "black") -> str:
+    """
+    Scale a stream to fit into `width` x `height`. The remaining area is padded
+    black, or with fill_mode "blur" filled with a blurred copy of the frame that
+    is computed at 1/8 of the output resolution.
+    """
+    fit = f"scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2"
+    if fill_mode != "blur":
+        return f"[{input_label}]{fit},pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black,setsar=1[{output_label}]"
+
+    small_width = max(width // 16 * 2, 8)
+    small_height = max(height // 16 * 2, 8)
+    return ";".join([
+        f"[{input_label}]split=2[{output_label}bg][{output_label}fg]",
+        f"[{output_label}bg]scale={small_width}:{small_height}:force_original_aspect_ratio=increase,"
+        f"crop={small_width}:{small_height},boxblur=2:1,scale={width}:{height},setsar=1[{output_label}bgs]",
+        f"[{output_label}fg]{fit},setsar=1[{output_label}fgs]",
+        f"[{output_label}bgs][{output_label}fgs]overlay=(W-w)/2:(H-h)/2[{output_label}]",
+    ])
+
+
+def build_clip_filters(clip, width: int, height: int, fps: int) -> List[str]:
+    """
+    Filter chain for a single timeline clip after it is scaled to the target
+    resolution: normalize fps/timebase and apply the clip's effect plan.
+    Raises ValueError if the effect plan can not be expressed as ffmpeg filters.
+    """
+    filters = [f"fps={fps}"]
+    effects = getattr(clip, "effects", None) or []
+    effect_filters = video_effects.effect_plan_to_ffmpeg(
+        effects, clip.duration, (width, height), fps
+    )
+    if effect_filters is None:
+        raise ValueError(f"effects can not be rendered natively: {effects}")
+    filters.extend(effect_filters)
+    filters.extend(["format=yuv420p", "settb=AVTB"])
+    return filters
+
+
+def needs_fill(clip, width: int, height: int) -> bool:
+    # clips without a known size are treated as mismatched
+    if not getattr(clip, "width", None) or not getattr(clip, "height", None):
+        return True
+    return abs(clip.width * height - clip.height * width) > max(width, height)
+
+
+def build_timeline(
+    clips: List,
+    width: int,
+    height: int,
+    fps: int = 30,
+    crossfade: float = 0.0,
+    fill_mode: str = "black",
+) -> Tuple[List[str], str]:
+    """
+    Build the ffmpeg input arguments and the filtergraph that renders all clips
+    as one timeline. Each clip needs `file_path` and `duration`, and may have
+    `start_time`, `width`/`height` of the source and an `effects` plan.
+    """
+    input_args = []
+    graph = []
+    for i, clip in enumerate(clips):
+        if clip.start_time:
+            input_args += ["-ss", f"{clip.start_time:.3f}"]
+        input_args += ["-t", f"{clip.duration:.3f}", "-i", clip.file_path]
+        chain = ",".join(build_clip_filters(clip, width, height, fps))
+        clip_fill_mode = fill_mode if needs_fill(clip, width, height) else "black"
+        graph.append(f"[{i}:v]setpts=PTS-STARTPTS[s{i}]")
+        graph.append(build_fit_graph(f"s{i}", f"f{i}", width, height, clip_fill_mode))
+        graph.append(f"[f{i}]{chain}[v{i}]")
+
+    if len(clips) == 1:
+        graph.append("[v0]null[vout]")
+    elif crossfade > 0:
+        # chain xfade filters, every transition overlaps two clips by `crossfade` seconds
+        offset = 0.0
+        last = "v0"
+        for i, clip in enumerate(clips[1:], 1):
+            offset += clips[i - 1].duration - crossfade
+            out = "vout" if i == len(clips) - 1 else f"x{i}"
+            graph.append(
+                f"[{last}][v{i}]xfade=transition=fade:duration={crossfade}:offset={offset:.3f}[{out}]"
+            )
+            last = out
+    else:
+        labels = "".join(f"[v{i}]" for i in range(len(clips)))
+        graph.append(f"{labels}concat=n={len(clips)}:v=1:a=0[vout]")
+
+    return input_args, ";\n".join(graph)
+
+
+def render_timeline(
+    output_file: str,
+    clips: List,
+    width: int,
+    height: int,
+    fps: int = 30,
+    crossfade: float = 0.0,
+    codec: str = "libx264",
+    threads: int = 2,
+    preset: str = "",
+    fill_mode: str = "black",
+    encoder_params: List[str] = None,
+) -> str:
+    """Render all clips into `output_file` with a single ffmpeg encode."""
+    if not clips:
+        raise ValueError("no clips to render")
+
+    input_args, graph = build_timeline(clips, width, height, fps, crossfade, fill_mode)
+
+    # the filtergraph grows with the number of clips, pass it through a file
+    # to stay below the command line length limit on Windows
+    graph_file = f"{output_file}.filtergraph.txt"
+    with open(graph_file, "w", encoding="utf-8") as f:
+        f.write(graph)
+
+    try:
+        run_ffmpeg(
+            [
+                *input_args,
+                "-filter_complex_script",
+                graph_file,
+                "-map",
+                "[vout]",
+                "-an",
+                "-c:v",
+                codec,
+                *(["-preset", preset] if preset else []),
+                *(encoder_params or []),
+                "-pix_fmt",
+                "yuv420p",
+                "-r",
+                str(fps),
+                "-threads",
+                str(threads or 2),
+                output_file,
+            ]
+        )
+    finally:
+        try:
+            os.remove(graph_file)
+        except Exception:
+            pass
+
+    logger.info(f"rendered {len(clips)} clips in a single pass: {output_file}")
+    return output_file
+
+
+class TimelineStream:
+    """
+    Render clips as one timeline and read the frames from an ffmpeg pipe
+    instead of a combined file, the next stage encodes them directly. With
+    `tee_file` the timeline is also encoded into that file by the same ffmpeg
+    process. Frames can only be read forward, use `get_frame` as the frame
+    function of a moviepy VideoClip that is written once.
+    """
+
+    def __init__(
+        self,
+        clips: List,
+        width: int,
+        height: int,
+        fps: int = 30,
+        crossfade: float = 0.0,
+        fill_mode: str = "black",
+        tee_file: str = "",
+        codec: str = "libx264",
+        threads: int = 2,
+        preset: str = "",
+        encoder_params: List[str] = None,
+        graph_dir: str = "",
+    ):
+        if not clips:
+            raise ValueError("no clips to render")
+
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.tee_file = tee_file
+        self.duration = sum(clip.duration for clip in clips) - crossfade * (len(clips) - 1)
+        self._frame_size = width * height * 3
+        self._frame = None
+        self._index = -1
+
+        input_args, graph = build_timeline(clips, width, height, fps, crossfade, fill_mode)
+        output_args = []
+        if tee_file:
+            graph += ";\n[vout]split=2[vfile][vpipe]"
+            output_args = [
+                "-map",
+                "[vfile]",
+                "-an",
+                "-c:v",
+                codec,
+                *(["-preset", preset] if preset else []),
+                *(encoder_params or []),
+                "-pix_fmt",
+                "yuv420p",
+                "-r",
+                str(fps),
+                "-threads",
+                str(threads or 2),
+                tee_file,
+            ]
+        pipe_label = "[vpipe]" if tee_file else "[vout]"
+
+        graph_dir = graph_dir or (os.path.dirname(tee_file) if tee_file else "")
+        self._graph_file = os.path.join(graph_dir or ".", f"stream-{os.getpid()}-{id(self)}.filtergraph.txt")
+        with open(self._graph_file, "w", encoding="utf-8") as f:
+            f.write(graph)
+        # stderr goes to a file, a pipe nobody reads while frames are streamed
+        # would block ffmpeg once it is full
+        self._log = tempfile.TemporaryFile(dir=graph_dir or None)
+
+        cmd = [
+            get_ffmpeg_binary(),
+            "-y",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            *input_args,
+            "-filter_complex_script",
+            self._graph_file,
+            *output_args,
+            "-map",
+            pipe_label,
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-r",
+            str(fps),
+            "pipe:1",
+        ]
+        logger.debug(f"streaming ffmpeg: {' '.join(cmd)}")
+        try:
+            self._process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=self._log,
+                stdin=subprocess.DEVNULL,
+                bufsize=self._frame_size,
+            )
+        except Exception:
+            self._log.close()
+            os.remove(self._graph_file)
+            raise
+        logger.info(f"streaming {len(clips)} clips, {self.duration:.2f}s")
+
+    def _read_frame(self):
+        data = self._process.stdout.read(self._frame_size)
+        if len(data) < self._frame_size:
+            return None
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def get_frame(self, t: float) -> np.ndarray:
+        index = int(round(t * self.fps))
+        if index < self._index:
+            raise ValueError(f"timeline stream cannot seek backwards: frame {index} after {self._index}")
+        while self._index < index:
+            frame = self._read_frame()
+            if frame is None:
+                # the last frame is repeated when moviepy rounds the duration up
+                if self._frame is None:
+                    raise RuntimeError(f"timeline stream ended without frames: {self._stderr()}")
+                break
+            self._frame = frame
+            self._index += 1
+        return self._frame
+
+    def _stderr(self) -> str:
+        self._process.wait()
+        self._log.seek(0)
+        return self._log.read().decode("utf-8", errors="ignore").strip()[-2000:]
+
+    def close(self, abort: bool = False):
+        """
+        Wait for ffmpeg, the tee file is only complete after the whole timeline
+        was read. With `abort` ffmpeg is stopped and the tee file removed, for
+        a render that failed. Closing twice does nothing.
+        """
+        if self._process is None:
+            return
+        try:
+            if abort:
+                self._process.kill()
+            elif self.tee_file:
+                while self._process.stdout.read(self._frame_size):
+                    pass
+            self._process.stdout.close()
+            stderr = self._stderr()
+            if self.tee_file and (abort or self._process.returncode != 0):
+                if not abort:
+                    logger.warning(f"failed to write {self.tee_file}: {stderr}")
+                if os.path.exists(self.tee_file):
+                    os.remove(self.tee_file)
+        finally:
+            self._process = None
+            self._log.close()
+            try:
+                os.remove(self._graph_file)
+            except Exception:
+                pass
@@ -0,0 +1,128 @@
+import subprocess
+from typing import List, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.config import config
+from app.services import probe
+
+# frames are compared at a few frames per second and a thumbnail resolution,
+# that is enough to find hard cuts and keeps detection far below real time
+sample_fps = 4
+sample_width = 64
+sample_height = 36
+histogram_bins = 16
+# scenes shorter than this are flashes or fast cuts, they are merged into the previous scene
+min_scene_duration = 0.5
+
+
+def is_enabled() -> bool:
+    return bool(config.app.get("scene_detection", True))
+
+
+def get_threshold() -> float:
+    """Histogram distance in [0, 1] between two sampled frames that counts as a cut."""
+    return float(config.app.get("scene_threshold", 0.35))
+
+
+def frame_histograms(frames: np.ndarray) -> np.ndarray:
+    """Normalized per-channel color histograms of `frames` (n, h, w, 3), one row per frame."""
+    n = frames.shape[0]
+    bins = frames.reshape(n, -1, 3).astype(np.int64) // (256 // histogram_bins)
+    # one bincount for all frames and channels: bin + channel offset + frame offset
+    offsets = np.arange(3) * histogram_bins + np.arange(n)[:, None, None] * 3 * histogram_bins
+    counts = np.bincount((bins + offsets).ravel(), minlength=n * 3 * histogram_bins)
+    return counts.reshape(n, 3 * histogram_bins) / (frames.shape[1] * frames.shape[2])
+
+
+def find_cuts(histograms: np.ndarray, frame_rate: float, threshold: float) -> List[float]:
+    """Times of the frames whose histogram differs from the previous frame by more than `threshold`."""
+    if len(histograms) < 2:
+        return []
+    # the L1 distance of two normalized histograms is at most 2 per channel
+    distances = np.abs(np.diff(histograms, axis=0)).sum(axis=1) / 6
+    cuts = []
+    for index in np.flatnonzero(distances > threshold):
+        t = round((index + 1) / frame_rate, 3)
+        if t - (cuts[-1] if cuts else 0.0) >= min_scene_duration:
+            cuts.append(t)
+    return cuts
+
+
+def detect_scenes(file_path: str, threshold: float = None) -> List[float]:
+    """
+    Find the scene boundaries of a video: times in seconds where the picture
+    changes abruptly. Frames are decoded at `sample_fps` and thumbnail size,
+    consecutive frames are compared by their color histograms.
+    Raises ValueError if the video can not be decoded.
+    """
+    threshold = get_threshold() if threshold is None else threshold
+    cmd = [
+        probe.get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-nostdin", "-i", file_path,
+        "-map", "0:v:0", "-an",
+        "-vf", f"fps={sample_fps},scale={sample_width}:{sample_height}:flags=fast_bilinear",
+        "-pix_fmt", "rgb24", "-f", "rawvideo", "pipe:1",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    if result.returncode != 0:
+        raise ValueError(result.stderr.decode("utf-8", errors="ignore").strip()[-500:])
+
+    frame_size = sample_width * sample_height * 3
+    frame_count = len(result.stdout) // frame_size
+    frames = np.frombuffer(result.stdout[: frame_count * frame_size], dtype=np.uint8)
+    frames = frames.reshape(frame_count, sample_height, sample_width, 3)
+    cuts = find_cuts(frame_histograms(frames), sample_fps, threshold)
+    logger.debug(f"detected {len(cuts)} scene cuts in {file_path}: {cuts}")
+    return cuts
+
+
+def get_scenes(file_path: str) -> List[float]:
+    """
+    Scene boundaries of a video, detected once and cached alongside its probe
+    result. Returns no boundaries if detection is disabled or fails.
+    """
+    if not is_enabled():
+        return []
+    threshold = get_threshold()
+    cached = probe.get_cached_data(file_path, "scenes")
+    if cached and cached.get("threshold") == threshold and cached.get("sample_fps") == sample_fps:
+        return cached["cuts"]
+
+    try:
+        cuts = detect_scenes(file_path, threshold)
+    except Exception as e:
+        logger.warning(f"failed to detect scenes, cutting at fixed intervals: {file_path}, {str(e)}")
+        return []
+    probe.set_cached_data(file_path, "scenes", {"threshold": threshold, "sample_fps": sample_fps, "cuts": cuts})
+    return cuts
+
+
+def plan_cuts(
+    duration: float,
+    scene_cuts: List[float],
+    max_clip_duration: float,
+    min_clip_duration: float = None,
+    gap: float = 1 / sample_fps,
+) -> List[Tuple[float, float]]:
+    """
+    Split a video into (start, end) clips of at most `max_clip_duration`
+    seconds that never cross a scene boundary. A scene is cut into full-length
+    clips, the rest of the scene is kept as a shorter clip if it is at least
+    `min_clip_duration` long, half the maximum by default. Boundaries are only
+    known to one sampled frame, scenes end `gap` seconds before the next one.
+    """
+    if min_clip_duration is None:
+        min_clip_duration = max_clip_duration / 2
+    cuts = [t for t in scene_cuts if 0 < t < duration]
+    starts = [0.0] + cuts
+    ends = [t - gap for t in cuts] + [duration]
+    clips = []
+    for scene_start, scene_end in zip(starts, ends):
+        start = scene_start
+        while scene_end - start >= max_clip_duration:
+            clips.append((round(start, 3), round(start + max_clip_duration, 3)))
+            start += max_clip_duration
+        if scene_end - start >= min_clip_duration:
+            clips.append((round(start, 3), round(scene_end, 3)))
+    return clips
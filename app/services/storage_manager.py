@@ -0,0 +1,287 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+# managed storage directories and the config key of their size budget (MB)
+caches = {
+    "cache_videos": ("cache_videos_max_size_mb", 10240),
+    "generated_materials": ("generated_materials_max_size_mb", 2048),
+    "cache_subtitles": ("subtitle_cache_max_size_mb", 256),
+    # 0 disables the clip cache, see clip_cache.is_enabled
+    "cache_clips": ("clip_cache_max_size_mb", 2048),
+}
+# files changed or used within this many seconds are never evicted, they may
+# still be written or about to be used by the task that created them
+grace_period = 300
+# temp files are renamed when complete and download claims are removed when
+# the download ends, neither is evicted. Partial downloads (.part) are kept to
+# resume them. Any of them untouched for stale_age seconds was abandoned by a
+# crashed or cancelled task and is removed whatever the budget
+stale_age = 24 * 3600
+_skipped_names = ("materials_metadata.json",)
+_writing_suffixes = (".tmp", ".lock")
+_abandoned_suffixes = (".tmp", ".lock", ".part")
+
+# last access time of cached files, keyed by absolute path. The mtime is not
+# touched on a hit: probe results and fingerprints are keyed by it
+_access: Optional[Dict[str, float]] = None
+_access_dirty = False
+_lock = threading.Lock()
+# running tasks pin the files they use, pinned files are never evicted
+_pins: Dict[str, int] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+
+_worker: Optional[threading.Thread] = None
+_wakeup = threading.Event()
+
+
+def cache_dir(name: str) -> str:
+    return utils.storage_dir(name)
+
+
+def max_size(name: str) -> int:
+    """Byte budget of a managed directory, 0 means unlimited."""
+    key, default = caches[name]
+    return int(float(config.app.get(key, default) or 0) * 1024 * 1024)
+
+
+def access_file() -> str:
+    return os.path.join(utils.storage_dir(create=True), "storage_access.json")
+
+
+def _cache_name(path: str) -> str:
+    directory = os.path.dirname(os.path.abspath(path))
+    for name in caches:
+        if directory == os.path.abspath(cache_dir(name)):
+            return name
+    return ""
+
+
+def _load_access() -> Dict[str, float]:
+    global _access
+    if _access is None:
+        _access = {}
+        try:
+            if os.path.isfile(access_file()):
+                with open(access_file(), "r", encoding="utf-8") as f:
+                    _access = json.load(f)
+        except Exception as e:
+            logger.warning(f"failed to load storage access times, starting anew: {str(e)}")
+            _access = {}
+    return _access
+
+
+def _save_access():
+    global _access_dirty
+    with _lock:
+        if not _access_dirty:
+            return
+        data = dict(_load_access())
+        _access_dirty = False
+    # write to a temp file first, a crash must not leave a truncated file behind
+    temp_file = f"{access_file()}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_file, access_file())
+    except Exception as e:
+        logger.warning(f"failed to save storage access times: {str(e)}")
+
+
+def _count(name: str, counter: str, value: int = 1):
+    counters = _stats.setdefault(name, {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0})
+    counters[counter] += value
+
+
+def touch(paths: Iterable[str], hit: bool = True):
+    """
+    Record that cached files were used. A hit is a file that was found in the
+    cache, a miss one that had to be downloaded or generated first.
+    """
+    global _access_dirty
+    now = time.time()
+    with _lock:
+        access = _load_access()
+        for path in paths:
+            name = _cache_name(path)
+            if not name:
+                continue
+            access[os.path.abspath(path)] = now
+            _count(name, "hits" if hit else "misses")
+            _access_dirty = True
+
+
+def pin(paths: Iterable[str]):
+    with _lock:
+        for path in paths:
+            path = os.path.abspath(path)
+            _pins[path] = _pins.get(path, 0) + 1
+
+
+def unpin(paths: Iterable[str]):
+    with _lock:
+        for path in paths:
+            path = os.path.abspath(path)
+            if _pins.get(path, 0) > 1:
+                _pins[path] -= 1
+            else:
+                _pins.pop(path, None)
+
+
+@contextmanager
+def pinned(paths: List[str]):
+    """Keep files from being evicted while a task uses them."""
+    paths = list(paths or [])
+    pin(paths)
+    try:
+        yield paths
+    finally:
+        unpin(paths)
+
+
+def is_pinned(path: str) -> bool:
+    with _lock:
+        return os.path.abspath(path) in _pins
+
+
+def get_stats() -> Dict[str, dict]:
+    """Hit, miss and eviction counters, size and budget of every managed directory."""
+    stats = {}
+    for name in caches:
+        d = cache_dir(name)
+        size = 0
+        if os.path.isdir(d):
+            for entry in os.scandir(d):
+                if entry.is_file(follow_symlinks=False):
+                    size += entry.stat().st_size
+        with _lock:
+            counters = dict(_stats.get(name) or {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0})
+        stats[name] = {**counters, "size": size, "max_size": max_size(name)}
+    return stats
+
+
+def remove_abandoned(d: str, max_age: float = None) -> int:
+    """Remove temp files, download claims and partial downloads older than `max_age` seconds."""
+    max_age = stale_age if max_age is None else max_age
+    now = time.time()
+    removed = 0
+    for entry in os.scandir(d):
+        if not entry.is_file(follow_symlinks=False) or not entry.name.endswith(_abandoned_suffixes):
+            continue
+        try:
+            if now - entry.stat().st_mtime <= max_age:
+                continue
+            os.remove(entry.path)
+        except OSError:
+            continue
+        removed += 1
+        logger.debug(f"removed abandoned file: {entry.path}")
+    return removed
+
+
+def evict(name: str, budget: int = None) -> int:
+    """
+    Remove the least recently used files of a managed directory until it fits
+    its budget. Pinned files, files being written and files used within the
+    grace period are kept. Returns the number of bytes freed.
+    """
+    global _access_dirty
+    budget = max_size(name) if budget is None else budget
+    d = cache_dir(name)
+    if not os.path.isdir(d):
+        return 0
+    remove_abandoned(d)
+    if budget <= 0:
+        return 0
+
+    now = time.time()
+    entries = []
+    total_size = 0
+    with _lock:
+        access = dict(_load_access())
+    files = set()
+    for entry in os.scandir(d):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        total_size += stat.st_size
+        if entry.name in _skipped_names or entry.name.endswith(_writing_suffixes):
+            continue
+        path = os.path.abspath(entry.path)
+        files.add(path)
+        last_access = max(stat.st_mtime, access.get(path, 0))
+        if now - last_access < grace_period:
+            continue
+        entries.append((last_access, stat.st_size, path))
+
+    # files removed by someone else are forgotten
+    prefix = os.path.abspath(d) + os.sep
+    with _lock:
+        access = _load_access()
+        for path in [p for p in access if p.startswith(prefix) and p not in files]:
+            access.pop(path, None)
+            _access_dirty = True
+
+    freed = 0
+    # least recently used first
+    for _, size, path in sorted(entries):
+        if total_size <= budget:
+            break
+        with _lock:
+            # pins are checked under the lock, a task pinning the file now either
+            # sees it removed or keeps it
+            if path in _pins:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            _load_access().pop(path, None)
+            _count(name, "evictions")
+            _count(name, "evicted_bytes", size)
+        total_size -= size
+        freed += size
+        logger.debug(f"evicted {name} file: {path}")
+
+    if freed:
+        with _lock:
+            _access_dirty = True
+        logger.info(f"evicted {freed / 1024 / 1024:.1f} MB from {name}, {total_size / 1024 / 1024:.1f} MB left")
+    return freed
+
+
+def evict_all():
+    for name in caches:
+        try:
+            evict(name)
+        except Exception as e:
+            logger.warning(f"failed to evict {name}: {str(e)}")
+    _save_access()
+
+
+def _run_worker():
+    while True:
+        _wakeup.wait()
+        _wakeup.clear()
+        evict_all()
+
+
+def schedule_eviction():
+    """Check the budgets in the background, requests while a pass runs are coalesced into the next one."""
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name="storage-eviction", daemon=True)
+            _worker.start()
+    _wakeup.set()
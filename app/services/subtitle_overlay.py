@@ -0,0 +1,151 @@
+import bisect
+import functools
+import hashlib
+import itertools
+import json
+import os
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from loguru import logger
+from moviepy import TextClip
+from PIL import Image
+
+from app.services import storage_manager
+from app.utils import utils
+
+# decoded lines kept in memory, a task uses each line once per video
+sprite_cache_size = 256
+
+
+@dataclass
+class SubtitleSprite:
+    start: float
+    end: float
+    x: int
+    y: int
+    image: np.ndarray  # RGBA, uint8
+
+
+def cache_dir() -> str:
+    d = utils.storage_dir("cache_subtitles")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def rasterize_text(
+    text: str,
+    font_path: str,
+    font_size: int,
+    color,
+    bg_color,
+    stroke_color,
+    stroke_width: int,
+    max_width: float,
+) -> np.ndarray:
+    """
+    Rasterize a subtitle line into an RGBA image. Images are cached in memory and
+    under storage/cache_subtitles, a line is only drawn once for the same style.
+    The directory is kept within its budget by storage_manager.
+    """
+    spec = json.dumps(
+        [text, font_path, font_size, color, bg_color, stroke_color, stroke_width, int(max_width)],
+        ensure_ascii=False,
+    )
+    return _get_sprite(spec)
+
+
+@functools.lru_cache(maxsize=sprite_cache_size)
+def _get_sprite(spec: str) -> np.ndarray:
+    text, font_path, font_size, color, bg_color, stroke_color, stroke_width, _ = json.loads(spec)
+    key = hashlib.md5(spec.encode("utf-8")).hexdigest()
+    sprite_file = os.path.join(cache_dir(), f"sub-{key}.png")
+    if os.path.isfile(sprite_file):
+        try:
+            image = np.array(Image.open(sprite_file).convert("RGBA"))
+            storage_manager.touch([sprite_file])
+            return image
+        except Exception as e:
+            logger.warning(f"failed to load cached subtitle image: {sprite_file}, {str(e)}")
+
+    clip = TextClip(
+        text=text,
+        font=font_path,
+        font_size=font_size,
+        color=color,
+        bg_color=bg_color,
+        stroke_color=stroke_color,
+        stroke_width=stroke_width,
+    )
+    rgb = clip.get_frame(0)
+    alpha = clip.mask.get_frame(0) if clip.mask is not None else np.ones(rgb.shape[:2])
+    image = np.dstack([rgb, np.round(alpha * 255)]).astype(np.uint8)
+    clip.close()
+
+    try:
+        temp_file = f"{sprite_file}.{os.getpid()}.tmp"
+        Image.fromarray(image, "RGBA").save(temp_file, format="PNG")
+        os.replace(temp_file, sprite_file)
+        storage_manager.touch([sprite_file], hit=False)
+        storage_manager.schedule_eviction()
+    except Exception as e:
+        logger.warning(f"failed to cache subtitle image: {sprite_file}, {str(e)}")
+
+    return image
+
+
+class SubtitleOverlay:
+    """
+    Burn subtitle sprites into video frames. Each frame looks up the active
+    sprite and blends only its area, the cost does not grow with the number of
+    subtitle lines. Use it with `clip.transform(overlay)`.
+    """
+
+    def __init__(self, sprites: List[SubtitleSprite]):
+        self.sprites = sorted(sprites, key=lambda s: s.start)
+        self.starts = [s.start for s in self.sprites]
+        # the latest end time of all sprites up to an index, lets lookups stop early
+        self.max_ends = list(itertools.accumulate((s.end for s in self.sprites), max))
+        self._blend_cache = {}
+
+    def _blend_data(self, index: int):
+        if index not in self._blend_cache:
+            if len(self._blend_cache) >= 4:
+                self._blend_cache.clear()
+            image = self.sprites[index].image
+            alpha = image[:, :, 3:].astype(np.float32) / 255
+            self._blend_cache[index] = (image[:, :, :3].astype(np.float32) * alpha, 1 - alpha)
+        return self._blend_cache[index]
+
+    def active_sprites(self, t: float) -> List[int]:
+        indexes = []
+        i = bisect.bisect_right(self.starts, t) - 1
+        while i >= 0 and self.max_ends[i] > t:
+            if self.sprites[i].end > t:
+                indexes.append(i)
+            i -= 1
+        return indexes[::-1]
+
+    def __call__(self, get_frame, t):
+        frame = get_frame(t)
+        indexes = self.active_sprites(t)
+        if not indexes:
+            return frame
+
+        frame = frame.copy()
+        frame_h, frame_w = frame.shape[:2]
+        for index in indexes:
+            sprite = self.sprites[index]
+            premultiplied, inverse_alpha = self._blend_data(index)
+            h, w = premultiplied.shape[:2]
+            # clip the sprite to the frame
+            x0, y0 = max(sprite.x, 0), max(sprite.y, 0)
+            x1, y1 = min(sprite.x + w, frame_w), min(sprite.y + h, frame_h)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            sx, sy = x0 - sprite.x, y0 - sprite.y
+            region = frame[y0:y1, x0:x1].astype(np.float32)
+            region = region * inverse_alpha[sy:sy + y1 - y0, sx:sx + x1 - x0] + premultiplied[sy:sy + y1 - y0, sx:sx + x1 - x0]
+            frame[y0:y1, x0:x1] = np.clip(np.round(region), 0, 255).astype(np.uint8)
+        return frame
@@ -1,5 +1,7 @@
+import json
 import math
 import os.path
+import random
 import re
 from os import path
 import asyncio
@@ -8,8 +10,8 @@ from loguru import logger
 
 from app.config import config
 from app.models import const
-from app.models.schema import VideoConcatMode, VideoParams
-from app.services import llm, material, subtitle, video, voice
+from app.models.schema import MaterialInfo, RenderMode, VideoConcatMode, VideoParams
+from app.services import llm, material, probe, storage_manager, subtitle, video, voice
 from app.services import state as sm
 from app.utils import utils
 
@@ -59,13 +61,15 @@ def generate_terms(task_id, params, video_script):
     return video_terms
 
 
-def save_script_data(task_id, video_script, video_terms, params):
+def save_script_data(task_id, video_script, video_terms, params, materials=None):
     script_file = path.join(utils.task_dir(task_id), "script.json")
     script_data = {
         "script": video_script,
         "search_terms": video_terms,
         "params": params,
     }
+    if materials:
+        script_data["materials"] = materials
 
     with open(script_file, "w", encoding="utf-8") as f:
         f.write(utils.to_json(script_data))
@@ -163,10 +167,17 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
                 logger.error("AI素材生成失败，请检查配置和API密钥")
                 return None
             
-            # 返回生成的素材路径
-            ai_materials = [material.image_path for material in result.materials]
+            # 生成的图片经过图片片段阶段转为带缩放效果的视频片段
+            ai_materials = [MaterialInfo(provider="ai_generated", url=material.image_path) for material in result.materials]
             logger.info(f"AI素材生成成功：共生成 {len(ai_materials)} 个素材文件")
-            return ai_materials
+            ai_materials = video.preprocess_video(
+                materials=ai_materials, clip_duration=params.video_clip_duration
+            )
+            if not ai_materials:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+                logger.error("AI素材转换为视频片段失败，没有可用的素材")
+                return None
+            return [material_info.url for material_info in ai_materials]
             
         except Exception as e:
             logger.error(f"AI素材生成过程中发生错误: {str(e)}")
@@ -196,54 +207,148 @@ def generate_final_videos(
     task_id, params, downloaded_videos, audio_file, subtitle_path
 ):
     final_video_paths = []
-    combined_video_paths = []
+    # drafts are kept next to the final videos, finalizing a task does not overwrite them
+    prefix = "draft-" if video.is_draft(params.render_mode) else ""
+    combined_video_paths = [
+        path.join(utils.task_dir(task_id), f"{prefix}combined-{i + 1}.mp4")
+        for i in range(params.video_count)
+    ]
     video_concat_mode = (
         params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
     )
     video_transition_mode = params.video_transition_mode
 
-    _progress = 50
-    for i in range(params.video_count):
-        index = i + 1
-        combined_video_path = path.join(
-            utils.task_dir(task_id), f"combined-{index}.mp4"
-        )
-        logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
-        
-        video.combine_videos(
-            combined_video_path=combined_video_path,
-            video_paths=downloaded_videos,
-            audio_file=audio_file,
-            video_aspect=params.video_aspect,
-            video_concat_mode=video_concat_mode,
-            video_transition_mode=video_transition_mode,
-            max_clip_duration=params.video_clip_duration,
-            threads=params.n_threads,
-            video_subject=params.video_subject,
-            enable_professional_effects=params.enable_professional_effects,
-            effect_preset=params.effect_preset,
-        )
+    if config.app.get("stream_render", False):
+        try:
+            return generate_streamed_videos(
+                task_id, params, downloaded_videos, audio_file, subtitle_path, combined_video_paths, prefix
+            )
+        except Exception as e:
+            logger.warning(f"streamed rendering failed, rendering combined videos: {str(e)}")
+
+    # all variants are planned together, the clips they share are rendered once
+    logger.info(f"\n\n## combining videos: {len(combined_video_paths)}")
+    video.combine_video_variants(
+        combined_video_paths=combined_video_paths,
+        video_paths=downloaded_videos,
+        audio_file=audio_file,
+        video_aspect=params.video_aspect,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        max_clip_duration=params.video_clip_duration,
+        threads=params.n_threads,
+        video_subject=params.video_subject,
+        enable_professional_effects=params.enable_professional_effects,
+        effect_preset=params.effect_preset,
+        seed=params.video_seed,
+        render_mode=params.render_mode,
+    )
+
+    _progress = 75
+    sm.state.update_task(task_id, progress=_progress)
+
+    duration = max(probe.get_duration(p) for p in combined_video_paths)
+    audio_track = prepare_audio_track(task_id, params, audio_file, duration, prefix)
+    try:
+        for i, combined_video_path in enumerate(combined_video_paths):
+            index = i + 1
+            final_video_path = path.join(utils.task_dir(task_id), f"{prefix}final-{index}.mp4")
+
+            logger.info(f"\n\n## generating video: {index} => {final_video_path}")
+            video.generate_video(
+                video_path=combined_video_path,
+                audio_path=audio_file,
+                subtitle_path=subtitle_path,
+                output_file=final_video_path,
+                params=params,
+                audio_track=audio_track,
+            )
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+            _progress += 50 / params.video_count / 2
+            sm.state.update_task(task_id, progress=_progress)
 
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
+            final_video_paths.append(final_video_path)
+    finally:
+        remove_audio_track(task_id, audio_track)
+
+    return final_video_paths, combined_video_paths
 
-        logger.info(f"\n\n## generating video: {index} => {final_video_path}")
-        video.generate_video(
-            video_path=combined_video_path,
-            audio_path=audio_file,
-            subtitle_path=subtitle_path,
-            output_file=final_video_path,
-            params=params,
-        )
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+def prepare_audio_track(task_id, params, audio_file, duration, prefix=""):
+    """
+    Mix the voice and the background music once for all videos of the task,
+    the track covers the longest video and is muxed in without re-encoding.
+    """
+    logger.info(f"\n\n## mixing audio: {duration:.2f}s")
+    scratch_dir = video.get_scratch_dir(utils.task_dir(task_id))
+    audio_track = path.join(scratch_dir, f"{prefix}audio-track.m4a")
+    return video.mix_audio_track(audio_file, audio_track, duration, params)
 
-        final_video_paths.append(final_video_path)
-        combined_video_paths.append(combined_video_path)
 
+def remove_audio_track(task_id, audio_track):
+    try:
+        os.remove(audio_track)
+    except Exception as e:
+        logger.warning(f"failed to remove audio track: {str(e)}")
+    video.remove_scratch_dir(utils.task_dir(task_id))
+
+
+def generate_streamed_videos(
+    task_id, params, downloaded_videos, audio_file, subtitle_path, combined_video_paths, prefix=""
+):
+    """
+    Render every variant from the sources straight into the final encoder, the
+    combined videos are only written when `stream_keep_combined` is enabled.
+    """
+    keep_combined = config.app.get("stream_keep_combined", True)
+    video_concat_mode = (
+        params.video_concat_mode if params.video_count == 1 else VideoConcatMode.random
+    )
+    audio_duration = probe.get_duration(audio_file)
+    timelines, crossfade = video.plan_video_variants(
+        video_paths=downloaded_videos,
+        audio_duration=audio_duration,
+        video_count=params.video_count,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=params.video_transition_mode,
+        max_clip_duration=params.video_clip_duration,
+        video_subject=params.video_subject,
+        enable_professional_effects=params.enable_professional_effects,
+        effect_preset=params.effect_preset,
+        seed=params.video_seed,
+        render_mode=params.render_mode,
+    )
+
+    duration = max(video.get_timeline_duration(timeline, audio_duration, crossfade) for timeline in timelines)
+    audio_track = prepare_audio_track(task_id, params, audio_file, duration, prefix)
+
+    _progress = 50
+    final_video_paths = []
+    try:
+        for i, (combined_video_path, timeline) in enumerate(zip(combined_video_paths, timelines)):
+            index = i + 1
+            final_video_path = path.join(utils.task_dir(task_id), f"{prefix}final-{index}.mp4")
+
+            logger.info(f"\n\n## streaming video: {index} => {final_video_path}")
+            video.generate_video(
+                video_path=combined_video_path if keep_combined else "",
+                audio_path=audio_file,
+                subtitle_path=subtitle_path,
+                output_file=final_video_path,
+                params=params,
+                timeline=timeline,
+                crossfade=crossfade,
+                audio_track=audio_track,
+            )
+
+            _progress += 50 / params.video_count
+            sm.state.update_task(task_id, progress=_progress)
+
+            final_video_paths.append(final_video_path)
+    finally:
+        remove_audio_track(task_id, audio_track)
+
+    combined_video_paths = [p for p in combined_video_paths if path.exists(p)]
     return final_video_paths, combined_video_paths
 
 
@@ -254,6 +359,10 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     if type(params.video_concat_mode) is str:
         params.video_concat_mode = VideoConcatMode(params.video_concat_mode)
 
+    # the seed is saved with the script data, all random choices of the task can be reproduced
+    if params.video_seed is None:
+        params.video_seed = random.randrange(2**32)
+
     # 1. Generate script
     video_script = generate_script(task_id, params)
     if not video_script or "Error: " in video_script:
@@ -329,6 +438,9 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
         return
 
+    # materials are saved with the script, a draft can be finalized with the same clips
+    save_script_data(task_id, video_script, video_terms, params, downloaded_videos)
+
     if stop_at == "materials":
         sm.state.update_task(
             task_id,
@@ -340,10 +452,11 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
 
-    # 6. Generate final videos
-    final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
-    )
+    # 6. Generate final videos, the materials are kept from eviction while they are rendered
+    with storage_manager.pinned(downloaded_videos):
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id, params, downloaded_videos, audio_file, subtitle_path
+        )
 
     if not final_video_paths:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -369,6 +482,75 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
     return kwargs
 
 
+def finalize(task_id):
+    """
+    Render a draft task at full quality. The script, audio, subtitles, materials
+    and random seed of the draft are reused, so the same clips are selected.
+    """
+    logger.info(f"finalize task: {task_id}")
+    script_file = path.join(utils.task_dir(task_id), "script.json")
+    if not path.exists(script_file):
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        logger.error(f"script data not found, can not finalize task: {script_file}")
+        return
+
+    with open(script_file, "r", encoding="utf-8") as f:
+        script_data = json.load(f)
+
+    params = VideoParams(**script_data["params"])
+    params.render_mode = RenderMode.final.value
+    video_script = script_data.get("script", "")
+    video_terms = script_data.get("search_terms", "")
+    downloaded_videos = script_data.get("materials", [])
+    audio_file = path.join(utils.task_dir(task_id), "audio.mp3")
+    subtitle_path = path.join(utils.task_dir(task_id), "subtitle.srt")
+    if not params.subtitle_enabled or not path.exists(subtitle_path):
+        subtitle_path = ""
+    if not downloaded_videos or not path.exists(audio_file):
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        logger.error(f"materials or audio of the draft are missing, can not finalize task: {task_id}")
+        return
+
+    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+    # pinned before the check, a material found now can not be evicted while rendering
+    with storage_manager.pinned(downloaded_videos):
+        missing = [file for file in downloaded_videos if not path.isfile(file)]
+        if missing:
+            # other materials would select other clips than the draft
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            logger.error(
+                f"{len(missing)} materials of the draft were removed, can not finalize task: {task_id}, "
+                f"missing: {missing}. Generate the video again."
+            )
+            return
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id, params, downloaded_videos, audio_file, subtitle_path
+        )
+
+    if not final_video_paths:
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        return
+
+    save_script_data(task_id, video_script, video_terms, params, downloaded_videos)
+    logger.success(
+        f"task {task_id} finalized, generated {len(final_video_paths)} videos."
+    )
+
+    kwargs = {
+        "videos": final_video_paths,
+        "combined_videos": combined_video_paths,
+        "script": video_script,
+        "terms": video_terms,
+        "audio_file": audio_file,
+        "subtitle_path": subtitle_path,
+        "materials": downloaded_videos,
+    }
+    sm.state.update_task(
+        task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
+    )
+    return kwargs
+
+
 if __name__ == "__main__":
     task_id = "task_id"
     params = VideoParams(
@@ -1,6 +1,8 @@
 from moviepy import Clip, vfx, VideoFileClip, CompositeVideoClip, ColorClip, ImageClip
 import numpy as np
+from PIL import Image
 import random
+import re
 from typing import List, Tuple, Optional, Union
 from loguru import logger
 
@@ -21,12 +23,15 @@ def fadeout_transition(clip: Clip, t: float) -> Clip:
 
 def slidein_transition(clip: Clip, t: float, side: str) -> Clip:
     """滑入转场效果"""
-    return clip.with_effects([vfx.SlideIn(t, side)])
+    length = max(float(t), 0.001)
+    return _slide(clip, lambda time: _progress(time, 0, length), side)
 
 
 def slideout_transition(clip: Clip, t: float, side: str) -> Clip:
     """滑出转场效果"""
-    return clip.with_effects([vfx.SlideOut(t, side)])
+    length = max(float(t), 0.001)
+    start = max(0.0, clip.duration - length)
+    return _slide(clip, lambda time: 1 - _progress(time, start, length), side)
 
 
 def crossfade_transition(clip1: Clip, clip2: Clip, duration: float = 1.0) -> Clip:
@@ -50,19 +55,78 @@ def crossfade_transition(clip1: Clip, clip2: Clip, duration: float = 1.0) -> Cli
         return clip1
 
 
+# ========================================
+# 运动效果的 moviepy 实现，逐帧计算与 effect_to_ffmpeg 中相同的表达式，两种引擎输出一致
+# ========================================
+
+def _progress(t: float, start: float, length: float) -> float:
+    # 对应 ffmpeg 表达式 clip((t-start)/length,0,1)
+    return min(max((t - start) / length, 0.0), 1.0)
+
+
+def _zoom_in_value(factor: float, start: float, length: float, t: float) -> float:
+    return 1 + (factor - 1) * _progress(t, start, length)
+
+
+def _zoom_out_value(factor: float, start: float, length: float, t: float) -> float:
+    return factor - (factor - 1) * _progress(t, start, length)
+
+
+def _zoom_frame(frame: np.ndarray, zoom: float) -> np.ndarray:
+    # 与 zoompan 相同：取中心 1/zoom 的区域放大回原尺寸，zoompan 的缩放不小于 1
+    if zoom <= 1:
+        return frame
+    h, w = frame.shape[:2]
+    crop_w, crop_h = w / zoom, h / zoom
+    x, y = (w - crop_w) / 2, (h - crop_h) / 2
+    image = Image.fromarray(frame).resize((w, h), Image.Resampling.BICUBIC, box=(x, y, x + crop_w, y + crop_h))
+    return np.asarray(image)
+
+
+def _shift_frame(frame: np.ndarray, dx: float, dy: float) -> np.ndarray:
+    # 与 pad+crop 相同：画面移动 (dx, dy)，移出的部分补黑
+    h, w = frame.shape[:2]
+    dx, dy = int(round(dx)), int(round(dy))
+    shifted = np.zeros_like(frame)
+    if abs(dx) >= w or abs(dy) >= h:
+        return shifted
+    shifted[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] = \
+        frame[max(-dy, 0):h - max(dy, 0), max(-dx, 0):w - max(dx, 0)]
+    return shifted
+
+
+def _rotate_frame(frame: np.ndarray, degrees: float) -> np.ndarray:
+    # ffmpeg rotate 的正角度为顺时针，PIL 为逆时针
+    if not degrees:
+        return frame
+    return np.asarray(Image.fromarray(frame).rotate(-degrees, resample=Image.Resampling.BILINEAR, fillcolor=0))
+
+
+def _zoom(clip: Clip, zoom_at) -> Clip:
+    return clip.transform(lambda get_frame, t: _zoom_frame(get_frame(t), zoom_at(t)))
+
+
+def _translate(clip: Clip, offset_at) -> Clip:
+    return clip.transform(lambda get_frame, t: _shift_frame(get_frame(t), *offset_at(t)))
+
+
+def _slide(clip: Clip, progress_at, side: str) -> Clip:
+    # progress 为 0 时画面完全在 side 一侧的画外，为 1 时回到原位
+    w, h = clip.size
+    if side == "left":
+        return _translate(clip, lambda t: (-w * (1 - progress_at(t)), 0))
+    if side == "right":
+        return _translate(clip, lambda t: (w * (1 - progress_at(t)), 0))
+    if side == "top":
+        return _translate(clip, lambda t: (0, -h * (1 - progress_at(t))))
+    return _translate(clip, lambda t: (0, h * (1 - progress_at(t))))
+
+
 def zoom_in_transition(clip: Clip, zoom_factor: float = 1.2, duration: float = 1.0) -> Clip:
     """缩放进入转场效果"""
     try:
-        def zoom_effect(get_frame, t):
-            frame = get_frame(t)
-            if t < duration:
-                # 计算当前缩放比例
-                current_zoom = 1 + (zoom_factor - 1) * (t / duration)
-                # 应用缩放效果
-                return vfx.Resize(current_zoom)(clip).get_frame(t)
-            return frame
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration)
+        length = max(float(duration), 0.001)
+        return _zoom(clip, lambda t: _zoom_in_value(zoom_factor, 0, length, t))
     except Exception as e:
         logger.warning(f"缩放转场失败，返回原片段: {e}")
         return clip
@@ -71,17 +135,9 @@ def zoom_in_transition(clip: Clip, zoom_factor: float = 1.2, duration: float = 1
 def zoom_out_transition(clip: Clip, zoom_factor: float = 1.2, duration: float = 1.0) -> Clip:
     """缩放退出转场效果"""
     try:
-        def zoom_effect(get_frame, t):
-            frame = get_frame(t)
-            if t > clip.duration - duration:
-                # 计算当前缩放比例
-                progress = (t - (clip.duration - duration)) / duration
-                current_zoom = zoom_factor - (zoom_factor - 1) * progress
-                # 应用缩放效果
-                return vfx.Resize(current_zoom)(clip).get_frame(t)
-            return frame
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration)
+        length = max(float(duration), 0.001)
+        start = max(0.0, clip.duration - length)
+        return _zoom(clip, lambda t: _zoom_out_value(zoom_factor, start, length, t))
     except Exception as e:
         logger.warning(f"缩放退出转场失败，返回原片段: {e}")
         return clip
@@ -90,15 +146,10 @@ def zoom_out_transition(clip: Clip, zoom_factor: float = 1.2, duration: float =
 def rotate_transition(clip: Clip, angle: float = 360, duration: float = 1.0) -> Clip:
     """旋转转场效果"""
     try:
-        def rotate_effect(get_frame, t):
-            frame = get_frame(t)
-            if t < duration:
-                # 计算当前旋转角度
-                current_angle = angle * (t / duration)
-                return vfx.Rotate(current_angle)(clip).get_frame(t)
-            return frame
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration)
+        length = max(float(duration), 0.001)
+        return clip.transform(
+            lambda get_frame, t: _rotate_frame(get_frame(t), angle * t / length if t < length else 0)
+        )
     except Exception as e:
         logger.warning(f"旋转转场失败，返回原片段: {e}")
         return clip
@@ -155,12 +206,8 @@ def wipe_transition(clip1: Clip, clip2: Clip, direction: str = "left", duration:
 def apply_cinematic_filter(clip: Clip, intensity: float = 0.5) -> Clip:
     """电影级滤镜效果"""
     try:
-        # 应用电影级色彩调整
-        clip = clip.with_effects([
-            vfx.ColorX(1.1),  # 增强对比度
-            vfx.Gamma(0.9),   # 调整伽马值
-        ])
-        return clip
+        # 增强对比度 + 调整伽马值
+        return apply_color_effects(clip, [("cinematic", intensity)])
     except Exception as e:
         logger.warning(f"电影滤镜应用失败: {e}")
         return clip
@@ -169,12 +216,8 @@ def apply_cinematic_filter(clip: Clip, intensity: float = 0.5) -> Clip:
 def apply_vintage_filter(clip: Clip, intensity: float = 0.5) -> Clip:
     """复古滤镜效果"""
     try:
-        # 应用复古色调
-        clip = clip.with_effects([
-            vfx.ColorX(0.8),     # 降低饱和度
-            vfx.Gamma(1.2),      # 增加亮度
-        ])
-        return clip
+        # 降低饱和度 + 增加亮度
+        return apply_color_effects(clip, [("vintage", intensity)])
     except Exception as e:
         logger.warning(f"复古滤镜应用失败: {e}")
         return clip
@@ -183,7 +226,7 @@ def apply_vintage_filter(clip: Clip, intensity: float = 0.5) -> Clip:
 def apply_black_white_filter(clip: Clip) -> Clip:
     """黑白滤镜效果"""
     try:
-        return clip.with_effects([vfx.BlackAndWhite()])
+        return apply_color_effects(clip, [("black_white",)])
     except Exception as e:
         logger.warning(f"黑白滤镜应用失败: {e}")
         return clip
@@ -192,10 +235,8 @@ def apply_black_white_filter(clip: Clip) -> Clip:
 def apply_sepia_filter(clip: Clip) -> Clip:
     """棕褐色滤镜效果"""
     try:
-        # 先转黑白，再添加棕褐色调
-        clip = clip.with_effects([vfx.BlackAndWhite()])
-        # 这里可以添加更复杂的棕褐色效果
-        return clip
+        # 先转黑白，这里可以添加更复杂的棕褐色效果
+        return apply_color_effects(clip, [("sepia",)])
     except Exception as e:
         logger.warning(f"棕褐色滤镜应用失败: {e}")
         return clip
@@ -214,7 +255,7 @@ def apply_sharpen_filter(clip: Clip, intensity: float = 1.0) -> Clip:
     """锐化滤镜效果"""
     try:
         # MoviePy没有直接的锐化效果，使用对比度增强
-        return clip.with_effects([vfx.ColorX(1 + intensity * 0.2)])
+        return apply_color_effects(clip, [("sharpen", intensity)])
     except Exception as e:
         logger.warning(f"锐化滤镜应用失败: {e}")
         return clip
@@ -227,14 +268,7 @@ def apply_sharpen_filter(clip: Clip, intensity: float = 1.0) -> Clip:
 def adjust_brightness(clip: Clip, factor: float = 1.2) -> Clip:
     """调整亮度"""
     try:
-        # 使用更兼容的方式调整亮度
-        def brightness_effect(get_frame, t):
-            frame = get_frame(t)
-            # 简单的亮度调整：将像素值乘以因子，但限制在0-255范围内
-            brightened = np.clip(frame * factor, 0, 255).astype(np.uint8)
-            return brightened
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration).with_make_frame(brightness_effect)
+        return apply_color_effects(clip, [("brightness", factor)])
     except Exception as e:
         logger.warning(f"亮度调整失败: {e}")
         return clip
@@ -243,14 +277,7 @@ def adjust_brightness(clip: Clip, factor: float = 1.2) -> Clip:
 def adjust_contrast(clip: Clip, factor: float = 1.2) -> Clip:
     """调整对比度"""
     try:
-        # 使用更兼容的方式调整对比度
-        def contrast_effect(get_frame, t):
-            frame = get_frame(t)
-            # 对比度调整：(像素值 - 128) * 因子 + 128
-            contrasted = np.clip((frame.astype(float) - 128) * factor + 128, 0, 255).astype(np.uint8)
-            return contrasted
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration).with_make_frame(contrast_effect)
+        return apply_color_effects(clip, [("contrast", factor)])
     except Exception as e:
         logger.warning(f"对比度调整失败: {e}")
         return clip
@@ -259,19 +286,7 @@ def adjust_contrast(clip: Clip, factor: float = 1.2) -> Clip:
 def adjust_saturation(clip: Clip, factor: float = 1.2) -> Clip:
     """调整饱和度"""
     try:
-        # 使用更兼容的方式调整饱和度
-        def saturation_effect(get_frame, t):
-            frame = get_frame(t)
-            # 简单的饱和度调整：保持亮度，增强色彩
-            if len(frame.shape) == 3 and frame.shape[2] == 3:
-                # RGB图像
-                gray = np.dot(frame, [0.299, 0.587, 0.114])
-                gray = np.stack([gray, gray, gray], axis=2)
-                saturated = np.clip(gray + (frame - gray) * factor, 0, 255).astype(np.uint8)
-                return saturated
-            return frame
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration).with_make_frame(saturation_effect)
+        return apply_color_effects(clip, [("saturation", factor)])
     except Exception as e:
         logger.warning(f"饱和度调整失败: {e}")
         return clip
@@ -280,17 +295,7 @@ def adjust_saturation(clip: Clip, factor: float = 1.2) -> Clip:
 def color_temperature_warm(clip: Clip, intensity: float = 0.3) -> Clip:
     """暖色调调整"""
     try:
-        def warm_effect(get_frame, t):
-            frame = get_frame(t)
-            if len(frame.shape) == 3 and frame.shape[2] == 3:
-                # 增加红色和黄色通道
-                warmed = frame.copy().astype(float)
-                warmed[:, :, 0] = np.clip(warmed[:, :, 0] * (1 + intensity * 0.3), 0, 255)  # 红色
-                warmed[:, :, 1] = np.clip(warmed[:, :, 1] * (1 + intensity * 0.1), 0, 255)  # 绿色
-                return warmed.astype(np.uint8)
-            return frame
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration).with_make_frame(warm_effect)
+        return apply_color_effects(clip, [("warm", intensity)])
     except Exception as e:
         logger.warning(f"暖色调调整失败: {e}")
         return clip
@@ -299,22 +304,145 @@ def color_temperature_warm(clip: Clip, intensity: float = 0.3) -> Clip:
 def color_temperature_cool(clip: Clip, intensity: float = 0.3) -> Clip:
     """冷色调调整"""
     try:
-        def cool_effect(get_frame, t):
-            frame = get_frame(t)
-            if len(frame.shape) == 3 and frame.shape[2] == 3:
-                # 增加蓝色通道
-                cooled = frame.copy().astype(float)
-                cooled[:, :, 2] = np.clip(cooled[:, :, 2] * (1 + intensity * 0.3), 0, 255)  # 蓝色
-                cooled[:, :, 0] = np.clip(cooled[:, :, 0] * (1 - intensity * 0.1), 0, 255)  # 减少红色
-                return cooled.astype(np.uint8)
-            return frame
-        
-        return clip.with_fps(clip.fps).with_duration(clip.duration).with_make_frame(cool_effect)
+        return apply_color_effects(clip, [("cool", intensity)])
     except Exception as e:
         logger.warning(f"冷色调调整失败: {e}")
         return clip
 
 
+# ========================================
+# 🧮 色彩运算编译系统
+# ========================================
+#
+# 逐像素的色彩调整都被编译为"程序": 由查找表 (LUT, 3x256 uint8) 和
+# 3x3 混色矩阵组成的序列。相邻的查找表在编译时直接复合为一张表，
+# 每一帧只需要一次查表（饱和度/黑白再加一次矩阵运算），
+# 而不是每个效果各自分配一份 float64 的帧副本。
+
+COLOR_EFFECTS = {
+    "contrast", "brightness", "saturation", "warm", "cool",
+    "cinematic", "vintage", "sharpen", "black_white", "sepia",
+}
+
+_LUT_INPUT = np.arange(256, dtype=np.float64)
+
+
+def _channel_lut(values) -> np.ndarray:
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def _uniform_lut(values) -> np.ndarray:
+    return np.stack([_channel_lut(values)] * 3)
+
+
+def _multiply_lut(factor: float) -> np.ndarray:
+    # 对应 ColorX / MultiplyColor
+    return _uniform_lut(np.minimum(255, factor * _LUT_INPUT))
+
+
+def _gamma_lut(gamma: float) -> np.ndarray:
+    # 对应 Gamma / GammaCorrection
+    return _uniform_lut(255 * (_LUT_INPUT / 255) ** gamma)
+
+
+def _saturation_matrix(factor: float) -> np.ndarray:
+    # gray + (pixel - gray) * factor 展开后的 3x3 混色矩阵
+    weights = np.array([0.299, 0.587, 0.114])
+    return factor * np.eye(3) + (1 - factor) * np.tile(weights, (3, 1))
+
+
+def color_effect_stages(effect: tuple) -> list:
+    """将单个色彩效果拆解为 ("lut", 3x256) / ("matrix", 3x3) 阶段"""
+    name, args = effect[0], effect[1:]
+
+    if name == "brightness":
+        return [("lut", _uniform_lut(_LUT_INPUT * args[0]))]
+    if name == "contrast":
+        return [("lut", _uniform_lut((_LUT_INPUT - 128) * args[0] + 128))]
+    if name == "warm":
+        intensity = args[0] if args else 0.3
+        return [("lut", np.stack([
+            _channel_lut(_LUT_INPUT * (1 + intensity * 0.3)),  # 红色
+            _channel_lut(_LUT_INPUT * (1 + intensity * 0.1)),  # 绿色
+            _channel_lut(_LUT_INPUT),
+        ]))]
+    if name == "cool":
+        intensity = args[0] if args else 0.3
+        return [("lut", np.stack([
+            _channel_lut(_LUT_INPUT * (1 - intensity * 0.1)),  # 减少红色
+            _channel_lut(_LUT_INPUT),
+            _channel_lut(_LUT_INPUT * (1 + intensity * 0.3)),  # 蓝色
+        ]))]
+    if name == "cinematic":
+        return [("lut", _multiply_lut(1.1)), ("lut", _gamma_lut(0.9))]
+    if name == "vintage":
+        return [("lut", _multiply_lut(0.8)), ("lut", _gamma_lut(1.2))]
+    if name == "sharpen":
+        intensity = args[0] if args else 1.0
+        return [("lut", _multiply_lut(1 + intensity * 0.2))]
+    if name == "saturation":
+        return [("matrix", _saturation_matrix(args[0]))]
+    if name in ("black_white", "sepia"):
+        return [("matrix", np.full((3, 3), 1 / 3))]
+
+    raise ValueError(f"not a color effect: {name}")
+
+
+def compile_color_effects(effects: list) -> list:
+    """将一串色彩效果编译为程序，相邻的查找表会被复合成一张"""
+    program = []
+    for effect in effects:
+        for kind, data in color_effect_stages(effect):
+            if kind == "lut" and program and program[-1][0] == "lut":
+                previous = program[-1][1]
+                # 先查 previous 再查 data，复合后与逐个应用逐位一致
+                data = np.stack([data[c][previous[c]] for c in range(3)])
+                program[-1] = ("lut", data)
+            else:
+                program.append((kind, data))
+
+    # 三个通道共用一张表时可以整帧一次查表
+    compiled = []
+    for kind, data in program:
+        if kind == "lut":
+            uniform = bool((data[0] == data[1]).all() and (data[0] == data[2]).all())
+            compiled.append(("lut", data[0] if uniform else data))
+        else:
+            compiled.append(("matrix", data.T.astype(np.float32)))
+    return compiled
+
+
+def run_color_program(frame: np.ndarray, program: list) -> np.ndarray:
+    """对一帧执行编译后的色彩程序"""
+    if frame.dtype != np.uint8:
+        frame = np.clip(frame, 0, 255).astype(np.uint8)
+
+    for kind, data in program:
+        if kind == "lut":
+            if data.ndim == 1:
+                frame = data[frame]
+            elif frame.ndim == 3 and frame.shape[2] >= 3:
+                out = np.empty_like(frame)
+                for c in range(3):
+                    out[:, :, c] = data[c][frame[:, :, c]]
+                if frame.shape[2] > 3:
+                    out[:, :, 3:] = frame[:, :, 3:]
+                frame = out
+        elif frame.ndim == 3 and frame.shape[2] == 3:
+            mixed = frame.astype(np.float32) @ data
+            np.clip(mixed, 0, 255, out=mixed)
+            frame = mixed.astype(np.uint8)
+    return frame
+
+
+def apply_color_effects(clip: Clip, effects: list) -> Clip:
+    """将一串色彩效果融合为一次逐帧变换"""
+    if not effects:
+        return clip
+    program = compile_color_effects(effects)
+    return clip.image_transform(lambda frame: run_color_program(frame, program))
+
+
 # ========================================
 # 🎭 动态效果系统
 # ========================================
@@ -322,14 +450,19 @@ def color_temperature_cool(clip: Clip, intensity: float = 0.3) -> Clip:
 def add_zoom_effect(clip: Clip, zoom_type: str = "in", intensity: float = 1.2) -> Clip:
     """添加缩放动画效果"""
     try:
+        duration = clip.duration
         if zoom_type == "in":
-            return zoom_in_transition(clip, intensity, clip.duration * 0.3)
+            length = max(duration * 0.3, 0.001)
+            return _zoom(clip, lambda t: _zoom_in_value(intensity, 0, length, t))
         elif zoom_type == "out":
-            return zoom_out_transition(clip, intensity, clip.duration * 0.3)
+            length = max(duration * 0.3, 0.001)
+            return _zoom(clip, lambda t: _zoom_out_value(intensity, duration - length, length, t))
         else:  # in_out
-            clip = zoom_in_transition(clip, intensity, clip.duration * 0.2)
-            clip = zoom_out_transition(clip, intensity, clip.duration * 0.2)
-            return clip
+            length = max(duration * 0.2, 0.001)
+            return _zoom(clip, lambda t: min(
+                _zoom_in_value(intensity, 0, length, t),
+                _zoom_out_value(intensity, duration - length, length, t),
+            ))
     except Exception as e:
         logger.warning(f"缩放效果添加失败: {e}")
         return clip
@@ -338,19 +471,18 @@ def add_zoom_effect(clip: Clip, zoom_type: str = "in", intensity: float = 1.2) -
 def add_pan_effect(clip: Clip, direction: str = "left", speed: float = 50) -> Clip:
     """添加平移效果"""
     try:
-        w, h = clip.size
         if direction == "left":
             # 从右向左平移
-            return clip.with_position(lambda t: (-speed * t, 0))
+            return _translate(clip, lambda t: (-speed * t, 0))
         elif direction == "right":
             # 从左向右平移
-            return clip.with_position(lambda t: (speed * t, 0))
+            return _translate(clip, lambda t: (speed * t, 0))
         elif direction == "up":
             # 从下向上平移
-            return clip.with_position(lambda t: (0, -speed * t))
+            return _translate(clip, lambda t: (0, -speed * t))
         else:  # down
             # 从上向下平移
-            return clip.with_position(lambda t: (0, speed * t))
+            return _translate(clip, lambda t: (0, speed * t))
     except Exception as e:
         logger.warning(f"平移效果添加失败: {e}")
         return clip
@@ -359,12 +491,12 @@ def add_pan_effect(clip: Clip, direction: str = "left", speed: float = 50) -> Cl
 def add_shake_effect(clip: Clip, intensity: float = 5.0, frequency: float = 10.0) -> Clip:
     """添加震动效果"""
     try:
-        def shake_position(t):
+        def shake_offset(t):
             x_offset = intensity * np.sin(2 * np.pi * frequency * t)
             y_offset = intensity * np.cos(2 * np.pi * frequency * t * 1.3)
             return (x_offset, y_offset)
         
-        return clip.with_position(shake_position)
+        return _translate(clip, shake_offset)
     except Exception as e:
         logger.warning(f"震动效果添加失败: {e}")
         return clip
@@ -388,47 +520,55 @@ def apply_random_transition(clip1: Clip, clip2: Clip, duration: float = 1.0) ->
     return selected_transition(clip1, clip2, duration)
 
 
-def apply_random_filter(clip: Clip) -> Clip:
-    """随机应用滤镜效果"""
+def random_filter_plan(rng: random.Random = None) -> list:
+    """随机选择一个滤镜，返回对应的效果计划，rng 用于复现同一次选择"""
     filters = [
-        lambda c: c,  # 无滤镜
-        lambda c: apply_cinematic_filter(c, 0.3),
-        lambda c: apply_vintage_filter(c, 0.4),
-        lambda c: adjust_brightness(c, 1.1),
-        lambda c: adjust_contrast(c, 1.1),
-        lambda c: color_temperature_warm(c, 0.2),
-        lambda c: color_temperature_cool(c, 0.2),
+        [],  # 无滤镜
+        [("cinematic", 0.3)],
+        [("vintage", 0.4)],
+        [("brightness", 1.1)],
+        [("contrast", 1.1)],
+        [("warm", 0.2)],
+        [("cool", 0.2)],
     ]
-    
-    selected_filter = random.choice(filters)
-    return selected_filter(clip)
+
+    return list((rng or random).choice(filters))
+
+
+def apply_random_filter(clip: Clip) -> Clip:
+    """随机应用滤镜效果"""
+    return apply_effect_plan(clip, random_filter_plan())
+
+
+def professional_enhancement_plan(enhancement_level: str = "medium") -> list:
+    """专业级视频增强对应的效果计划"""
+    if enhancement_level == "light":
+        # 轻度增强
+        return [("contrast", 1.05), ("brightness", 1.02)]
+    elif enhancement_level == "medium":
+        # 中度增强
+        return [
+            ("contrast", 1.1),
+            ("brightness", 1.05),
+            ("saturation", 1.05),
+            ("cinematic", 0.3),
+        ]
+    elif enhancement_level == "strong":
+        # 强度增强
+        return [
+            ("contrast", 1.2),
+            ("brightness", 1.1),
+            ("saturation", 1.1),
+            ("cinematic", 0.5),
+            ("zoom", "in_out", 1.05),
+        ]
+    return []
 
 
 def apply_professional_enhancement(clip: Clip, enhancement_level: str = "medium") -> Clip:
     """应用专业级视频增强"""
     try:
-        if enhancement_level == "light":
-            # 轻度增强
-            clip = adjust_contrast(clip, 1.05)
-            clip = adjust_brightness(clip, 1.02)
-            
-        elif enhancement_level == "medium":
-            # 中度增强
-            clip = adjust_contrast(clip, 1.1)
-            clip = adjust_brightness(clip, 1.05)
-            clip = adjust_saturation(clip, 1.05)
-            clip = apply_cinematic_filter(clip, 0.3)
-            
-        elif enhancement_level == "strong":
-            # 强度增强
-            clip = adjust_contrast(clip, 1.2)
-            clip = adjust_brightness(clip, 1.1)
-            clip = adjust_saturation(clip, 1.1)
-            clip = apply_cinematic_filter(clip, 0.5)
-            clip = add_zoom_effect(clip, "in_out", 1.05)
-            
-        return clip
-        
+        return apply_effect_plan(clip, professional_enhancement_plan(enhancement_level))
     except Exception as e:
         logger.warning(f"专业增强应用失败: {e}")
         return clip
@@ -477,32 +617,37 @@ def get_recommended_effects(clip_index: int, total_clips: int, content_type: str
     return effects
 
 
+def smart_effects_plan(clip_index: int, total_clips: int, content_type: str = "general") -> list:
+    """根据推荐结果生成智能效果计划"""
+    effects = get_recommended_effects(clip_index, total_clips, content_type)
+    plan = []
+
+    # 滤镜
+    if effects["filter"] == "cinematic":
+        plan.append(("cinematic", 0.4))
+    elif effects["filter"] == "vintage":
+        plan.append(("vintage", 0.4))
+    elif effects["filter"] == "warm":
+        plan.append(("warm", 0.3))
+    elif effects["filter"] == "professional":
+        plan.append(("contrast", 1.1))
+
+    # 增强
+    plan.extend(professional_enhancement_plan(effects["enhancement"]))
+
+    # 动态效果
+    if effects["dynamic"] == "zoom_in":
+        plan.append(("zoom", "in", 1.05))
+    elif effects["dynamic"] == "zoom_out":
+        plan.append(("zoom", "out", 1.05))
+
+    return plan
+
+
 def apply_smart_effects(clip: Clip, clip_index: int, total_clips: int, content_type: str = "general") -> Clip:
     """智能应用推荐的效果"""
     try:
-        effects = get_recommended_effects(clip_index, total_clips, content_type)
-        
-        # 应用滤镜
-        if effects["filter"] == "cinematic":
-            clip = apply_cinematic_filter(clip, 0.4)
-        elif effects["filter"] == "vintage":
-            clip = apply_vintage_filter(clip, 0.4)
-        elif effects["filter"] == "warm":
-            clip = color_temperature_warm(clip, 0.3)
-        elif effects["filter"] == "professional":
-            clip = adjust_contrast(clip, 1.1)
-        
-        # 应用增强
-        clip = apply_professional_enhancement(clip, effects["enhancement"])
-        
-        # 应用动态效果
-        if effects["dynamic"] == "zoom_in":
-            clip = add_zoom_effect(clip, "in", 1.05)
-        elif effects["dynamic"] == "zoom_out":
-            clip = add_zoom_effect(clip, "out", 1.05)
-        
-        return clip
-        
+        return apply_effect_plan(clip, smart_effects_plan(clip_index, total_clips, content_type))
     except Exception as e:
         logger.warning(f"智能效果应用失败: {e}")
         return clip
@@ -541,51 +686,302 @@ EFFECT_PRESETS = {
 }
 
 
+def preset_effects_plan(preset_name: str) -> list:
+    """将预设效果组合解析为效果计划"""
+    if preset_name not in EFFECT_PRESETS:
+        logger.warning(f"未知的预设效果: {preset_name}")
+        return []
+
+    plan = []
+    for effect in EFFECT_PRESETS[preset_name]["effects"]:
+        if effect == "zoom_in_out":
+            plan.append(("zoom", "in_out", 1.05))
+        elif effect.startswith("shake_"):
+            plan.append(("shake", float(effect.split("_")[1]), 10.0))
+        else:
+            name, value = effect.rsplit("_", 1)
+            plan.append((name, float(value)))
+    return plan
+
+
 def apply_preset_effects(clip: Clip, preset_name: str) -> Clip:
     """应用预设效果组合"""
     try:
         if preset_name not in EFFECT_PRESETS:
             logger.warning(f"未知的预设效果: {preset_name}")
             return clip
-        
+
         preset = EFFECT_PRESETS[preset_name]
         logger.info(f"应用预设效果: {preset['name']} - {preset['description']}")
-        
-        for effect in preset["effects"]:
-            if effect.startswith("contrast_"):
-                factor = float(effect.split("_")[1])
-                clip = adjust_contrast(clip, factor)
-            elif effect.startswith("brightness_"):
-                factor = float(effect.split("_")[1])
-                clip = adjust_brightness(clip, factor)
-            elif effect.startswith("saturation_"):
-                factor = float(effect.split("_")[1])
-                clip = adjust_saturation(clip, factor)
-            elif effect.startswith("cinematic_"):
-                intensity = float(effect.split("_")[1])
-                clip = apply_cinematic_filter(clip, intensity)
-            elif effect.startswith("vintage_"):
-                intensity = float(effect.split("_")[1])
-                clip = apply_vintage_filter(clip, intensity)
-            elif effect.startswith("warm_"):
-                intensity = float(effect.split("_")[1])
-                clip = color_temperature_warm(clip, intensity)
-            elif effect.startswith("cool_"):
-                intensity = float(effect.split("_")[1])
-                clip = color_temperature_cool(clip, intensity)
-            elif effect == "zoom_in_out":
-                clip = add_zoom_effect(clip, "in_out", 1.05)
-            elif effect.startswith("shake_"):
-                intensity = float(effect.split("_")[1])
-                clip = add_shake_effect(clip, intensity, 10.0)
-        
-        return clip
-        
+        return apply_effect_plan(clip, preset_effects_plan(preset_name))
+
     except Exception as e:
         logger.error(f"预设效果应用失败: {e}")
         return clip
 
 
+# ========================================
+# 🧩 效果计划系统
+# ========================================
+#
+# 效果计划是由 (效果名, *参数) 元组组成的列表，例如:
+#   [("fade_in", 1), ("contrast", 1.1), ("zoom", "in_out", 1.05)]
+# 同一份计划既可以用 moviepy 逐帧应用，也可以翻译成 ffmpeg 滤镜，
+# 由编码器在一次解码/编码中完成。
+
+EFFECT_HANDLERS = {
+    "fade_in": fadein_transition,
+    "fade_out": fadeout_transition,
+    "slide_in": slidein_transition,
+    "slide_out": slideout_transition,
+    "zoom_in": zoom_in_transition,
+    "zoom_out": zoom_out_transition,
+    "rotate": rotate_transition,
+    "zoom": add_zoom_effect,
+    "pan": add_pan_effect,
+    "shake": add_shake_effect,
+    "contrast": adjust_contrast,
+    "brightness": adjust_brightness,
+    "saturation": adjust_saturation,
+    "warm": color_temperature_warm,
+    "cool": color_temperature_cool,
+    "cinematic": apply_cinematic_filter,
+    "vintage": apply_vintage_filter,
+    "black_white": apply_black_white_filter,
+    "sepia": apply_sepia_filter,
+    "blur": apply_blur_filter,
+    "sharpen": apply_sharpen_filter,
+}
+
+
+def apply_effect_plan(clip: Clip, plan: list) -> Clip:
+    """按顺序将效果计划应用到 moviepy 片段上，相邻的色彩效果会被融合为一次变换"""
+    color_run = []
+    for effect in plan or []:
+        if effect[0] in COLOR_EFFECTS:
+            color_run.append(effect)
+            continue
+
+        if color_run:
+            clip = apply_color_effects(clip, color_run)
+            color_run = []
+
+        handler = EFFECT_HANDLERS.get(effect[0])
+        if handler is None:
+            logger.warning(f"未知的效果: {effect[0]}")
+            continue
+        clip = handler(clip, *effect[1:])
+
+    if color_run:
+        clip = apply_color_effects(clip, color_run)
+    return clip
+
+
+def _lutrgb(r: str = "val", g: str = "val", b: str = "val") -> str:
+    return f"lutrgb=r='{r}':g='{g}':b='{b}'"
+
+
+def _multiply_gamma_expr(factor: float, gamma: float) -> str:
+    # 对应 ColorX(factor) + Gamma(gamma)
+    return f"255*pow(clip(val*{factor},0,255)/255,{gamma})"
+
+
+def _saturation_mixer(factor: float) -> str:
+    # gray + (pixel - gray) * factor 展开后的 3x3 混色矩阵
+    weights = (0.299, 0.587, 0.114)
+    rows = []
+    for out_channel, name in enumerate("rgb"):
+        for in_channel, in_name in enumerate("rgb"):
+            value = (1 - factor) * weights[in_channel]
+            if in_channel == out_channel:
+                value += factor
+            rows.append(f"{name}{in_name}={value:.6f}")
+    return "colorchannelmixer=" + ":".join(rows)
+
+
+def _even_margin(value: float) -> int:
+    return int(np.ceil(max(value, 0) / 2)) * 2
+
+
+def _translate_filters(
+    size: Tuple[int, int],
+    x_expr: str,
+    y_expr: str,
+    x_range: Tuple[float, float] = (0, 0),
+    y_range: Tuple[float, float] = (0, 0),
+) -> List[str]:
+    # 画面位置 (x_expr, y_expr) 与 moviepy 的 with_position 含义相同，取值范围为 x_range/y_range。
+    # 先用黑边扩展画布，再用按帧求值的 crop 窗口取出原尺寸，位移完全在滤镜中完成
+    w, h = size
+    left, right = _even_margin(x_range[1]), _even_margin(-x_range[0])
+    top, bottom = _even_margin(y_range[1]), _even_margin(-y_range[0])
+    return [
+        f"pad=iw+{left + right}:ih+{top + bottom}:{left}:{top}:color=black",
+        f"crop={w}:{h}:x='{left}-({x_expr})':y='{top}-({y_expr})'",
+    ]
+
+
+def _slide_filters(size: Tuple[int, int], progress: str, side: str) -> List[str]:
+    # progress 为 0 时画面完全在 side 一侧的画外，为 1 时回到原位
+    w, h = size
+    offset = f"(1-{progress})"
+    if side == "left":
+        return _translate_filters(size, f"-{w}*{offset}", "0", x_range=(-w, 0))
+    if side == "right":
+        return _translate_filters(size, f"{w}*{offset}", "0", x_range=(0, w))
+    if side == "top":
+        return _translate_filters(size, "0", f"-{h}*{offset}", y_range=(-h, 0))
+    return _translate_filters(size, "0", f"{h}*{offset}", y_range=(0, h))
+
+
+def _zoom_filter(zoom_expr: str, size: Tuple[int, int], fps: int) -> str:
+    # zoom_expr 中的 t 为片段内时间，zoompan 中用输出帧序号 on/fps 表示
+    w, h = size
+    zoom = re.sub(r"\bt\b", f"(on/{fps})", zoom_expr)
+    return (
+        f"zoompan=z='{zoom}':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+        f":d=1:s={w}x{h}:fps={fps}"
+    )
+
+
+def _zoom_in_expr(factor: float, start: float, length: float) -> str:
+    # 在 [start, start+length] 内从 1 放大到 factor，之后保持
+    return f"1+({factor}-1)*clip((t-{start:.3f})/{length:.3f},0,1)"
+
+
+def _zoom_out_expr(factor: float, start: float, length: float) -> str:
+    # 保持 factor，在 [start, start+length] 内缩回 1
+    return f"{factor}-({factor}-1)*clip((t-{start:.3f})/{length:.3f},0,1)"
+
+
+def effect_to_ffmpeg(effect: tuple, duration: float, size: Tuple[int, int], fps: int = 30) -> Optional[List[str]]:
+    """将单个效果翻译为 ffmpeg 滤镜，无法原生表达时返回 None"""
+    name, args = effect[0], effect[1:]
+
+    if name == "fade_in":
+        return [f"fade=t=in:st=0:d={args[0]}"]
+    if name == "fade_out":
+        return [f"fade=t=out:st={max(0.0, duration - args[0]):.3f}:d={args[0]}"]
+    if name == "contrast":
+        return [_lutrgb(*[f"clip((val-128)*{args[0]}+128,0,255)"] * 3)]
+    if name == "brightness":
+        return [_lutrgb(*[f"clip(val*{args[0]},0,255)"] * 3)]
+    if name == "saturation":
+        return [_saturation_mixer(args[0])]
+    if name == "warm":
+        intensity = args[0] if args else 0.3
+        return [_lutrgb(
+            r=f"clip(val*{1 + intensity * 0.3},0,255)",
+            g=f"clip(val*{1 + intensity * 0.1},0,255)",
+        )]
+    if name == "cool":
+        intensity = args[0] if args else 0.3
+        return [_lutrgb(
+            r=f"clip(val*{1 - intensity * 0.1},0,255)",
+            b=f"clip(val*{1 + intensity * 0.3},0,255)",
+        )]
+    if name == "cinematic":
+        return [_lutrgb(*[_multiply_gamma_expr(1.1, 0.9)] * 3)]
+    if name == "vintage":
+        return [_lutrgb(*[_multiply_gamma_expr(0.8, 1.2)] * 3)]
+    if name == "sharpen":
+        intensity = args[0] if args else 1.0
+        return [_lutrgb(*[f"clip(val*{1 + intensity * 0.2},0,255)"] * 3)]
+    if name in ("black_white", "sepia"):
+        third = 1 / 3
+        return ["colorchannelmixer=" + ":".join(
+            f"{o}{i}={third:.6f}" for o in "rgb" for i in "rgb"
+        )]
+    if name == "blur":
+        radius = args[0] if args else 2.0
+        return [f"gblur=sigma={radius}"]
+
+    # 运动类效果：按时间求值的 pad/crop/zoompan/rotate 表达式，不再逐帧回调 Python
+    if name in ("slide_in", "slide_out"):
+        length = max(float(args[0]), 0.001)
+        side = args[1] if len(args) > 1 else "left"
+        if name == "slide_in":
+            return _slide_filters(size, f"clip(t/{length:.3f},0,1)", side)
+        start = max(0.0, duration - length)
+        return _slide_filters(size, f"(1-clip((t-{start:.3f})/{length:.3f},0,1))", side)
+    if name in ("zoom_in", "zoom_out"):
+        factor = args[0] if args else 1.2
+        length = max(float(args[1]) if len(args) > 1 else 1.0, 0.001)
+        if name == "zoom_in":
+            return [_zoom_filter(_zoom_in_expr(factor, 0, length), size, fps)]
+        return [_zoom_filter(_zoom_out_expr(factor, max(0.0, duration - length), length), size, fps)]
+    if name == "zoom":
+        zoom_type = args[0] if args else "in"
+        factor = args[1] if len(args) > 1 else 1.2
+        if zoom_type == "in":
+            zoom_expr = _zoom_in_expr(factor, 0, max(duration * 0.3, 0.001))
+        elif zoom_type == "out":
+            length = max(duration * 0.3, 0.001)
+            zoom_expr = _zoom_out_expr(factor, duration - length, length)
+        else:  # in_out
+            length = max(duration * 0.2, 0.001)
+            zoom_expr = f"min({_zoom_in_expr(factor, 0, length)},{_zoom_out_expr(factor, duration - length, length)})"
+        return [_zoom_filter(zoom_expr, size, fps)]
+    if name == "rotate":
+        angle = args[0] if args else 360
+        length = max(float(args[1]) if len(args) > 1 else 1.0, 0.001)
+        return [f"rotate=a='if(lt(t,{length:.3f}),{angle}*PI/180*t/{length:.3f},0)':c=black"]
+    if name == "pan":
+        direction = args[0] if args else "left"
+        speed = args[1] if len(args) > 1 else 50
+        distance = speed * duration
+        if direction == "left":
+            return _translate_filters(size, f"-{speed}*t", "0", x_range=(-distance, 0))
+        if direction == "right":
+            return _translate_filters(size, f"{speed}*t", "0", x_range=(0, distance))
+        if direction == "up":
+            return _translate_filters(size, "0", f"-{speed}*t", y_range=(-distance, 0))
+        return _translate_filters(size, "0", f"{speed}*t", y_range=(0, distance))
+    if name == "shake":
+        intensity = args[0] if args else 5.0
+        frequency = args[1] if len(args) > 1 else 10.0
+        return _translate_filters(
+            size,
+            f"{intensity}*sin(2*PI*{frequency}*t)",
+            f"{intensity}*cos(2*PI*{frequency}*t*1.3)",
+            x_range=(-intensity, intensity),
+            y_range=(-intensity, intensity),
+        )
+
+    return None
+
+
+_LUTRGB_PATTERN = re.compile(r"^lutrgb=r='([^']*)':g='([^']*)':b='([^']*)'$")
+
+
+def _fuse_lutrgb(filters: List[str]) -> List[str]:
+    # 相邻的 lutrgb 通过表达式代入合并为一个，编码时每帧只查一次表
+    fused = []
+    for f in filters:
+        current = _LUTRGB_PATTERN.match(f)
+        previous = _LUTRGB_PATTERN.match(fused[-1]) if fused else None
+        if current and previous:
+            channels = [
+                re.sub(r"\bval\b", f"({before})", after)
+                for before, after in zip(previous.groups(), current.groups())
+            ]
+            fused[-1] = _lutrgb(*channels)
+        else:
+            fused.append(f)
+    return fused
+
+
+def effect_plan_to_ffmpeg(plan: list, duration: float, size: Tuple[int, int], fps: int = 30) -> Optional[List[str]]:
+    """将效果计划翻译为 ffmpeg 滤镜链，只要有一个效果无法原生表达就返回 None"""
+    filters = []
+    for effect in plan or []:
+        effect_filters = effect_to_ffmpeg(effect, duration, size, fps)
+        if effect_filters is None:
+            return None
+        filters.extend(effect_filters)
+    return _fuse_lutrgb(filters)
+
+
 # ========================================
 # 🎨 导出函数
 # ========================================
@@ -1,33 +1,42 @@
+import copy
+import functools
 import glob
-import itertools
+import json
 import os
 import random
 import gc
 import shutil
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
 from loguru import logger
 from moviepy import (
-    AudioFileClip,
-    ColorClip,
-    CompositeAudioClip,
-    CompositeVideoClip,
-    ImageClip,
-    TextClip,
+    VideoClip,
     VideoFileClip,
-    afx,
     concatenate_videoclips,
 )
-from moviepy.video.tools.subtitles import SubtitlesClip
-from PIL import ImageFont
+from moviepy.video.tools.subtitles import file_to_subtitles
+from PIL import Image, ImageFont
 
+from app.config import config
 from app.models import const
 from app.models.schema import (
     MaterialInfo,
+    RenderMode,
     VideoAspect,
     VideoConcatMode,
     VideoParams,
     VideoTransitionMode,
 )
+from app.services import (
+    bgm_library,
+    clip_cache,
+    image_clip,
+    material_reader,
+    probe,
+    renderer,
+    scene_detect,
+    subtitle_overlay,
+)
 from app.services.utils import video_effects
 from app.utils import utils
 
@@ -38,6 +47,7 @@ class SubClippedVideoClip:
         self.end_time = end_time
         self.width = width
         self.height = height
+        self.effects = []
         if duration is None:
             self.duration = end_time - start_time
         else:
@@ -51,6 +61,24 @@ audio_codec = "aac"
 video_codec = "libx264"
 fps = 30
 
+# 草稿模式：低分辨率、低帧率、最快的编码预设，用于快速检查节奏、片段选择和字幕
+draft_short_side = 360
+draft_fps = 15
+draft_preset = "ultrafast"
+
+
+def is_draft(render_mode) -> bool:
+    return render_mode is not None and RenderMode(render_mode) == RenderMode.draft
+
+
+def get_render_resolution(video_aspect: VideoAspect, render_mode: RenderMode = RenderMode.final):
+    video_width, video_height = VideoAspect(video_aspect).to_resolution()
+    if is_draft(render_mode):
+        scale = draft_short_side / min(video_width, video_height)
+        video_width = round(video_width * scale / 2) * 2
+        video_height = round(video_height * scale / 2) * 2
+    return video_width, video_height
+
 def close_clip(clip):
     if clip is None:
         return
@@ -115,6 +143,36 @@ def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
     return ""
 
 
+def mix_audio_track(audio_path: str, output_file: str, duration: float, params: VideoParams) -> str:
+    """
+    Mix the voice and the background music of a task into one AAC track that
+    covers `duration` seconds. The track is prepared once and muxed into every
+    video of the task.
+    """
+    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+    if bgm_file:
+        # indexed tracks are mixed from their decoded copy at the target loudness,
+        # a track that is not analysed yet is mixed as it is this time
+        track = bgm_library.get_track(bgm_file)
+        if track:
+            bgm_file = track["normalized_file"]
+        try:
+            return renderer.mix_audio(
+                audio_path,
+                output_file,
+                duration,
+                voice_volume=params.voice_volume,
+                bgm_file=bgm_file,
+                bgm_volume=params.bgm_volume,
+                codec=audio_codec,
+            )
+        except Exception as e:
+            logger.error(f"failed to add bgm: {str(e)}")
+    return renderer.mix_audio(
+        audio_path, output_file, duration, voice_volume=params.voice_volume, codec=audio_codec
+    )
+
+
 def detect_content_type(video_subject: str) -> str:
     """根据视频主题检测内容类型，用于智能效果推荐"""
     subject_lower = video_subject.lower()
@@ -142,264 +200,467 @@ def detect_content_type(video_subject: str) -> str:
     return "general"
 
 
-def apply_enhanced_transitions(clip, video_transition_mode, clip_index, total_clips, content_type="general"):
-    """应用增强的转场效果"""
-    try:
-        shuffle_side = random.choice(["left", "right", "top", "bottom"])
-        
-        if video_transition_mode.value == VideoTransitionMode.none.value:
-            # 即使选择无转场，也应用轻微的专业增强
-            clip = video_effects.apply_professional_enhancement(clip, "light")
-            
-        elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-            clip = video_effects.fadein_transition(clip, 1)
-            # 添加专业增强
-            clip = video_effects.apply_professional_enhancement(clip, "medium")
-            
-        elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-            clip = video_effects.fadeout_transition(clip, 1)
-            clip = video_effects.apply_professional_enhancement(clip, "medium")
-            
-        elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-            clip = video_effects.slidein_transition(clip, 1, shuffle_side)
-            clip = video_effects.apply_professional_enhancement(clip, "medium")
-            
-        elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-            clip = video_effects.slideout_transition(clip, 1, shuffle_side)
-            clip = video_effects.apply_professional_enhancement(clip, "medium")
-            
-        elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-            # 使用新的专业转场效果
-            enhanced_transitions = [
-                lambda c: video_effects.fadein_transition(c, 1),
-                lambda c: video_effects.fadeout_transition(c, 1),
-                lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                lambda c: video_effects.zoom_in_transition(c, 1.1, 1),
-                lambda c: video_effects.zoom_out_transition(c, 1.1, 1),
-                lambda c: video_effects.apply_random_filter(c),
-            ]
-            shuffle_transition = random.choice(enhanced_transitions)
-            clip = shuffle_transition(clip)
-            
-            # 应用智能效果
-            clip = video_effects.apply_smart_effects(clip, clip_index, total_clips, content_type)
-        
-        # 根据内容类型应用额外的视觉增强
-        if content_type == "tech":
-            # 技术类内容：现代、清晰、专业
-            clip = video_effects.apply_cinematic_filter(clip, 0.3)
-            clip = video_effects.adjust_contrast(clip, 1.1)
-            
-        elif content_type == "lifestyle":
-            # 生活方式：温暖、自然
-            clip = video_effects.color_temperature_warm(clip, 0.2)
-            clip = video_effects.adjust_brightness(clip, 1.05)
-            
-        elif content_type == "business":
-            # 商务：专业、稳重
-            clip = video_effects.adjust_contrast(clip, 1.05)
-            clip = video_effects.apply_professional_enhancement(clip, "light")
-            
-        elif content_type == "creative":
-            # 创意：艺术、个性
-            clip = video_effects.apply_vintage_filter(clip, 0.3)
-            clip = video_effects.adjust_saturation(clip, 1.1)
-        
-        return clip
-        
-    except Exception as e:
-        logger.warning(f"增强转场效果应用失败，使用基础效果: {e}")
-        # 回退到基础转场效果
-        if video_transition_mode.value == VideoTransitionMode.fade_in.value:
-            return video_effects.fadein_transition(clip, 1)
-        elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-            return video_effects.fadeout_transition(clip, 1)
-        else:
-            return clip
+def _transition_mode_value(video_transition_mode) -> str:
+    if video_transition_mode is None:
+        return VideoTransitionMode.none.value
+    return VideoTransitionMode(video_transition_mode).value
 
 
-def combine_videos(
+def plan_enhanced_transitions(video_transition_mode, clip_index, total_clips, content_type="general", rng: random.Random = None) -> list:
+    """生成增强转场效果的效果计划"""
+    rng = rng or random
+    shuffle_side = rng.choice(["left", "right", "top", "bottom"])
+    mode = _transition_mode_value(video_transition_mode)
+    plan = []
+
+    if mode == VideoTransitionMode.none.value:
+        # 即使选择无转场，也应用轻微的专业增强
+        plan += video_effects.professional_enhancement_plan("light")
+
+    elif mode == VideoTransitionMode.fade_in.value:
+        plan.append(("fade_in", 1))
+        # 添加专业增强
+        plan += video_effects.professional_enhancement_plan("medium")
+
+    elif mode == VideoTransitionMode.fade_out.value:
+        plan.append(("fade_out", 1))
+        plan += video_effects.professional_enhancement_plan("medium")
+
+    elif mode == VideoTransitionMode.slide_in.value:
+        plan.append(("slide_in", 1, shuffle_side))
+        plan += video_effects.professional_enhancement_plan("medium")
+
+    elif mode == VideoTransitionMode.slide_out.value:
+        plan.append(("slide_out", 1, shuffle_side))
+        plan += video_effects.professional_enhancement_plan("medium")
+
+    elif mode == VideoTransitionMode.shuffle.value:
+        # 使用新的专业转场效果
+        enhanced_transitions = [
+            lambda: [("fade_in", 1)],
+            lambda: [("fade_out", 1)],
+            lambda: [("slide_in", 1, shuffle_side)],
+            lambda: [("slide_out", 1, shuffle_side)],
+            lambda: [("zoom_in", 1.1, 1)],
+            lambda: [("zoom_out", 1.1, 1)],
+            lambda: video_effects.random_filter_plan(rng),
+        ]
+        plan += rng.choice(enhanced_transitions)()
+
+        # 应用智能效果
+        plan += video_effects.smart_effects_plan(clip_index, total_clips, content_type)
+
+    # 根据内容类型应用额外的视觉增强
+    if content_type == "tech":
+        # 技术类内容：现代、清晰、专业
+        plan += [("cinematic", 0.3), ("contrast", 1.1)]
+
+    elif content_type == "lifestyle":
+        # 生活方式：温暖、自然
+        plan += [("warm", 0.2), ("brightness", 1.05)]
+
+    elif content_type == "business":
+        # 商务：专业、稳重
+        plan.append(("contrast", 1.05))
+        plan += video_effects.professional_enhancement_plan("light")
+
+    elif content_type == "creative":
+        # 创意：艺术、个性
+        plan += [("vintage", 0.3), ("saturation", 1.1)]
+
+    return plan
+
+
+def plan_basic_transitions(video_transition_mode, rng: random.Random = None) -> list:
+    """生成基础转场效果的效果计划（不启用专业效果时使用）"""
+    rng = rng or random
+    shuffle_side = rng.choice(["left", "right", "top", "bottom"])
+    mode = _transition_mode_value(video_transition_mode)
+
+    if mode == VideoTransitionMode.fade_in.value:
+        return [("fade_in", 1)]
+    elif mode == VideoTransitionMode.fade_out.value:
+        return [("fade_out", 1)]
+    elif mode == VideoTransitionMode.slide_in.value:
+        return [("slide_in", 1, shuffle_side)]
+    elif mode == VideoTransitionMode.slide_out.value:
+        return [("slide_out", 1, shuffle_side)]
+    elif mode == VideoTransitionMode.shuffle.value:
+        transition_plans = [
+            [("fade_in", 1)],
+            [("fade_out", 1)],
+            [("slide_in", 1, shuffle_side)],
+            [("slide_out", 1, shuffle_side)],
+        ]
+        return rng.choice(transition_plans)
+    return []
+
+
+def plan_clip_effects(
+    video_transition_mode,
+    clip_index: int,
+    total_clips: int,
+    content_type: str = "general",
+    enable_professional_effects: bool = True,
+    effect_preset: str = "auto",
+    rng: random.Random = None,
+) -> list:
+    """决定单个片段要应用的效果计划，随机选择由 rng 决定"""
+    if not enable_professional_effects:
+        # 使用原有的基础转场效果
+        return plan_basic_transitions(video_transition_mode, rng)
+
+    # 应用效果预设
+    if effect_preset != "auto" and effect_preset in video_effects.EFFECT_PRESETS:
+        return video_effects.preset_effects_plan(effect_preset)
+
+    # 使用智能效果推荐
+    return plan_enhanced_transitions(video_transition_mode, clip_index, total_clips, content_type, rng)
+
+
+def get_crossfade_duration(video_transition_mode, enable_professional_effects: bool) -> float:
+    # 片段间的交叉淡化只在专业效果 + 随机转场时启用
+    if enable_professional_effects and _transition_mode_value(video_transition_mode) == VideoTransitionMode.shuffle.value:
+        return 0.5
+    return 0.0
+
+
+def get_final_enhancement_level(content_type: str) -> str:
+    if content_type == "tech":
+        return "strong"
+    elif content_type in ["lifestyle", "creative"]:
+        return "medium"
+    return "light"
+
+
+def select_timeline_clips(subclipped_items: List[SubClippedVideoClip], audio_duration: float, crossfade: float = 0.0) -> List[SubClippedVideoClip]:
+    """
+    Pick the fewest clips in order that cover the audio duration, the last clip
+    is shortened to end with the audio. Crossfades overlap neighbouring clips,
+    so every transition is subtracted from the timeline duration. Clips are
+    only repeated when all materials together are shorter than the audio.
+    """
+    selected = []
+    video_duration = 0
+    for item in subclipped_items:
+        if video_duration >= audio_duration:
+            break
+        selected.append(item)
+        video_duration += item.duration - (crossfade if len(selected) > 1 else 0)
+
+    if selected and video_duration < audio_duration:
+        logger.warning(f"video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s), repeating clips to match audio length.")
+        base_count = len(selected)
+        while video_duration < audio_duration:
+            item = selected[(len(selected) - base_count) % base_count]
+            selected.append(item)
+            video_duration += item.duration - crossfade
+        logger.info(f"video duration: {video_duration:.2f}s, audio duration: {audio_duration:.2f}s, repeated {len(selected)-base_count} clips")
+
+    # a short tail keeps frame rounding of the clips from cutting the end of the audio
+    overshoot = video_duration - audio_duration - 0.1
+    if selected and overshoot > 0.01:
+        # the clip still has to outlast the crossfade into it
+        last = selected[-1]
+        duration = max(last.duration - overshoot, crossfade + 0.5, 0.5)
+        if duration < last.duration:
+            last = copy.copy(last)
+            last.end_time = round(last.start_time + duration, 3)
+            last.duration = last.end_time - last.start_time
+            selected[-1] = last
+
+    return selected
+
+
+def get_fill_mode() -> str:
+    """
+    How clips with another aspect ratio fill the frame: "black" pads them with
+    black bars, "blur" fills the bars with a blurred copy of the clip.
+    """
+    fill_mode = config.app.get("video_fill_mode", "black")
+    if fill_mode not in ("black", "blur"):
+        logger.warning(f"unknown video_fill_mode: {fill_mode}, using black")
+        return "black"
+    return fill_mode
+
+
+def get_intermediate_encoding() -> tuple:
+    """
+    x264 preset and encoder arguments of intermediate files, see
+    `intermediate_profile` in the config. Only the final video uses the slow preset.
+    """
+    return renderer.intermediate_encoding(config.app.get("intermediate_profile", "fast"))
+
+
+def get_scratch_dir(output_dir: str) -> str:
+    """
+    Directory of the intermediate files of a task. With `scratch_dir` in the
+    config (e.g. a tmpfs mount) they are kept out of the task directory.
+    """
+    scratch_dir = config.app.get("scratch_dir", "")
+    if not scratch_dir:
+        return output_dir
+    d = os.path.join(scratch_dir, os.path.basename(os.path.normpath(output_dir)))
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def remove_scratch_dir(output_dir: str):
+    d = get_scratch_dir(output_dir)
+    if d != output_dir:
+        try:
+            # only removed when empty, other stages of the task may still use it
+            os.rmdir(d)
+        except OSError:
+            pass
+
+
+def get_timeline_duration(
+    subclipped_items: List[SubClippedVideoClip], audio_duration: float, crossfade: float = 0.0
+) -> float:
+    """Duration of the video rendered from a planned timeline."""
+    clips = select_timeline_clips(subclipped_items, audio_duration, crossfade)
+    return sum(clip.duration for clip in clips) - crossfade * max(len(clips) - 1, 0)
+
+
+def render_single_pass(
     combined_video_path: str,
-    video_paths: List[str],
-    audio_file: str,
-    video_aspect: VideoAspect = VideoAspect.portrait,
-    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
-    video_transition_mode: VideoTransitionMode = None,
-    max_clip_duration: int = 5,
+    subclipped_items: List[SubClippedVideoClip],
+    audio_duration: float,
+    video_width: int,
+    video_height: int,
+    crossfade: float = 0.0,
     threads: int = 2,
-    video_subject: str = "",  # 新增：用于智能效果推荐
-    enable_professional_effects: bool = True,  # 新增：是否启用专业效果
-    effect_preset: str = "auto",  # 新增：效果预设
+    fps: int = fps,
+    preset: str = "",
+    encoder_params: List[str] = None,
 ) -> str:
-    audio_clip = AudioFileClip(audio_file)
-    audio_duration = audio_clip.duration
-    logger.info(f"audio duration: {audio_duration} seconds")
-    
-    # 检测内容类型用于智能效果推荐
-    content_type = detect_content_type(video_subject) if video_subject else "general"
-    logger.info(f"detected content type: {content_type}")
-    
-    # Required duration of each clip
-    req_dur = audio_duration / len(video_paths)
-    req_dur = max_clip_duration
-    logger.info(f"maximum clip duration: {req_dur} seconds")
-    output_dir = os.path.dirname(combined_video_path)
+    """Trim, scale/pad, apply effects and join all clips with one ffmpeg encode."""
+    timeline = select_timeline_clips(subclipped_items, audio_duration, crossfade)
+    if not timeline:
+        raise ValueError("no clips available for rendering")
 
-    aspect = VideoAspect(video_aspect)
-    video_width, video_height = aspect.to_resolution()
+    logger.info(f"rendering {len(timeline)} clips in a single pass")
+    return renderer.render_timeline(
+        output_file=combined_video_path,
+        clips=timeline,
+        width=video_width,
+        height=video_height,
+        fps=fps,
+        crossfade=crossfade,
+        codec=video_codec,
+        threads=threads,
+        preset=preset,
+        fill_mode=get_fill_mode(),
+        encoder_params=encoder_params,
+    )
 
-    processed_clips = []
-    subclipped_items = []
-    video_duration = 0
-    for video_path in video_paths:
-        clip = VideoFileClip(video_path)
-        clip_duration = clip.duration
-        clip_w, clip_h = clip.size
-        close_clip(clip)
-        
-        start_time = 0
-
-        while start_time < clip_duration:
-            end_time = min(start_time + max_clip_duration, clip_duration)            
-            if clip_duration - start_time >= max_clip_duration:
-                subclipped_items.append(SubClippedVideoClip(file_path= video_path, start_time=start_time, end_time=end_time, width=clip_w, height=clip_h))
-            start_time = end_time    
-            if video_concat_mode.value == VideoConcatMode.sequential.value:
-                break
 
-    # random subclipped_items order
-    if video_concat_mode.value == VideoConcatMode.random.value:
-        random.shuffle(subclipped_items)
-        
-    logger.debug(f"total subclipped items: {len(subclipped_items)}")
-    
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
-    for i, subclipped_item in enumerate(subclipped_items):
-        if video_duration > audio_duration:
-            break
-        
-        logger.debug(f"processing clip {i+1}: {subclipped_item.width}x{subclipped_item.height}, current duration: {video_duration:.2f}s, remaining: {audio_duration - video_duration:.2f}s")
-        
+def render_subclip(
+    subclipped_item: SubClippedVideoClip,
+    clip_file: str,
+    video_width: int,
+    video_height: int,
+    max_clip_duration: int,
+) -> SubClippedVideoClip:
+    """
+    Render one subclip to `clip_file`. Rendered clips are stored in the clip
+    cache, the same subclip with the same effects is reused across tasks.
+    """
+    def get_cache_key(engine: str) -> str:
+        return clip_cache.clip_key(
+            subclipped_item,
+            video_width,
+            video_height,
+            fps,
+            video_codec,
+            max_clip_duration,
+            get_fill_mode(),
+            config.app.get("intermediate_profile", "fast"),
+            engine,
+        )
+
+    engine = config.app.get("video_render_engine", "ffmpeg")
+    cache_key = None
+    if clip_cache.is_enabled():
+        cache_key = get_cache_key(engine)
+        if clip_cache.get(cache_key, clip_file):
+            return SubClippedVideoClip(
+                file_path=clip_file,
+                duration=min(subclipped_item.duration, max_clip_duration),
+                width=subclipped_item.width,
+                height=subclipped_item.height,
+            )
+
+    # the clip is written to a temp file and moved into place: a clip file left by
+    # an earlier run may be a hard link of a cache entry, writing into it would
+    # change the cached clip for every task
+    temp_file = f"{clip_file}.{os.getpid()}.tmp.mp4"
+    processed_clip = None
+    try:
+        if engine == "ffmpeg":
+            preset, encoder_params = get_intermediate_encoding()
+            try:
+                renderer.render_timeline(
+                    temp_file,
+                    [subclipped_item],
+                    video_width,
+                    video_height,
+                    fps=fps,
+                    codec=video_codec,
+                    preset=preset,
+                    fill_mode=get_fill_mode(),
+                    encoder_params=encoder_params,
+                )
+                processed_clip = SubClippedVideoClip(
+                    file_path=clip_file,
+                    duration=subclipped_item.duration,
+                    width=subclipped_item.width,
+                    height=subclipped_item.height,
+                )
+            except Exception as e:
+                logger.debug(f"failed to render clip with ffmpeg, using moviepy: {str(e)}")
+        if processed_clip is None:
+            processed_clip = render_subclip_moviepy(subclipped_item, temp_file, video_width, video_height, max_clip_duration)
+            processed_clip.file_path = clip_file
+            # the clip is cached as what it is, a moviepy render
+            if cache_key and engine != "moviepy":
+                cache_key = get_cache_key("moviepy")
+        os.replace(temp_file, clip_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    if cache_key:
+        clip_cache.put(cache_key, clip_file)
+    return processed_clip
+
+
+def render_subclip_moviepy(
+    subclipped_item: SubClippedVideoClip,
+    clip_file: str,
+    video_width: int,
+    video_height: int,
+    max_clip_duration: int,
+) -> SubClippedVideoClip:
+    """Resize one subclip to the target resolution, apply its effects and write it to `clip_file`."""
+    clip_w, clip_h = subclipped_item.width, subclipped_item.height
+    if not clip_w or not clip_h:
+        media_info = probe.probe_media(subclipped_item.file_path)
+        clip_w, clip_h = media_info.width, media_info.height
+
+    # Not all videos are same size, the decoder scales them to fit the target resolution
+    # and the reader pads them, letterboxing is not composited per frame
+    logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, target: {video_width}x{video_height}")
+    source_clip = material_reader.open_fitted_video(
+        subclipped_item.file_path, clip_w, clip_h, video_width, video_height, get_fill_mode()
+    )
+    clip = source_clip.subclipped(subclipped_item.start_time, subclipped_item.end_time)
+
+    # 🎬 应用增强的转场和视觉效果
+    clip = video_effects.apply_effect_plan(clip, subclipped_item.effects)
+
+    if clip.duration > max_clip_duration:
+        clip = clip.subclipped(0, max_clip_duration)
+
+    # wirte clip to temp file
+    preset, encoder_params = get_intermediate_encoding()
+    clip.write_videofile(
+        clip_file,
+        logger=None,
+        fps=fps,
+        codec=video_codec,
+        audio=False,
+        preset=preset or "medium",
+        ffmpeg_params=encoder_params,
+    )
+    duration = clip.duration
+    # the source reader is shared with the next subclips of the same file, it is closed by the reader pool
+
+    return SubClippedVideoClip(file_path=clip_file, duration=duration, width=clip_w, height=clip_h)
+
+
+def render_subclips(
+    subclipped_items: List[SubClippedVideoClip],
+    output_dir: str,
+    video_width: int,
+    video_height: int,
+    max_clip_duration: int,
+    workers: int = 1,
+    first_index: int = 0,
+) -> Dict[int, SubClippedVideoClip]:
+    """
+    Render subclips to temp clip files, using a process pool when `workers` > 1.
+    Returns the rendered clips by their index in `subclipped_items`, clips that
+    failed to render are left out. Temp files are numbered from `first_index`.
+    """
+    results = {}
+
+    def collect(index, get_result):
         try:
-            clip = VideoFileClip(subclipped_item.file_path).subclipped(subclipped_item.start_time, subclipped_item.end_time)
-            clip_duration = clip.duration
-            # Not all videos are same size, so we need to resize them
-            clip_w, clip_h = clip.size
-            if clip_w != video_width or clip_h != video_height:
-                clip_ratio = clip.w / clip.h
-                video_ratio = video_width / video_height
-                logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, ratio: {clip_ratio:.2f}, target: {video_width}x{video_height}, ratio: {video_ratio:.2f}")
-                
-                if clip_ratio == video_ratio:
-                    clip = clip.resized(new_size=(video_width, video_height))
-                else:
-                    if clip_ratio > video_ratio:
-                        scale_factor = video_width / clip_w
-                    else:
-                        scale_factor = video_height / clip_h
-
-                    new_width = int(clip_w * scale_factor)
-                    new_height = int(clip_h * scale_factor)
-
-                    background = ColorClip(size=(video_width, video_height), color=(0, 0, 0)).with_duration(clip_duration)
-                    clip_resized = clip.resized(new_size=(new_width, new_height)).with_position("center")
-                    clip = CompositeVideoClip([background, clip_resized])
-            
-            # 🎬 应用增强的转场和视觉效果
-            if enable_professional_effects:
-                # 应用效果预设
-                if effect_preset != "auto" and effect_preset in video_effects.EFFECT_PRESETS:
-                    logger.info(f"applying effect preset: {effect_preset}")
-                    clip = video_effects.apply_preset_effects(clip, effect_preset)
-                else:
-                    # 使用智能效果推荐
-                    clip = apply_enhanced_transitions(clip, video_transition_mode, i, len(subclipped_items), content_type)
-            else:
-                # 使用原有的基础转场效果
-                shuffle_side = random.choice(["left", "right", "top", "bottom"])
-                if video_transition_mode.value == VideoTransitionMode.none.value:
-                    clip = clip
-                elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                    clip = video_effects.fadein_transition(clip, 1)
-                elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                    clip = video_effects.fadeout_transition(clip, 1)
-                elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-                    clip = video_effects.slidein_transition(clip, 1, shuffle_side)
-                elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-                    clip = video_effects.slideout_transition(clip, 1, shuffle_side)
-                elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-                    transition_funcs = [
-                        lambda c: video_effects.fadein_transition(c, 1),
-                        lambda c: video_effects.fadeout_transition(c, 1),
-                        lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                        lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                    ]
-                    shuffle_transition = random.choice(transition_funcs)
-                    clip = shuffle_transition(clip)
-
-            if clip.duration > max_clip_duration:
-                clip = clip.subclipped(0, max_clip_duration)
-                
-            # wirte clip to temp file
-            clip_file = f"{output_dir}/temp-clip-{i+1}.mp4"
-            clip.write_videofile(clip_file, logger=None, fps=fps, codec=video_codec)
-            
-            close_clip(clip)
-        
-            processed_clips.append(SubClippedVideoClip(file_path=clip_file, duration=clip.duration, width=clip_w, height=clip_h))
-            video_duration += clip.duration
-            
+            results[index] = get_result()
         except Exception as e:
-            logger.error(f"failed to process clip: {str(e)}")
-    
-    # loop processed clips until the video duration matches or exceeds the audio duration.
-    if video_duration < audio_duration:
-        logger.warning(f"video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s), looping clips to match audio length.")
-        base_clips = processed_clips.copy()
-        for clip in itertools.cycle(base_clips):
-            if video_duration >= audio_duration:
-                break
-            processed_clips.append(clip)
-            video_duration += clip.duration
-        logger.info(f"video duration: {video_duration:.2f}s, audio duration: {audio_duration:.2f}s, looped {len(processed_clips)-len(base_clips)} clips")
-     
-    # merge video clips progressively, avoid loading all videos at once to avoid memory overflow
-    logger.info("starting clip merging process")
-    if not processed_clips:
-        logger.warning("no clips available for merging")
-        return combined_video_path
-    
-    # if there is only one clip, use it directly
-    if len(processed_clips) == 1:
-        logger.info("using single clip directly")
-        shutil.copy(processed_clips[0].file_path, combined_video_path)
-        delete_files(processed_clips)
-        logger.info("video combining completed")
-        return combined_video_path
-    
+            logger.error(f"failed to process clip {index+1}: {str(e)}")
+
+    def render_args(index, subclipped_item):
+        logger.debug(f"processing clip {index+1}: {subclipped_item.width}x{subclipped_item.height}, {subclipped_item.file_path}")
+        return (subclipped_item, f"{output_dir}/temp-clip-{first_index+index+1}.mp4", video_width, video_height, max_clip_duration)
+
+    # subclips of the same file are rendered one after another, so they share a
+    # material reader that only seeks forward
+    order = sorted(
+        range(len(subclipped_items)),
+        key=lambda i: (subclipped_items[i].file_path, subclipped_items[i].start_time or 0),
+    )
+
+    if workers <= 1 or len(subclipped_items) <= 1:
+        try:
+            for index in order:
+                args = render_args(index, subclipped_items[index])
+                collect(index, lambda: render_subclip(*args))
+        finally:
+            material_reader.close_all()
+        return results
+
+    logger.info(f"rendering {len(subclipped_items)} clips with {workers} worker processes")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(render_subclip, *render_args(index, subclipped_items[index])): index
+            for index in order
+        }
+        for future in as_completed(futures):
+            collect(futures[future], future.result)
+
+    return results
+
+
+def merge_clips_progressively(combined_video_path: str, processed_clips: List[SubClippedVideoClip], crossfade: float = 0.0, threads: int = 2):
+    """Merge clip files one by one with moviepy, used when ffmpeg rendering is unavailable."""
+    output_dir = get_scratch_dir(os.path.dirname(combined_video_path))
+    preset, encoder_params = get_intermediate_encoding()
+
     # create initial video file as base
     base_clip_path = processed_clips[0].file_path
     temp_merged_video = f"{output_dir}/temp-merged-video.mp4"
     temp_merged_next = f"{output_dir}/temp-merged-next.mp4"
-    
+
     # copy first clip as initial merged video
     shutil.copy(base_clip_path, temp_merged_video)
-    
+
     # merge remaining video clips one by one
     for i, clip in enumerate(processed_clips[1:], 1):
         logger.info(f"merging clip {i}/{len(processed_clips)-1}, duration: {clip.duration:.2f}s")
-        
+
         try:
             # load current base video and next clip to merge
             base_clip = VideoFileClip(temp_merged_video)
             next_clip = VideoFileClip(clip.file_path)
-            
+
             # 🎬 在合并时应用片段间转场效果
-            if enable_professional_effects and video_transition_mode.value == VideoTransitionMode.shuffle.value:
+            if crossfade > 0:
                 # 使用专业的片段间转场
                 try:
-                    merged_clip = video_effects.crossfade_transition(base_clip, next_clip, 0.5)
+                    merged_clip = video_effects.crossfade_transition(base_clip, next_clip, crossfade)
                 except:
                     # 如果专业转场失败，使用标准拼接
                     merged_clip = concatenate_videoclips([base_clip, next_clip])
@@ -415,67 +676,469 @@ def combine_videos(
                 temp_audiofile_path=output_dir,
                 audio_codec=audio_codec,
                 fps=fps,
+                preset=preset or "medium",
+                ffmpeg_params=encoder_params,
             )
             close_clip(base_clip)
             close_clip(next_clip)
             close_clip(merged_clip)
-            
+
             # replace base file with new merged file
             delete_files(temp_merged_video)
             os.rename(temp_merged_next, temp_merged_video)
-            
+
         except Exception as e:
             logger.error(f"failed to merge clip: {str(e)}")
             continue
-    
+
     # after merging, rename final result to target file name
-    os.rename(temp_merged_video, combined_video_path)
+    shutil.move(temp_merged_video, combined_video_path)
+
+
+def build_subclipped_items(video_paths: List[str], max_clip_duration: int, video_concat_mode: VideoConcatMode) -> List[SubClippedVideoClip]:
+    """
+    Cut every source video into clips of at most `max_clip_duration` seconds.
+    Cuts follow the scene boundaries of the video, a clip never spans two
+    scenes, and the shorter rest of a scene is kept when it is long enough.
+    """
+    subclipped_items = []
+    for video_path in video_paths:
+        try:
+            media_info = probe.probe_media(video_path)
+        except Exception as e:
+            logger.warning(f"failed to probe video, skip it: {video_path}, {str(e)}")
+            continue
+        clip_w, clip_h = media_info.width, media_info.height
+
+        cuts = scene_detect.plan_cuts(media_info.duration, scene_detect.get_scenes(video_path), max_clip_duration)
+        if video_concat_mode.value == VideoConcatMode.sequential.value:
+            cuts = cuts[:1]
+        for start_time, end_time in cuts:
+            subclipped_items.append(SubClippedVideoClip(file_path=video_path, start_time=start_time, end_time=end_time, width=clip_w, height=clip_h))
+
+    logger.debug(f"total subclipped items: {len(subclipped_items)}")
+    return subclipped_items
+
+
+def plan_variant_clips(
+    subclipped_items: List[SubClippedVideoClip],
+    seed: int,
+    variant: int,
+    video_concat_mode: VideoConcatMode,
+    video_transition_mode: VideoTransitionMode,
+    content_type: str,
+    enable_professional_effects: bool,
+    effect_preset: str,
+) -> List[SubClippedVideoClip]:
+    """决定一个视频的片段顺序和每个片段的效果，返回全部片段，时间线从中按顺序选取"""
+    ordered_items = [copy.copy(item) for item in subclipped_items]
+
+    # random subclipped_items order
+    if video_concat_mode.value == VideoConcatMode.random.value:
+        random.Random(f"{seed}:{variant}").shuffle(ordered_items)
+
+    for i, subclipped_item in enumerate(ordered_items):
+        # 随机效果只由种子和片段本身决定，同一片段每次得到相同的效果，渲染结果可以被片段缓存复用
+        clip_rng = random.Random(f"{seed}:{os.path.basename(subclipped_item.file_path)}:{subclipped_item.start_time}")
+        subclipped_item.effects = plan_clip_effects(
+            video_transition_mode,
+            clip_index=i,
+            total_clips=len(ordered_items),
+            content_type=content_type,
+            enable_professional_effects=enable_professional_effects,
+            effect_preset=effect_preset,
+            rng=clip_rng,
+        )
+        if enable_professional_effects:
+            # 整体增强并入每个片段的效果链，避免对合成后的视频再做一次完整的解码和编码
+            subclipped_item.effects += video_effects.professional_enhancement_plan(
+                get_final_enhancement_level(content_type)
+            )
+
+    return ordered_items
+
+
+def plan_variant_timeline(
+    subclipped_items: List[SubClippedVideoClip],
+    audio_duration: float,
+    seed: int,
+    variant: int,
+    video_concat_mode: VideoConcatMode,
+    video_transition_mode: VideoTransitionMode,
+    content_type: str,
+    enable_professional_effects: bool,
+    effect_preset: str,
+    crossfade: float,
+) -> List[SubClippedVideoClip]:
+    """决定一个视频使用的片段顺序和每个片段的效果，返回覆盖音频时长的片段列表"""
+    ordered_items = plan_variant_clips(
+        subclipped_items,
+        seed=seed,
+        variant=variant,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        content_type=content_type,
+        enable_professional_effects=enable_professional_effects,
+        effect_preset=effect_preset,
+    )
+    return select_timeline_clips(ordered_items, audio_duration, crossfade)
+
+
+def clip_identity(subclipped_item: SubClippedVideoClip) -> str:
+    return json.dumps([
+        subclipped_item.file_path,
+        subclipped_item.start_time,
+        subclipped_item.end_time,
+        [list(effect) for effect in subclipped_item.effects],
+    ])
+
+
+def join_clips(
+    combined_video_path: str,
+    processed_clips: List[SubClippedVideoClip],
+    audio_duration: float,
+    video_width: int,
+    video_height: int,
+    crossfade: float = 0.0,
+    threads: int = 2,
+) -> str:
+    """Join rendered clip files into one video, the clip files are left in place."""
+    processed_clips = list(processed_clips)
+    video_duration = sum(clip.duration for clip in processed_clips)
+
+    # the timeline was planned to cover the audio, see select_timeline_clips
+    if processed_clips and video_duration < audio_duration - 0.5:
+        logger.warning(f"video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s)")
+
+    logger.info("starting clip merging process")
+    if not processed_clips:
+        logger.warning("no clips available for merging")
+        return combined_video_path
     
-    # clean temp files
+    # if there is only one clip, use it directly
+    if len(processed_clips) == 1:
+        logger.info("using single clip directly")
+        shutil.copy(processed_clips[0].file_path, combined_video_path)
+        return combined_video_path
+
     clip_files = [clip.file_path for clip in processed_clips]
-    delete_files(clip_files)
-    
-    # 🎬 最终视频后处理
-    if enable_professional_effects:
-        logger.info("applying final video enhancement...")
+
+    # without cross-clip transitions the normalized clip files can be joined
+    # as they are, the merge phase then only costs I/O
+    if crossfade <= 0 and renderer.can_concat_copy(clip_files):
         try:
-            final_clip = VideoFileClip(combined_video_path)
-            
-            # 根据内容类型应用最终增强
-            if content_type == "tech":
-                final_clip = video_effects.apply_professional_enhancement(final_clip, "strong")
-            elif content_type in ["lifestyle", "creative"]:
-                final_clip = video_effects.apply_professional_enhancement(final_clip, "medium")
+            return renderer.concat_copy(clip_files, combined_video_path)
+        except Exception as e:
+            logger.warning(f"failed to join clips without re-encoding: {str(e)}")
+
+    # join all clip files with one encode instead of re-encoding the growing
+    # merged file for every clip
+    preset, encoder_params = get_intermediate_encoding()
+    try:
+        renderer.render_timeline(
+            output_file=combined_video_path,
+            clips=processed_clips,
+            width=video_width,
+            height=video_height,
+            fps=fps,
+            crossfade=crossfade,
+            codec=video_codec,
+            threads=threads,
+            preset=preset,
+            encoder_params=encoder_params,
+        )
+    except Exception as e:
+        logger.warning(f"failed to merge clips with ffmpeg, merging progressively: {str(e)}")
+        # merge video clips progressively, avoid loading all videos at once to avoid memory overflow
+        merge_clips_progressively(combined_video_path, processed_clips, crossfade, threads)
+    return combined_video_path
+
+
+def plan_variant_candidates(
+    video_paths: List[str],
+    video_count: int,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    video_subject: str = "",
+    enable_professional_effects: bool = True,
+    effect_preset: str = "auto",
+    seed: int = 0,
+    first_variant: int = 0,
+    render_mode: RenderMode = RenderMode.final,
+) -> tuple:
+    """
+    Plan the clip order, transitions and effects of `video_count` videos from
+    the same materials. Returns all ordered clips of every video, their
+    timelines are selected from them, and the crossfade duration between clips.
+    """
+    # 检测内容类型用于智能效果推荐
+    content_type = detect_content_type(video_subject) if video_subject else "general"
+    logger.info(f"detected content type: {content_type}")
+    
+    logger.info(f"maximum clip duration: {max_clip_duration} seconds")
+
+    # 交叉淡化会改变选取的片段数量，草稿使用与成片相同的交叉淡化，定稿时选取的片段与草稿一致
+    crossfade = get_crossfade_duration(video_transition_mode, enable_professional_effects)
+    if is_draft(render_mode):
+        # 草稿只用于检查节奏和片段选择，不渲染特效和转场
+        logger.info("draft mode: rendering low resolution videos without effects")
+        enable_professional_effects = False
+        video_transition_mode = None
+
+    subclipped_items = build_subclipped_items(video_paths, max_clip_duration, video_concat_mode)
+
+    # 🎬 为每个视频决定片段顺序、转场和视觉效果
+    if enable_professional_effects and effect_preset != "auto" and effect_preset in video_effects.EFFECT_PRESETS:
+        logger.info(f"applying effect preset: {effect_preset}")
+    candidates = [
+        plan_variant_clips(
+            subclipped_items,
+            seed=seed,
+            variant=first_variant + i,
+            video_concat_mode=video_concat_mode,
+            video_transition_mode=video_transition_mode,
+            content_type=content_type,
+            enable_professional_effects=enable_professional_effects,
+            effect_preset=effect_preset,
+        )
+        for i in range(video_count)
+    ]
+    return candidates, crossfade
+
+
+def plan_video_variants(
+    video_paths: List[str],
+    audio_duration: float,
+    video_count: int,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    video_subject: str = "",
+    enable_professional_effects: bool = True,
+    effect_preset: str = "auto",
+    seed: int = 0,
+    first_variant: int = 0,
+    render_mode: RenderMode = RenderMode.final,
+) -> tuple:
+    """
+    Plan the timelines of `video_count` videos from the same materials: clip
+    order, transitions and effects. Returns the timelines and the crossfade
+    duration between their clips.
+    """
+    candidates, crossfade = plan_variant_candidates(
+        video_paths,
+        video_count,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        max_clip_duration=max_clip_duration,
+        video_subject=video_subject,
+        enable_professional_effects=enable_professional_effects,
+        effect_preset=effect_preset,
+        seed=seed,
+        first_variant=first_variant,
+        render_mode=render_mode,
+    )
+    timelines = [select_timeline_clips(items, audio_duration, crossfade) for items in candidates]
+    return timelines, crossfade
+
+
+def combine_video_variants(
+    combined_video_paths: List[str],
+    video_paths: List[str],
+    audio_file: str,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    threads: int = 2,
+    video_subject: str = "",
+    enable_professional_effects: bool = True,
+    effect_preset: str = "auto",
+    seed: int = None,
+    first_variant: int = 0,
+    render_mode: RenderMode = RenderMode.final,
+) -> List[str]:
+    """
+    Combine several videos from the same materials. The timelines of all videos
+    are planned first, every distinct clip is rendered once and each video is
+    then joined from the shared clip files.
+    """
+    if seed is None:
+        seed = random.randrange(2**32)
+    logger.info(f"random seed: {seed}, videos: {len(combined_video_paths)}")
+
+    audio_duration = probe.get_duration(audio_file)
+    logger.info(f"audio duration: {audio_duration} seconds")
+    output_dir = os.path.dirname(combined_video_paths[0])
+
+    draft = is_draft(render_mode)
+    video_width, video_height = get_render_resolution(video_aspect, render_mode)
+    candidates, crossfade = plan_variant_candidates(
+        video_paths,
+        len(combined_video_paths),
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        max_clip_duration=max_clip_duration,
+        video_subject=video_subject,
+        enable_professional_effects=enable_professional_effects,
+        effect_preset=effect_preset,
+        seed=seed,
+        first_variant=first_variant,
+        render_mode=render_mode,
+    )
+    candidates = dict(zip(combined_video_paths, candidates))
+    timelines = [select_timeline_clips(candidates[path], audio_duration, crossfade) for path in combined_video_paths]
+
+    # without crossfades the clips are rendered one by one, so they can be cached
+    # and joined without re-encoding. crossfades would need a second encode of
+    # the cached clips, those timelines are rendered from the sources in one pass
+    pending = list(zip(combined_video_paths, timelines))
+    render_engine = config.app.get("video_render_engine", "ffmpeg")
+    if draft or (render_engine == "ffmpeg" and (crossfade > 0 or not clip_cache.is_enabled())):
+        preset, encoder_params = get_intermediate_encoding()
+        for combined_video_path, timeline in list(pending):
+            try:
+                render_single_pass(
+                    combined_video_path,
+                    timeline,
+                    audio_duration,
+                    video_width,
+                    video_height,
+                    crossfade=crossfade,
+                    threads=threads,
+                    fps=draft_fps if draft else fps,
+                    preset=draft_preset if draft else preset,
+                    encoder_params=encoder_params,
+                )
+                pending.remove((combined_video_path, timeline))
+            except Exception as e:
+                logger.warning(f"single-pass render failed, falling back to per-clip rendering: {str(e)}")
+        if not pending:
+            logger.info("video combining completed")
+            return combined_video_paths
+
+    clip_render_workers = int(config.app.get("clip_render_workers", 1) or 1)
+    rendered_clips = {}
+    failed_clips = set()
+    # materials that failed to render, the part of the source is left out of every video
+    failed_sources = set()
+    while True:
+        # render the union of the clips of all videos once, videos mostly reorder the same clips
+        unique_items = {}
+        for _, timeline in pending:
+            for subclipped_item in timeline:
+                key = clip_identity(subclipped_item)
+                if key not in rendered_clips and key not in failed_clips:
+                    unique_items.setdefault(key, subclipped_item)
+        if not unique_items:
+            break
+        keys = list(unique_items.keys())
+        logger.info(f"rendering {len(keys)} distinct clips for {len(pending)} videos")
+
+        rendered = render_subclips(
+            list(unique_items.values()),
+            get_scratch_dir(output_dir),
+            video_width,
+            video_height,
+            max_clip_duration,
+            workers=clip_render_workers,
+            first_index=len(rendered_clips) + len(failed_clips),
+        )
+        for index, key in enumerate(keys):
+            if index in rendered:
+                rendered_clips[key] = rendered[index]
             else:
-                final_clip = video_effects.apply_professional_enhancement(final_clip, "light")
-            
-            # 保存增强后的视频
-            enhanced_path = f"{output_dir}/enhanced-{os.path.basename(combined_video_path)}"
-            final_clip.write_videofile(
-                enhanced_path,
-                threads=threads,
-                logger=None,
-                temp_audiofile_path=output_dir,
-                audio_codec=audio_codec,
-                fps=fps,
+                failed_clips.add(key)
+                failed_sources.add((unique_items[key].file_path, unique_items[key].start_time))
+        if len(rendered) == len(keys):
+            break
+
+        # the videos are planned again without the failed clips, so they still
+        # cover the audio with the next materials or, when there are none left,
+        # by repeating the clips that were rendered
+        logger.warning(f"{len(keys) - len(rendered)} clips failed to render, planning the videos again without them")
+        pending = [
+            (
+                combined_video_path,
+                select_timeline_clips(
+                    [
+                        item
+                        for item in candidates[combined_video_path]
+                        if (item.file_path, item.start_time) not in failed_sources
+                    ],
+                    audio_duration,
+                    crossfade,
+                ),
             )
-            
-            close_clip(final_clip)
-            
-            # 替换原文件
-            os.replace(enhanced_path, combined_video_path)
-            logger.info("final video enhancement completed")
-            
-        except Exception as e:
-            logger.warning(f"final enhancement failed, using original video: {e}")
-            
+            for combined_video_path, _ in pending
+        ]
+
+    for combined_video_path, timeline in pending:
+        processed_clips = [
+            rendered_clips[clip_identity(item)] for item in timeline if clip_identity(item) in rendered_clips
+        ]
+        join_clips(
+            combined_video_path,
+            processed_clips,
+            audio_duration,
+            video_width,
+            video_height,
+            crossfade=crossfade,
+            threads=threads,
+        )
+
+    # clean temp files
+    delete_files([clip.file_path for clip in rendered_clips.values()])
+    remove_scratch_dir(output_dir)
+
     logger.info("video combining completed")
-    return combined_video_path
+    return combined_video_paths
+
+
+def combine_videos(
+    combined_video_path: str,
+    video_paths: List[str],
+    audio_file: str,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    threads: int = 2,
+    video_subject: str = "",  # 新增：用于智能效果推荐
+    enable_professional_effects: bool = True,  # 新增：是否启用专业效果
+    effect_preset: str = "auto",  # 新增：效果预设
+    seed: int = None,  # 随机种子：片段顺序、转场和滤镜的随机选择都由它决定
+    variant: int = 0,  # 同一种子下的第几个视频，只影响片段顺序
+    render_mode: RenderMode = RenderMode.final,
+) -> str:
+    return combine_video_variants(
+        [combined_video_path],
+        video_paths,
+        audio_file,
+        video_aspect=video_aspect,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        max_clip_duration=max_clip_duration,
+        threads=threads,
+        video_subject=video_subject,
+        enable_professional_effects=enable_professional_effects,
+        effect_preset=effect_preset,
+        seed=seed,
+        first_variant=variant,
+        render_mode=render_mode,
+    )[0]
+
+
+@functools.lru_cache(maxsize=16)
+def load_font(font, fontsize):
+    return ImageFont.truetype(font, fontsize)
 
 
+@functools.lru_cache(maxsize=1024)
 def wrap_text(text, max_width, font="Arial", fontsize=60):
-    # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
+    # Create ImageFont, the font is loaded once per font file and size
+    font = load_font(font, fontsize)
 
     def get_text_size(inner_text):
         inner_text = inner_text.strip()
@@ -527,15 +1190,142 @@ def wrap_text(text, max_width, font="Arial", fontsize=60):
     return result, height
 
 
+def get_encode_segments() -> int:
+    """Number of segments the final video is encoded in, 0 uses one segment per CPU core."""
+    segments = int(config.app.get("final_encode_segments", 1) or 0)
+    if segments <= 0:
+        segments = os.cpu_count() or 1
+    return segments
+
+
+def plan_encode_segments(video_path: str, total_frames: int, frame_rate: int, segments: int, min_frames: int = None) -> List[tuple]:
+    """
+    Split the frames of a video into up to `segments` (start, end) frame ranges.
+    Segments start on keyframes of the video, so every worker seeks to its start
+    without decoding the frames before it.
+    """
+    if min_frames is None:
+        min_frames = frame_rate * 2
+    try:
+        keyframes = sorted({round(t * frame_rate) for t in probe.keyframe_times(video_path)})
+    except Exception as e:
+        logger.warning(f"failed to read keyframes: {video_path}, {str(e)}")
+        keyframes = []
+
+    boundaries = [0]
+    for i in range(1, segments):
+        target = total_frames * i // segments
+        candidates = [
+            k for k in (keyframes or [target])
+            if boundaries[-1] + min_frames <= k <= total_frames - min_frames
+        ]
+        if not candidates:
+            continue
+        boundary = min(candidates, key=lambda k: abs(k - target))
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    boundaries.append(total_frames)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def render_final_segment(
+    video_path: str,
+    overlay,
+    start_frame: int,
+    end_frame: int,
+    segment_file: str,
+    frame_rate: int,
+    preset: str,
+    threads: int,
+) -> str:
+    """Encode the frames [start_frame, end_frame) of the final video without audio, runs in a worker process."""
+    video_clip = VideoFileClip(video_path, audio=False)
+    try:
+        clip = video_clip.transform(overlay) if overlay else video_clip
+        # half a frame of slack, moviepy rounds the number of frames down
+        clip = clip.subclipped(start_frame / frame_rate).with_duration(
+            (end_frame - start_frame + 0.5) / frame_rate
+        )
+        clip.write_videofile(
+            segment_file,
+            fps=frame_rate,
+            codec=video_codec,
+            audio=False,
+            preset=preset,
+            threads=threads,
+            logger=None,
+        )
+    finally:
+        video_clip.close()
+    return segment_file
+
+
+def encode_segmented(
+    video_path: str,
+    overlay,
+    audio_file: str,
+    output_file: str,
+    duration: float,
+    segments: int,
+    frame_rate: int = fps,
+    preset: str = "medium",
+) -> str:
+    """
+    Encode the final video in parallel segments split on keyframes, then join
+    them without re-encoding. The mixed audio track is muxed in when the
+    segments are joined.
+    """
+    total_frames = int(duration * frame_rate)
+    ranges = plan_encode_segments(video_path, total_frames, frame_rate, segments)
+    if len(ranges) < 2:
+        raise ValueError(f"video is too short to split into segments: {duration:.2f}s")
+
+    threads = max(1, (os.cpu_count() or 1) // len(ranges))
+    output_dir = os.path.dirname(output_file)
+    temp_prefix = os.path.join(get_scratch_dir(output_dir), os.path.basename(output_file))
+    segment_files = [f"{temp_prefix}.segment-{i + 1}.mp4" for i in range(len(ranges))]
+    logger.info(f"encoding {len(ranges)} segments in parallel, {threads} threads each")
+    try:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(
+                    render_final_segment, video_path, overlay, start, end, segment_file, frame_rate, preset, threads
+                )
+                for (start, end), segment_file in zip(ranges, segment_files)
+            ]
+            for future in futures:
+                future.result()
+
+        return renderer.concat_copy(segment_files, output_file, audio_file=audio_file, duration=duration)
+    finally:
+        for file in segment_files:
+            if os.path.exists(file):
+                os.remove(file)
+        remove_scratch_dir(output_dir)
+
+
 def generate_video(
     video_path: str,
     audio_path: str,
     subtitle_path: str,
     output_file: str,
     params: VideoParams,
+    timeline: List[SubClippedVideoClip] = None,
+    crossfade: float = 0.0,
+    audio_track: str = "",
 ):
-    aspect = VideoAspect(params.video_aspect)
-    video_width, video_height = aspect.to_resolution()
+    """
+    Burn the subtitles and encode the final video, the audio track is muxed in
+    without re-encoding. `audio_track` is a track prepared by `mix_audio_track`
+    for all videos of a task, without it the audio is mixed for this video.
+    With a `timeline` the video is streamed from the sources by one ffmpeg
+    process, see `renderer.TimelineStream`, and `video_path` is only written
+    when it is not empty.
+    """
+    video_width, video_height = get_render_resolution(params.video_aspect, params.render_mode)
+    draft = is_draft(params.render_mode)
+    # 字幕按渲染分辨率等比缩放，草稿和正式视频的字幕排版一致
+    text_scale = video_width / VideoAspect(params.video_aspect).to_resolution()[0]
 
     logger.info(f"generating video: {video_width} x {video_height}")
     logger.info(f"  ① video: {video_path}")
@@ -545,7 +1335,7 @@ def generate_video(
 
     # https://github.com/huang-jianhua/VideoGenius/issues/217
     # PermissionError: [WinError 32] The process cannot access the file because it is being used by another process: 'final-1.mp4.tempTEMP_MPY_wvf_snd.mp3'
-    # write into the same directory as the output file
+    # temp files are written next to the output file or into the scratch dir
     output_dir = os.path.dirname(output_file)
 
     font_path = ""
@@ -558,141 +1348,206 @@ def generate_video(
 
         logger.info(f"  ⑤ font: {font_path}")
 
-    def create_text_clip(subtitle_item):
+    def create_subtitle_sprite(subtitle_item):
         params.font_size = int(params.font_size)
         params.stroke_width = int(params.stroke_width)
+        font_size = max(int(params.font_size * text_scale), 1)
+        stroke_width = int(round(params.stroke_width * text_scale))
         phrase = subtitle_item[1]
         max_width = video_width * 0.9
         wrapped_txt, txt_height = wrap_text(
-            phrase, max_width=max_width, font=font_path, fontsize=params.font_size
+            phrase, max_width=max_width, font=font_path, fontsize=font_size
         )
-        interline = int(params.font_size * 0.25)
-        size=(int(max_width), int(txt_height + params.font_size * 0.25 + (interline * (wrapped_txt.count("\n") + 1))))
 
-        _clip = TextClip(
+        image = subtitle_overlay.rasterize_text(
             text=wrapped_txt,
-            font=font_path,
-            font_size=params.font_size,
+            font_path=font_path,
+            font_size=font_size,
             color=params.text_fore_color,
             bg_color=params.text_background_color,
             stroke_color=params.stroke_color,
-            stroke_width=params.stroke_width,
-            # interline=interline,
-            # size=size,
+            stroke_width=stroke_width,
+            max_width=max_width,
         )
-        duration = subtitle_item[0][1] - subtitle_item[0][0]
-        _clip = _clip.with_start(subtitle_item[0][0])
-        _clip = _clip.with_end(subtitle_item[0][1])
-        _clip = _clip.with_duration(duration)
+        text_h, text_w = image.shape[:2]
         if params.subtitle_position == "bottom":
-            _clip = _clip.with_position(("center", video_height * 0.95 - _clip.h))
+            y = video_height * 0.95 - text_h
         elif params.subtitle_position == "top":
-            _clip = _clip.with_position(("center", video_height * 0.05))
+            y = video_height * 0.05
         elif params.subtitle_position == "custom":
             # Ensure the subtitle is fully within the screen bounds
             margin = 10  # Additional margin, in pixels
-            max_y = video_height - _clip.h - margin
+            max_y = video_height - text_h - margin
             min_y = margin
-            custom_y = (video_height - _clip.h) * (params.custom_position / 100)
-            custom_y = max(
+            custom_y = (video_height - text_h) * (params.custom_position / 100)
+            y = max(
                 min_y, min(custom_y, max_y)
             )  # Constrain the y value within the valid range
-            _clip = _clip.with_position(("center", custom_y))
         else:  # center
-            _clip = _clip.with_position(("center", "center"))
-        return _clip
-
-    video_clip = VideoFileClip(video_path).without_audio()
-    audio_clip = AudioFileClip(audio_path).with_effects(
-        [afx.MultiplyVolume(params.voice_volume)]
-    )
-
-    def make_textclip(text):
-        return TextClip(
-            text=text,
-            font=font_path,
-            font_size=params.font_size,
+            y = (video_height - text_h) / 2
+        return subtitle_overlay.SubtitleSprite(
+            start=subtitle_item[0][0],
+            end=subtitle_item[0][1],
+            x=int((video_width - text_w) / 2),
+            y=int(y),
+            image=image,
         )
 
-    if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(
-            subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
+    stream = None
+    if timeline:
+        # the combined video is never read back, frames go straight to the final encoder
+        clips = select_timeline_clips(timeline, probe.get_duration(audio_path), crossfade)
+        preset, encoder_params = get_intermediate_encoding()
+        stream = renderer.TimelineStream(
+            clips,
+            video_width,
+            video_height,
+            fps=draft_fps if draft else fps,
+            crossfade=crossfade,
+            fill_mode=get_fill_mode(),
+            tee_file=video_path,
+            codec=video_codec,
+            threads=params.n_threads,
+            preset=draft_preset if draft else preset,
+            encoder_params=encoder_params,
+            graph_dir=output_dir,
         )
-        text_clips = []
-        for item in sub.subtitles:
-            clip = create_text_clip(subtitle_item=item)
-            text_clips.append(clip)
-        video_clip = CompositeVideoClip([video_clip, *text_clips])
+        video_clip = VideoClip(stream.get_frame, duration=stream.duration)
+    else:
+        video_clip = VideoFileClip(video_path).without_audio()
 
-    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
-    if bgm_file:
-        try:
-            bgm_clip = AudioFileClip(bgm_file).with_effects(
-                [
-                    afx.MultiplyVolume(params.bgm_volume),
-                    afx.AudioFadeOut(3),
-                    afx.AudioLoop(duration=video_clip.duration),
-                ]
-            )
-            audio_clip = CompositeAudioClip([audio_clip, bgm_clip])
-        except Exception as e:
-            logger.error(f"failed to add bgm: {str(e)}")
+    temp_files = []
+    try:
+        overlay = None
+        if subtitle_path and os.path.exists(subtitle_path):
+            # every line is rasterized once, then all lines are burned in by one overlay stage
+            sprites = [
+                create_subtitle_sprite(subtitle_item=item)
+                for item in file_to_subtitles(subtitle_path, encoding="utf-8")
+            ]
+            logger.info(f"burning {len(sprites)} subtitle lines")
+            overlay = subtitle_overlay.SubtitleOverlay(sprites)
+            video_clip = video_clip.transform(overlay)
 
-    video_clip = video_clip.with_audio(audio_clip)
-    video_clip.write_videofile(
-        output_file,
-        audio_codec=audio_codec,
-        temp_audiofile_path=output_dir,
-        threads=params.n_threads or 2,
-        logger=None,
-        fps=fps,
-    )
-    video_clip.close()
-    del video_clip
+        duration = video_clip.duration
+        temp_prefix = os.path.join(get_scratch_dir(output_dir), os.path.basename(output_file))
+        if not audio_track:
+            audio_track = f"{temp_prefix}.audio.m4a"
+            temp_files.append(audio_track)
+            mix_audio_track(audio_path, audio_track, duration, params)
 
+        # a stream is read once from the start, it cannot be split into segments
+        segments = 1 if draft or stream else get_encode_segments()
+        if segments > 1:
+            try:
+                encode_segmented(video_path, overlay, audio_track, output_file, duration, segments)
+                return
+            except Exception as e:
+                logger.warning(f"failed to encode segments in parallel, encoding in one pass: {str(e)}")
 
-def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
+        # the video is encoded without audio, the mixed track is muxed in as it is
+        temp_video = f"{temp_prefix}.video.mp4"
+        temp_files.append(temp_video)
+        video_clip.write_videofile(
+            temp_video,
+            audio=False,
+            threads=params.n_threads or 2,
+            logger=None,
+            fps=draft_fps if draft else fps,
+            preset=draft_preset if draft else "medium",
+        )
+        if stream:
+            # the whole timeline was read, the combined video is complete
+            stream.close()
+        renderer.concat_copy([temp_video], output_file, audio_file=audio_track, duration=duration)
+    finally:
+        if stream:
+            # stops ffmpeg if anything above failed, does nothing after a complete read
+            stream.close(abort=True)
+        video_clip.close()
+        for file in temp_files:
+            if os.path.exists(file):
+                os.remove(file)
+        remove_scratch_dir(output_dir)
+
+
+def preprocess_video(materials: List[MaterialInfo], clip_duration=4, workers: int = None):
+    """
+    Check the resolution of local materials and turn images into `{url}.mp4`
+    clips with a slow zoom. Images are rendered by the image clip stage, in
+    parallel with `clip_render_workers` processes and cached by image content.
+    Images that fail to render are dropped from the returned materials.
+    """
+    images = []
     for material in materials:
         if not material.url:
             continue
 
         ext = utils.parse_extension(material.url)
         try:
-            clip = VideoFileClip(material.url)
-        except Exception:
-            clip = ImageClip(material.url)
+            if ext in const.FILE_TYPE_IMAGES:
+                # only the image header is read
+                with Image.open(material.url) as image:
+                    width, height = image.size
+            else:
+                media_info = probe.probe_media(material.url)
+                width, height = media_info.width, media_info.height
+        except Exception as e:
+            logger.warning(f"failed to read material: {material.url}, {str(e)}")
+            continue
 
-        width = clip.size[0]
-        height = clip.size[1]
         if width < 480 or height < 480:
             logger.warning(f"low resolution material: {width}x{height}, minimum 480x480 required")
             continue
 
         if ext in const.FILE_TYPE_IMAGES:
-            logger.info(f"processing image: {material.url}")
-            # Create an image clip and set its duration to 3 seconds
-            clip = (
-                ImageClip(material.url)
-                .with_duration(clip_duration)
-                .with_position("center")
-            )
-            # Apply a zoom effect using the resize method.
-            # A lambda function is used to make the zoom effect dynamic over time.
-            # The zoom effect starts from the original size and gradually scales up to 120%.
-            # t represents the current time, and clip.duration is the total duration of the clip (3 seconds).
-            # Note: 1 represents 100% size, so 1.2 represents 120% size.
-            zoom_clip = clip.resized(
-                lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
-            )
+            images.append(material)
+
+    if not images:
+        return materials
+
+    # The zoom starts from the original size and gradually scales up,
+    # 1 represents 100% size, a 4 seconds clip ends at 112%.
+    preset, encoder_params = get_intermediate_encoding()
+    render_args = [
+        dict(
+            image_path=material.url,
+            output_file=f"{material.url}.mp4",
+            duration=clip_duration,
+            fps=fps,
+            codec=video_codec,
+            zoom_start=1.0,
+            zoom_end=round(1 + clip_duration * 0.03, 3),
+            preset=preset,
+            encoder_params=encoder_params,
+        )
+        for material in images
+    ]
+    if workers is None:
+        workers = int(config.app.get("clip_render_workers", 1) or 1)
 
-            # Optionally, create a composite video clip containing the zoomed clip.
-            # This is useful when you want to add other elements to the video.
-            final_clip = CompositeVideoClip([zoom_clip])
-
-            # Output the video to a file.
-            video_file = f"{material.url}.mp4"
-            final_clip.write_videofile(video_file, fps=30, logger=None)
-            close_clip(clip)
-            material.url = video_file
-            logger.success(f"image processed: {video_file}")
-    return materials
\ No newline at end of file
+    # an image that could not be rendered is dropped, it must not reach the timeline as a video
+    failed = set()
+
+    def processed(material, get_video_file):
+        try:
+            material.url = get_video_file()
+            logger.success(f"image processed: {material.url}")
+        except Exception as e:
+            failed.add(id(material))
+            logger.error(f"failed to process image: {material.url}, {str(e)}")
+
+    if workers <= 1 or len(images) <= 1:
+        for material, kwargs in zip(images, render_args):
+            logger.info(f"processing image: {material.url}")
+            processed(material, lambda: image_clip.render_image_clip(**kwargs))
+    else:
+        logger.info(f"processing {len(images)} images with {workers} worker processes")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(image_clip.render_image_clip, **kwargs): material
+                for material, kwargs in zip(images, render_args)
+            }
+            for future in as_completed(futures):
+                processed(futures[future], future.result)
+    return [material for material in materials if id(material) not in failed]
\ No newline at end of file
@@ -0,0 +1,115 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import bgm_library, probe, renderer
+from app.utils import utils
+
+class TestBgmLibrary(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.song_dir = os.path.join(self.temp_dir.name, "songs")
+        self.library_dir = os.path.join(self.temp_dir.name, "bgm_library")
+        os.makedirs(self.song_dir)
+        os.makedirs(self.library_dir)
+        self.patches = [
+            mock.patch.object(utils, "song_dir", return_value=self.song_dir),
+            mock.patch.object(bgm_library, "library_dir", return_value=self.library_dir),
+            mock.patch.object(bgm_library, "_index", None),
+            mock.patch.object(bgm_library, "_pending", set()),
+            mock.patch.object(bgm_library, "_failed", {}),
+            mock.patch.object(probe, "db_file", return_value=os.path.join(self.temp_dir.name, "probe_index.db")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.song_path = os.path.join(self.song_dir, "song.mp3")
+        renderer.run_ffmpeg([
+            "-f", "lavfi", "-i", "sine=frequency=440", "-t", "3", "-af", "volume=0.1", self.song_path,
+        ])
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def test_scan_normalizes_tracks(self):
+        tracks = bgm_library.scan()
+        self.assertEqual(len(tracks), 1)
+        track = tracks[0]
+        self.assertAlmostEqual(track["duration"], 3, delta=0.1)
+        self.assertGreater(track["gain"], 0)
+        self.assertTrue(os.path.isfile(track["normalized_file"]))
+
+        # the copy is at the target loudness unless that would clip
+        loudness = bgm_library.measure_loudness(track["normalized_file"])
+        self.assertAlmostEqual(
+            loudness["loudness"], track["loudness"] + track["gain"], delta=0.5
+        )
+        self.assertLessEqual(loudness["true_peak"], -0.5)
+
+        # unchanged tracks are a lookup
+        with mock.patch.object(bgm_library, "measure_loudness") as measure:
+            self.assertEqual(bgm_library.get_track(self.song_path), track)
+            measure.assert_not_called()
+        self.assertEqual(bgm_library.list_tracks(), [track])
+
+    def test_scan_drops_removed_tracks(self):
+        track = bgm_library.scan()[0]
+        os.remove(self.song_path)
+
+        self.assertEqual(bgm_library.scan(), [])
+        self.assertEqual(bgm_library.list_tracks(), [])
+        self.assertFalse(os.path.exists(track["normalized_file"]))
+
+    def test_get_track_analyses_new_tracks_in_background(self):
+        with mock.patch.object(utils, "run_in_background") as run_in_background:
+            self.assertIsNone(bgm_library.get_track(self.song_path))
+            run_in_background.assert_called_once()
+        # the background job adds the track, later tasks find it
+        run_in_background.call_args.args[0]()
+        self.assertEqual(bgm_library.get_track(self.song_path)["file"], os.path.abspath(self.song_path))
+
+    def test_background_analysis_runs_once(self):
+        with mock.patch.object(utils, "run_in_background") as run_in_background:
+            bgm_library.get_track(self.song_path)
+            bgm_library.get_track(self.song_path)
+            run_in_background.assert_called_once()
+
+            # a failed track is not analysed again until the file changes
+            with mock.patch.object(bgm_library, "measure_loudness", side_effect=ValueError("broken")):
+                run_in_background.call_args.args[0]()
+            bgm_library.get_track(self.song_path)
+            self.assertEqual(run_in_background.call_count, 1)
+            mtime = os.path.getmtime(self.song_path) + 10
+            os.utime(self.song_path, (mtime, mtime))
+            bgm_library.get_track(self.song_path)
+            self.assertEqual(run_in_background.call_count, 2)
+
+    def test_concurrent_add_track_converts_once(self):
+        measure_loudness = bgm_library.measure_loudness
+
+        def slow_measure(file_path):
+            time.sleep(0.2)
+            return measure_loudness(file_path)
+
+        with mock.patch.object(bgm_library, "measure_loudness", side_effect=slow_measure) as measure:
+            threads = [threading.Thread(target=bgm_library.add_track, args=(self.song_path,)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(measure.call_count, 1)
+
+    def test_get_track_ignores_files_outside_the_library(self):
+        other_path = os.path.join(self.temp_dir.name, "other.mp3")
+        os.rename(self.song_path, other_path)
+        self.assertIsNone(bgm_library.get_track(other_path))
+
+if __name__ == "__main__":
+    unittest.main()
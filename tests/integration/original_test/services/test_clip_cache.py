@@ -0,0 +1,108 @@
+import unittest
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.models.schema import VideoTransitionMode
+from app.services import clip_cache, renderer, storage_manager, video
+from app.services.video import SubClippedVideoClip
+
+class TestClipCacheService(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, "cache_clips")
+        os.makedirs(self.cache_dir)
+        self.patches = [
+            mock.patch.object(clip_cache, "cache_dir", return_value=self.cache_dir),
+            mock.patch.object(storage_manager, "cache_dir", side_effect=lambda name: os.path.join(self.temp_dir.name, name)),
+            mock.patch.object(storage_manager, "access_file", return_value=os.path.join(self.temp_dir.name, "access.json")),
+            mock.patch.object(storage_manager, "_access", None),
+            mock.patch.object(storage_manager, "_stats", {}),
+            mock.patch.object(storage_manager, "schedule_eviction"),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.source_path = os.path.join(self.temp_dir.name, "source.mp4")
+        renderer.run_ffmpeg([
+            "-f", "lavfi", "-i", "testsrc=size=320x180:rate=25", "-t", "4",
+            "-pix_fmt", "yuv420p", self.source_path,
+        ])
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def test_clip_key(self):
+        item = SubClippedVideoClip(self.source_path, start_time=0, end_time=2)
+        item.effects = [("fade_in", 1)]
+        key = clip_cache.clip_key(item, 90, 160, 30, "libx264", 5)
+        self.assertEqual(key, clip_cache.clip_key(item, 90, 160, 30, "libx264", 5))
+        self.assertNotEqual(key, clip_cache.clip_key(item, 160, 90, 30, "libx264", 5))
+        item.effects = [("fade_out", 1)]
+        self.assertNotEqual(key, clip_cache.clip_key(item, 90, 160, 30, "libx264", 5))
+        # a clip rendered by the other engine is not reused
+        item.effects = [("fade_in", 1)]
+        self.assertNotEqual(key, clip_cache.clip_key(item, 90, 160, 30, "libx264", 5, engine="moviepy"))
+
+    def test_seeded_effect_plan(self):
+        plans = [
+            [
+                video.plan_clip_effects(VideoTransitionMode.shuffle, i, 5, rng=random.Random(f"42:{i}"))
+                for i in range(5)
+            ]
+            for _ in range(2)
+        ]
+        self.assertEqual(plans[0], plans[1])
+
+    def test_render_subclip_uses_cache(self):
+        item = SubClippedVideoClip(self.source_path, start_time=0, end_time=2, width=320, height=180)
+        item.effects = [("contrast", 1.1)]
+        first_file = os.path.join(self.temp_dir.name, "temp-clip-1.mp4")
+        video.render_subclip(item, first_file, 90, 160, 5)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        second_file = os.path.join(self.temp_dir.name, "temp-clip-2.mp4")
+        with mock.patch.object(renderer, "render_timeline") as render_timeline:
+            processed_clip = video.render_subclip(item, second_file, 90, 160, 5)
+            render_timeline.assert_not_called()
+        self.assertEqual(processed_clip.file_path, second_file)
+        self.assertAlmostEqual(processed_clip.duration, 2)
+        self.assertEqual(os.path.getsize(first_file), os.path.getsize(second_file))
+
+    def test_render_subclip_keeps_linked_cache_entry(self):
+        item = SubClippedVideoClip(self.source_path, start_time=0, end_time=2, width=320, height=180)
+        clip_file = os.path.join(self.temp_dir.name, "temp-clip-1.mp4")
+        video.render_subclip(item, clip_file, 90, 160, 5)
+        cached_file = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(cached_file, "rb") as f:
+            cached = f.read()
+
+        # a rerun renders another clip to the same file, the cached clip is not written through the link
+        other = SubClippedVideoClip(self.source_path, start_time=1, end_time=4, width=320, height=180)
+        video.render_subclip(other, clip_file, 90, 160, 5)
+        with open(cached_file, "rb") as f:
+            self.assertEqual(f.read(), cached)
+        self.assertNotEqual(os.path.getsize(clip_file), len(cached))
+
+    def test_evicted_by_storage_manager(self):
+        for i, name in enumerate(["clip-a.mp4", "clip-b.mp4", "clip-c.mp4"]):
+            file = os.path.join(self.cache_dir, name)
+            with open(file, "wb") as f:
+                f.write(b"0" * 100)
+            os.utime(file, (time.time() - 1000 + i, time.time() - 1000 + i))
+        # reading a clip makes it the most recently used one
+        clip_cache.get("a", os.path.join(self.temp_dir.name, "a.mp4"))
+        self.assertEqual(storage_manager.get_stats()["cache_clips"]["hits"], 1)
+
+        storage_manager.evict("cache_clips", budget=200)
+
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["clip-a.mp4", "clip-c.mp4"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+import numpy as np
+from moviepy import VideoFileClip
+from PIL import Image
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.models.schema import MaterialInfo
+from app.services import clip_cache, image_clip, storage_manager, video
+from app.utils import utils
+
+class TestImageClipService(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, "cache_clips")
+        os.makedirs(self.cache_dir)
+        self.dir_patch = mock.patch.object(clip_cache, "cache_dir", return_value=self.cache_dir)
+        self.dir_patch.start()
+        # the eviction pass would run over the real storage directory
+        self.eviction_patch = mock.patch.object(storage_manager, "schedule_eviction")
+        self.eviction_patch.start()
+        # access times of cached files are saved under storage/
+        self.storage_patch = mock.patch.object(utils, "storage_dir", side_effect=self.storage_dir)
+        self.storage_patch.start()
+        self.image_path = os.path.join(self.temp_dir.name, "image.png")
+        pixels = np.zeros((480, 640, 3), dtype=np.uint8)
+        pixels[:, :320] = (255, 0, 0)
+        Image.fromarray(pixels).save(self.image_path)
+
+    def tearDown(self):
+        self.dir_patch.stop()
+        self.eviction_patch.stop()
+        self.storage_patch.stop()
+        self.temp_dir.cleanup()
+
+    def storage_dir(self, sub_dir="", create=False):
+        d = os.path.join(self.temp_dir.name, "storage", sub_dir)
+        if create:
+            os.makedirs(d, exist_ok=True)
+        return d
+
+    def test_ken_burns_crop_box(self):
+        with Image.open(self.image_path) as image:
+            frames = image_clip.KenBurns(image, (320, 240), 4, zoom_start=1.0, zoom_end=1.2, pan_x=1.0)
+        self.assertEqual(frames.canvas.size, (384, 288))
+        self.assertEqual(frames.crop_box(0), (0.0, 0.0, 384.0, 288.0))
+        # the last frame shows 1/1.2 of the image, panned to the right edge
+        left, top, right, bottom = frames.crop_box(4)
+        self.assertAlmostEqual(right, 384)
+        self.assertAlmostEqual(right - left, 320)
+        self.assertAlmostEqual(top, 24)
+        self.assertEqual(frames(2).shape, (240, 320, 3))
+
+    def test_render_image_clip_uses_cache(self):
+        first_file = os.path.join(self.temp_dir.name, "first.mp4")
+        image_clip.render_image_clip(self.image_path, first_file, duration=1, zoom_end=1.1)
+        clip = VideoFileClip(first_file)
+        self.assertEqual(tuple(clip.size), (640, 480))
+        self.assertAlmostEqual(clip.duration, 1, delta=0.1)
+        clip.close()
+
+        second_file = os.path.join(self.temp_dir.name, "second.mp4")
+        with mock.patch.object(image_clip, "VideoClip") as video_clip:
+            image_clip.render_image_clip(self.image_path, second_file, duration=1, zoom_end=1.1)
+            video_clip.assert_not_called()
+        self.assertEqual(os.path.getsize(first_file), os.path.getsize(second_file))
+
+    def test_preprocess_video_renders_images(self):
+        materials = [MaterialInfo(provider="local", url=self.image_path)]
+        materials = video.preprocess_video(materials, clip_duration=1, workers=1)
+        self.assertEqual(materials[0].url, f"{self.image_path}.mp4")
+        self.assertTrue(os.path.isfile(materials[0].url))
+
+if __name__ == "__main__":
+    unittest.main()
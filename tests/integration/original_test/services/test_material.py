@@ -0,0 +1,316 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.config import config
+from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import material, material_index, probe, storage_manager
+from app.utils import utils
+
+class FakeResponse:
+    def __init__(self, content: bytes, range_header: str = ""):
+        self.status_code = 200
+        if range_header:
+            offset = int(range_header.split("=")[1].rstrip("-"))
+            self.status_code = 206 if offset < len(content) else 416
+            content = content[offset:]
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), 4):
+            yield self.content[i:i + 4]
+
+class TestMaterialService(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.content = b"0123456789abcdef" * 4
+        self.requests = []
+        self.patches = [
+            mock.patch.object(material, "get_session", return_value=mock.Mock(get=self.fake_get)),
+            mock.patch.object(probe, "probe_media", return_value=probe.MediaInfo(duration=10, fps=30, width=1080, height=1920)),
+            mock.patch.object(material_index, "db_file", return_value=os.path.join(self.temp_dir.name, "index.db")),
+            # the eviction pass would run over the real storage directory
+            mock.patch.object(storage_manager, "schedule_eviction"),
+            mock.patch.object(utils, "storage_dir", side_effect=self.storage_dir),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.video_dir = os.path.join(self.temp_dir.name, "videos")
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def storage_dir(self, sub_dir="", create=False):
+        d = os.path.join(self.temp_dir.name, "storage", sub_dir)
+        if create:
+            os.makedirs(d, exist_ok=True)
+        return d
+
+    def fake_get(self, url, headers=None, **kwargs):
+        self.requests.append((url, (headers or {}).get("Range", "")))
+        return FakeResponse(self.content, (headers or {}).get("Range", ""))
+
+    def test_save_video_streams_to_a_partial_file(self):
+        video_path = material.save_video("https://videos.example.com/a.mp4?token=1", self.video_dir)
+        self.assertTrue(video_path.endswith(".mp4"))
+        with open(video_path, "rb") as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(os.listdir(self.video_dir), [os.path.basename(video_path)])
+
+        # saved videos are not downloaded again
+        material.save_video("https://videos.example.com/a.mp4?token=2", self.video_dir)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_save_video_resumes_partial_files(self):
+        url = "https://videos.example.com/b.mp4"
+        video_path = f"{self.video_dir}/vid-{material.utils.md5(url)}.mp4"
+        os.makedirs(self.video_dir)
+        with open(f"{video_path}.part", "wb") as f:
+            f.write(self.content[:20])
+
+        self.assertEqual(material.save_video(url, self.video_dir), video_path)
+        self.assertEqual(self.requests, [(url, "bytes=20-")])
+        with open(video_path, "rb") as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_save_video_downloads_once_for_concurrent_tasks(self):
+        url = "https://videos.example.com/c.mp4"
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(material.save_video(url, self.video_dir)))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(len(self.requests), 1)
+        with open(results[0], "rb") as f:
+            self.assertEqual(f.read(), self.content)
+        # the claim file is removed with the download
+        self.assertEqual(os.listdir(self.video_dir), [os.path.basename(results[0])])
+
+    def test_save_video_takes_over_stale_claims(self):
+        url = "https://videos.example.com/d.mp4"
+        video_path = f"{self.video_dir}/vid-{material.utils.md5(url)}.mp4"
+        os.makedirs(self.video_dir)
+        with open(f"{video_path}.lock", "w") as f:
+            f.write("999999999")
+
+        self.assertEqual(material.save_video(url, self.video_dir), video_path)
+        self.assertFalse(os.path.exists(f"{video_path}.lock"))
+
+    def test_save_video_waits_for_claims_of_other_processes(self):
+        url = "https://videos.example.com/e.mp4"
+        video_path = f"{self.video_dir}/vid-{material.utils.md5(url)}.mp4"
+        os.makedirs(self.video_dir)
+        with open(f"{video_path}.lock", "w") as f:
+            f.write(str(os.getppid()))
+
+        cancel = threading.Event()
+        cancel.set()
+        self.assertEqual(material.save_video(url, self.video_dir, cancel), "")
+        self.assertEqual(self.requests, [])
+
+    def test_download_videos_stops_when_audio_is_covered(self):
+        items = [
+            MaterialInfo(provider="pexels", url=f"https://videos.example.com/{i}.mp4", duration=10)
+            for i in range(5)
+        ]
+        os.makedirs(self.video_dir)
+        with mock.patch.dict(config.app, {"material_directory": self.video_dir, "download_workers": 1}), \
+                mock.patch.object(material, "search_videos_pexels", return_value=items):
+            video_paths = material.download_videos(
+                "task", ["term"], video_contact_mode=VideoConcatMode.sequential, audio_duration=8, max_clip_duration=5
+            )
+
+        self.assertEqual(len(video_paths), 2)
+        self.assertEqual([url for url, _ in self.requests], [item.url for item in items[:2]])
+
+    def test_download_videos_uses_indexed_materials_first(self):
+        items = [
+            MaterialInfo(provider="pexels", url=f"https://videos.example.com/{i}.mp4", duration=10)
+            for i in range(5)
+        ]
+        os.makedirs(self.video_dir)
+        with mock.patch.dict(config.app, {"material_directory": self.video_dir, "download_workers": 1}), \
+                mock.patch.object(material, "search_videos_pexels", return_value=items) as search:
+            first_paths = material.download_videos(
+                "task", ["Term"], video_contact_mode=VideoConcatMode.sequential, audio_duration=8, max_clip_duration=5
+            )
+            # the downloaded videos cover the audio, no search and no download
+            second_paths = material.download_videos("task", ["term"], audio_duration=8, max_clip_duration=5)
+            self.assertEqual(search.call_count, 1)
+            self.assertEqual(sorted(second_paths), sorted(first_paths))
+
+            # only the shortfall is downloaded, videos found locally are skipped
+            third_paths = material.download_videos(
+                "task", ["term"], video_contact_mode=VideoConcatMode.sequential, audio_duration=18, max_clip_duration=5
+            )
+            self.assertEqual(len(third_paths), 4)
+            self.assertEqual(len(self.requests), 4)
+
+            # offline mode only uses the index
+            with mock.patch.dict(config.app, {"material_offline": True}):
+                offline_paths = material.download_videos("task", ["term"], audio_duration=100, max_clip_duration=5)
+            self.assertEqual(len(offline_paths), 4)
+            self.assertEqual(search.call_count, 2)
+
+class TestMaterialIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_patch = mock.patch.object(material_index, "db_file", return_value=os.path.join(self.temp_dir.name, "index.db"))
+        self.db_patch.start()
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.temp_dir.cleanup()
+
+    def create_file(self, name):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "wb") as f:
+            f.write(b"video")
+        return path
+
+    def test_find_materials(self):
+        portrait = self.create_file("portrait.mp4")
+        landscape = self.create_file("landscape.mp4")
+        short = self.create_file("short.mp4")
+        material_index.add_material(portrait, "pexels", "https://a", 10, 1080, 1920, ["City Night"])
+        material_index.add_material(landscape, "pexels", "https://b", 10, 1920, 1080, ["city night"])
+        material_index.add_material(short, "pixabay", "https://c", 2, 720, 1280, ["city night"])
+        # found again by another term
+        material_index.add_material(portrait, "pexels", "https://a", 10, 1080, 1920, ["traffic"])
+
+        rows = material_index.find_materials("city  night", VideoAspect.portrait, 5)
+        self.assertEqual([row["path"] for row in rows], [portrait])
+        self.assertEqual(rows[0]["size"], 5)
+        self.assertEqual([row["path"] for row in material_index.find_materials("traffic")], [portrait])
+        self.assertEqual(len(material_index.find_materials("city night", VideoAspect.portrait)), 2)
+
+        # deleted files are dropped from the index
+        os.remove(portrait)
+        self.assertEqual(material_index.find_materials("traffic"), [])
+
+class TestSearchCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(material, "search_cache_file", return_value=os.path.join(self.temp_dir.name, "search_cache.json")),
+            mock.patch.object(material, "_search_cache", None),
+            mock.patch.object(material, "get_api_key", return_value="key"),
+            mock.patch.object(material_index, "db_file", return_value=os.path.join(self.temp_dir.name, "index.db")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        response = {
+            "videos": [
+                {"duration": 12, "video_files": [{"width": 1080, "height": 1920, "link": "https://videos.example.com/1.mp4"}]},
+                {"duration": 3, "video_files": [{"width": 1080, "height": 1920, "link": "https://videos.example.com/2.mp4"}]},
+            ]
+        }
+        self.session = mock.Mock()
+        self.session.get.return_value.json.return_value = response
+        self.patches.append(mock.patch.object(material, "get_session", return_value=self.session))
+        self.patches[-1].start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def test_search_results_are_cached(self):
+        items = material.search_videos_pexels("Technology", 5)
+        self.assertEqual([item.url for item in items], ["https://videos.example.com/1.mp4"])
+
+        # the same search is answered from the cache, also after a restart
+        with mock.patch.object(material, "_search_cache", None):
+            self.assertEqual(material.search_videos_pexels("technology ", 5), items)
+        self.assertEqual(self.session.get.call_count, 1)
+
+        # other orientations and durations are separate searches
+        material.search_videos_pexels("technology", 4)
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_expired_results_are_searched_again(self):
+        material.search_videos_pexels("technology", 5)
+        with mock.patch.object(material.time, "time", return_value=material.time.time() + 25 * 3600):
+            material.search_videos_pexels("technology", 5)
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_failed_searches_are_not_cached(self):
+        self.session.get.side_effect = ConnectionError("offline")
+        self.assertEqual(material.search_videos_pexels("technology", 5), [])
+        self.session.get.side_effect = None
+        self.assertEqual(len(material.search_videos_pexels("technology", 5)), 1)
+
+    def test_download_videos_searches_all_terms(self):
+        with mock.patch.object(material, "save_video", return_value="") as save_video:
+            material.download_videos("task", ["a", "b", "c"], audio_duration=8)
+        self.assertEqual(self.session.get.call_count, 3)
+        # the same video found by several terms is downloaded once
+        self.assertEqual(save_video.call_count, 1)
+
+class TestRenditionSelection(unittest.TestCase):
+    renditions = [
+        {"width": 2160, "height": 3840, "fps": 25, "size": 40000000, "link": "uhd"},
+        {"width": 1080, "height": 1920, "fps": 50, "size": 12000000, "link": "hd50"},
+        {"width": 1080, "height": 1920, "fps": 25, "size": 9000000, "link": "hd"},
+        {"width": 1012, "height": 1800, "fps": 25, "size": 8000000, "link": "close"},
+        {"width": 720, "height": 1280, "fps": 25, "size": 4000000, "link": "sd"},
+        {"width": None, "height": None, "link": "hls"},
+    ]
+
+    def test_smallest_sufficient_rendition(self):
+        self.assertEqual(material.select_rendition(self.renditions, 1080, 1920, 0)["link"], "hd")
+        # within the tolerance a slightly smaller rendition is enough
+        self.assertEqual(material.select_rendition(self.renditions, 1080, 1920, 0.1)["link"], "close")
+        self.assertEqual(material.select_rendition(self.renditions, 720, 1280, 0)["link"], "sd")
+        self.assertEqual(material.select_rendition(self.renditions, 2160, 3840, 0)["link"], "uhd")
+        self.assertIsNone(material.select_rendition(self.renditions, 4320, 7680, 0.1))
+
+    def test_other_orientation_is_fitted(self):
+        landscape = [{"width": 1920, "height": 1080}, {"width": 3840, "height": 2160}]
+        # a landscape video fills a portrait frame by its width
+        self.assertEqual(material.select_rendition(landscape, 1080, 1920, 0)["width"], 1920)
+
+    def test_pixabay_skips_oversized_renditions(self):
+        response = {
+            "hits": [{
+                "duration": 10,
+                "videos": {
+                    "large": {"url": "large", "width": 3840, "height": 2160, "size": 30000000},
+                    "medium": {"url": "medium", "width": 1920, "height": 1080, "size": 8000000},
+                    "small": {"url": "small", "width": 1280, "height": 720, "size": 4000000},
+                    "tiny": {"url": "", "width": 0, "height": 0, "size": 0},
+                },
+            }]
+        }
+        session = mock.Mock()
+        session.get.return_value.json.return_value = response
+        with mock.patch.object(material, "get_session", return_value=session), \
+                mock.patch.object(material, "get_api_key", return_value="key"), \
+                mock.patch.object(material, "search_cache_ttl", return_value=0):
+            items = material.search_videos_pixabay("sky", 5, VideoAspect.landscape)
+        self.assertEqual([item.url for item in items], ["medium"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import material_reader, renderer
+
+class TestMaterialReader(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, "source.mp4")
+        renderer.run_ffmpeg([
+            "-f", "lavfi", "-i", "testsrc=size=640x360:rate=25", "-t", "2",
+            "-pix_fmt", "yuv420p", self.source_path,
+        ])
+
+    def tearDown(self):
+        material_reader.close_all()
+        self.temp_dir.cleanup()
+
+    def test_fit_size(self):
+        self.assertEqual(material_reader.fit_size(3840, 2160, 1080, 1920), (1080, 606))
+        self.assertEqual(material_reader.fit_size(720, 1280, 1920, 1080), (606, 1080))
+        self.assertEqual(material_reader.fit_size(3840, 2160, 1920, 1080), (1920, 1080))
+        self.assertEqual(material_reader.fit_size(1366, 768, 1920, 1080), (1920, 1080))
+
+    def test_open_video_decodes_scaled_frames(self):
+        clip = material_reader.open_video(self.source_path, 160, 90)
+        self.assertEqual(clip.get_frame(0.5).shape, (90, 160, 3))
+        # subclips of the same file share the reader
+        self.assertIs(material_reader.open_video(self.source_path, 160, 90), clip)
+        self.assertIsNot(material_reader.open_video(self.source_path, 320, 180), clip)
+
+    def test_open_fitted_video_pads_frames(self):
+        clip = material_reader.open_fitted_video(self.source_path, 640, 360, 90, 160)
+        frame = clip.get_frame(0.5)
+        self.assertEqual(frame.shape, (160, 90, 3))
+        self.assertEqual(int(frame[:20].sum()), 0)
+        self.assertGreater(frame[80].mean(), 20)
+
+        blurred = material_reader.open_fitted_video(self.source_path, 640, 360, 90, 160, "blur")
+        self.assertIsNot(blurred, clip)
+        self.assertGreater(blurred.get_frame(0.5)[:20].mean(), 20)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import sys
+import tempfile
+from contextlib import closing
+from pathlib import Path
+from unittest import mock
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import probe, renderer
+
+class TestProbeService(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.temp_dir.name, "source.mp4")
+        renderer.run_ffmpeg([
+            "-f", "lavfi", "-i", "testsrc=size=320x180:rate=25", "-t", "2",
+            "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100", "-t", "2",
+            "-pix_fmt", "yuv420p", "-g", "25", self.source_path,
+        ])
+        self.index_patch = mock.patch.object(
+            probe, "db_file", return_value=os.path.join(self.temp_dir.name, "probe_index.db")
+        )
+        self.index_patch.start()
+
+    def tearDown(self):
+        self.index_patch.stop()
+        self.temp_dir.cleanup()
+
+    def test_probe_media(self):
+        info = probe.probe_media(self.source_path, with_keyframes=True)
+        self.assertEqual((info.width, info.height), (320, 180))
+        self.assertAlmostEqual(info.duration, 2, delta=0.1)
+        self.assertAlmostEqual(info.fps, 25, delta=0.01)
+        self.assertEqual(info.codec, "h264")
+        self.assertEqual(info.keyframes, 2)
+        self.assertTrue(info.keyframes_probed)
+        self.assertEqual(len(info.audio_streams), 1)
+        self.assertEqual(info.audio_streams[0]["sample_rate"], 44100)
+
+    def test_probe_media_uses_persistent_index(self):
+        info = probe.probe_media(self.source_path)
+        self.assertTrue(os.path.isfile(probe.db_file()))
+
+        with mock.patch.object(probe, "_run") as run:
+            self.assertEqual(probe.probe_media(self.source_path), info)
+            run.assert_not_called()
+
+    def test_probe_media_counts_keyframes_on_request(self):
+        info = probe.probe_media(self.source_path)
+        self.assertFalse(info.keyframes_probed)
+        # an entry cached without keyframes is probed again when they are asked for
+        info = probe.probe_media(self.source_path, with_keyframes=True)
+        self.assertEqual(info.keyframes, 2)
+        with mock.patch.object(probe, "_run") as run:
+            self.assertEqual(probe.probe_media(self.source_path).keyframes, 2)
+            run.assert_not_called()
+
+    def test_index_skips_task_files_and_prunes_deleted_files(self):
+        task_path = os.path.join(self.temp_dir.name, "tasks", "task-id", "temp-clip-1.mp4")
+        os.makedirs(os.path.dirname(task_path))
+        renderer.run_ffmpeg(["-f", "lavfi", "-i", "testsrc=size=160x90:rate=25", "-t", "1", task_path])
+        gone_path = os.path.join(self.temp_dir.name, "gone.mp4")
+        renderer.run_ffmpeg(["-f", "lavfi", "-i", "testsrc=size=160x90:rate=25", "-t", "1", gone_path])
+
+        with mock.patch.object(probe.utils, "storage_dir", return_value=self.temp_dir.name):
+            probe.probe_media(task_path)
+            probe.probe_media(gone_path)
+            os.remove(gone_path)
+            # deleted files are only pruned once the interval has passed
+            probe.set_cached_data(self.source_path, "scenes", [0.5])
+            self.assertEqual(len(self.indexed_paths()), 2)
+            with mock.patch.object(probe, "prune_interval", 0):
+                probe.set_cached_data(self.source_path, "scenes", [1.0])
+
+        self.assertEqual(self.indexed_paths(), [os.path.abspath(self.source_path)])
+        self.assertEqual(probe.get_cached_data(self.source_path, "scenes"), [1.0])
+
+    def indexed_paths(self):
+        with closing(probe._connect()) as conn:
+            return [path for (path,) in conn.execute("SELECT path FROM probes ORDER BY path")]
+
+    def test_probe_media_detects_changed_file(self):
+        probe.probe_media(self.source_path)
+        renderer.run_ffmpeg([
+            "-f", "lavfi", "-i", "testsrc=size=160x90:rate=25", "-t", "1",
+            "-pix_fmt", "yuv420p", self.source_path,
+        ])
+        info = probe.probe_media(self.source_path)
+        self.assertEqual((info.width, info.height), (160, 90))
+        self.assertEqual(info.audio_streams, [])
+
+if __name__ == "__main__":
+    unittest.main()
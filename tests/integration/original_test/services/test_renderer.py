@@ -0,0 +1,169 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+from moviepy import (
+    AudioFileClip,
+    VideoFileClip,
+)
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import probe, renderer
+from app.services.video import SubClippedVideoClip
+
+class TestRendererService(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(probe, "db_file", return_value=os.path.join(self.temp_dir.name, "probe_index.db")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.source_path = os.path.join(self.temp_dir.name, "source.mp4")
+        renderer.run_ffmpeg([
+            "-f", "lavfi", "-i", "testsrc=size=320x180:rate=25", "-t", "4",
+            "-pix_fmt", "yuv420p", self.source_path,
+        ])
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def test_build_timeline_crossfade(self):
+        clips = [
+            SubClippedVideoClip(self.source_path, start_time=0, end_time=2),
+            SubClippedVideoClip(self.source_path, start_time=1, end_time=3),
+            SubClippedVideoClip(self.source_path, start_time=2, end_time=4),
+        ]
+        input_args, graph = renderer.build_timeline(clips, 90, 160, fps=30, crossfade=0.5)
+        self.assertEqual(input_args.count("-i"), 3)
+        self.assertIn("offset=1.500", graph)
+        self.assertIn("offset=3.000", graph)
+        self.assertIn("[vout]", graph)
+
+    def test_build_timeline_rejects_unsupported_effects(self):
+        clip = SubClippedVideoClip(self.source_path, start_time=0, end_time=2)
+        clip.effects = [("unknown_effect", 1)]
+        with self.assertRaises(ValueError):
+            renderer.build_timeline([clip], 90, 160)
+
+    def test_render_timeline(self):
+        first = SubClippedVideoClip(self.source_path, start_time=0, end_time=2)
+        first.effects = [("fade_in", 1), ("contrast", 1.1), ("saturation", 1.05)]
+        second = SubClippedVideoClip(self.source_path, start_time=2, end_time=4)
+        second.effects = [("fade_out", 1), ("warm", 0.2)]
+        output_file = os.path.join(self.temp_dir.name, "combined.mp4")
+
+        renderer.render_timeline(output_file, [first, second], 90, 160, fps=30)
+
+        clip = VideoFileClip(output_file)
+        self.assertEqual(tuple(clip.size), (90, 160))
+        self.assertAlmostEqual(clip.duration, 4, delta=0.2)
+        clip.close()
+
+    def test_render_timeline_motion_effects(self):
+        clip = SubClippedVideoClip(self.source_path, start_time=0, end_time=2)
+        clip.effects = [("slide_in", 1, "left"), ("zoom", "in_out", 1.05), ("shake", 5.0, 10.0)]
+        output_file = os.path.join(self.temp_dir.name, "motion.mp4")
+
+        renderer.render_timeline(output_file, [clip], 90, 160, fps=30)
+
+        video_clip = VideoFileClip(output_file)
+        # the clip starts outside of the frame and has slid in after one second
+        self.assertLess(video_clip.get_frame(0).mean(), 5)
+        self.assertGreater(video_clip.get_frame(1.5).mean(), 20)
+        self.assertAlmostEqual(video_clip.duration, 2, delta=0.1)
+        video_clip.close()
+
+    def test_render_timeline_intermediate_profile(self):
+        self.assertEqual(renderer.intermediate_encoding("unknown"), ("", []))
+        preset, encoder_params = renderer.intermediate_encoding("intra")
+        clip = SubClippedVideoClip(self.source_path, start_time=0, end_time=1)
+        output_file = os.path.join(self.temp_dir.name, "intra.mp4")
+
+        renderer.render_timeline(output_file, [clip], 90, 160, fps=30, preset=preset, encoder_params=encoder_params)
+
+        info = probe.probe_media(output_file, use_cache=False, with_keyframes=True)
+        self.assertEqual(info.keyframes, 30)
+
+    def test_render_timeline_blur_fill(self):
+        clip = SubClippedVideoClip(self.source_path, start_time=0, end_time=1, width=320, height=180)
+        output_file = os.path.join(self.temp_dir.name, "blur.mp4")
+
+        renderer.render_timeline(output_file, [clip], 90, 160, fps=30, fill_mode="blur")
+
+        video_clip = VideoFileClip(output_file)
+        frame = video_clip.get_frame(0.5)
+        self.assertEqual(frame.shape, (160, 90, 3))
+        # the bars above the scaled clip are filled instead of black
+        self.assertGreater(frame[:40].mean(), 20)
+        video_clip.close()
+
+    def test_timeline_stream(self):
+        clips = [
+            SubClippedVideoClip(self.source_path, start_time=0, end_time=1),
+            SubClippedVideoClip(self.source_path, start_time=1, end_time=2),
+        ]
+        tee_file = os.path.join(self.temp_dir.name, "combined.mp4")
+        stream = renderer.TimelineStream(clips, 90, 160, fps=10, tee_file=tee_file)
+        self.assertAlmostEqual(stream.duration, 2)
+
+        frames = [stream.get_frame(i / 10) for i in range(20)]
+        self.assertEqual(frames[0].shape, (160, 90, 3))
+        # the stream only reads forward, the last frame is repeated at the end
+        self.assertRaises(ValueError, stream.get_frame, 0)
+        self.assertIs(stream.get_frame(2.5), frames[-1])
+        stream.close()
+
+        self.assertEqual(len(os.listdir(self.temp_dir.name)), 2)
+        self.assertAlmostEqual(probe.get_duration(tee_file), 2, delta=0.1)
+
+    def test_timeline_stream_abort(self):
+        clips = [SubClippedVideoClip(self.source_path, start_time=0, end_time=2)]
+        tee_file = os.path.join(self.temp_dir.name, "combined.mp4")
+        stream = renderer.TimelineStream(clips, 90, 160, fps=10, tee_file=tee_file)
+        stream.get_frame(0)
+        process = stream._process
+        # a failed render stops ffmpeg and leaves nothing behind
+        stream.close(abort=True)
+        self.assertIsNotNone(process.poll())
+        self.assertEqual(os.listdir(self.temp_dir.name), [os.path.basename(self.source_path)])
+        stream.close()
+
+    def test_mix_audio(self):
+        voice_file = os.path.join(self.temp_dir.name, "voice.wav")
+        bgm_file = os.path.join(self.temp_dir.name, "bgm.wav")
+        renderer.run_ffmpeg(["-f", "lavfi", "-i", "sine=frequency=440", "-t", "2", voice_file])
+        renderer.run_ffmpeg(["-f", "lavfi", "-i", "sine=frequency=220", "-t", "1", bgm_file])
+        output_file = os.path.join(self.temp_dir.name, "mixed.m4a")
+
+        # the voice is padded and the music looped to the requested duration
+        renderer.mix_audio(voice_file, output_file, 3.5, bgm_file=bgm_file, bgm_volume=1, fade_out=1)
+
+        audio_clip = AudioFileClip(output_file)
+        self.assertAlmostEqual(audio_clip.duration, 3.5, delta=0.1)
+        self.assertGreater(abs(audio_clip.subclipped(2.2, 2.4).to_soundarray()).max(), 0.05)
+        audio_clip.close()
+
+    def test_concat_copy(self):
+        clip_files = []
+        for i in range(2):
+            clip_file = os.path.join(self.temp_dir.name, f"temp-clip-{i+1}.mp4")
+            renderer.render_timeline(clip_file, [SubClippedVideoClip(self.source_path, start_time=i, end_time=i + 2)], 90, 160)
+            clip_files.append(clip_file)
+        self.assertTrue(renderer.can_concat_copy(clip_files))
+        self.assertFalse(renderer.can_concat_copy([self.source_path, *clip_files]))
+
+        output_file = os.path.join(self.temp_dir.name, "combined.mp4")
+        renderer.concat_copy(clip_files, output_file)
+
+        clip = VideoFileClip(output_file)
+        self.assertEqual(tuple(clip.size), (90, 160))
+        self.assertAlmostEqual(clip.duration, 4, delta=0.2)
+        clip.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import probe, renderer, scene_detect
+
+class TestSceneDetect(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index_patches = [
+            mock.patch.object(probe, "db_file", return_value=os.path.join(self.temp_dir.name, "probe_index.db")),
+        ]
+        for patch in self.index_patches:
+            patch.start()
+        # a red scene of 2 seconds followed by a moving test pattern of 3 seconds
+        self.video_path = os.path.join(self.temp_dir.name, "scenes.mp4")
+        renderer.run_ffmpeg([
+            "-f", "lavfi", "-i", "color=red:size=160x90:rate=25:duration=2",
+            "-f", "lavfi", "-i", "testsrc=size=160x90:rate=25:duration=3",
+            "-filter_complex", "[0:v][1:v]concat=n=2:v=1[v]", "-map", "[v]",
+            "-pix_fmt", "yuv420p", self.video_path,
+        ])
+
+    def tearDown(self):
+        for patch in self.index_patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def test_detect_scenes(self):
+        self.assertEqual(scene_detect.detect_scenes(self.video_path), [2.0])
+
+    def test_get_scenes_is_cached_with_the_probe_result(self):
+        self.assertEqual(scene_detect.get_scenes(self.video_path), [2.0])
+        with mock.patch.object(scene_detect, "detect_scenes") as detect_scenes:
+            self.assertEqual(scene_detect.get_scenes(self.video_path), [2.0])
+            detect_scenes.assert_not_called()
+        # probing the file again keeps the stored scenes
+        probe.probe_media(self.video_path)
+        self.assertEqual(probe.get_cached_data(self.video_path, "scenes")["cuts"], [2.0])
+
+    def test_plan_cuts(self):
+        # without scenes the rest of the video is kept when it is long enough
+        self.assertEqual(scene_detect.plan_cuts(11, [], 4), [(0, 4), (4, 8), (8, 11)])
+        self.assertEqual(scene_detect.plan_cuts(9, [], 4), [(0, 4), (4, 8)])
+        # clips end before a cut and start at it
+        self.assertEqual(
+            scene_detect.plan_cuts(10, [3.0, 3.5], 4, gap=0.25),
+            [(0, 2.75), (3.5, 7.5), (7.5, 10)],
+        )
+
+if __name__ == "__main__":
+    unittest.main()
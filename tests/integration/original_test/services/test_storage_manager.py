@@ -0,0 +1,101 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import storage_manager
+
+class TestStorageManager(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, "cache_videos")
+        os.makedirs(self.cache_dir)
+        self.patches = [
+            mock.patch.object(storage_manager, "cache_dir", side_effect=lambda name: os.path.join(self.temp_dir.name, name)),
+            mock.patch.object(storage_manager, "access_file", return_value=os.path.join(self.temp_dir.name, "access.json")),
+            mock.patch.object(storage_manager, "_access", None),
+            mock.patch.object(storage_manager, "_pins", {}),
+            mock.patch.object(storage_manager, "_stats", {}),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def _write(self, name, size=1000, age=3600):
+        path = os.path.join(self.cache_dir, name)
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_evicts_least_recently_used(self):
+        oldest = self._write("a.mp4", age=3000)
+        used = self._write("b.mp4", age=4000)
+        newest = self._write("c.mp4", age=2000)
+        # a hit makes the oldest download the most recently used file
+        storage_manager.touch([used])
+
+        freed = storage_manager.evict("cache_videos", budget=2000)
+        self.assertEqual(freed, 1000)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(used))
+        self.assertTrue(os.path.exists(newest))
+
+        stats = storage_manager.get_stats()["cache_videos"]
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["evicted_bytes"], 1000)
+        self.assertEqual(stats["size"], 2000)
+
+    def test_keeps_pinned_and_written_files(self):
+        pinned = self._write("a.mp4")
+        writing = self._write("b.mp4.123.tmp")
+        recent = self._write("c.mp4", age=10)
+        old = self._write("d.mp4")
+
+        with storage_manager.pinned([pinned]):
+            storage_manager.evict("cache_videos", budget=1)
+        self.assertTrue(os.path.exists(pinned))
+        self.assertTrue(os.path.exists(writing))
+        self.assertTrue(os.path.exists(recent))
+        self.assertFalse(os.path.exists(old))
+        self.assertFalse(storage_manager.is_pinned(pinned))
+
+        # unpinned, the file can go
+        storage_manager.evict("cache_videos", budget=1)
+        self.assertFalse(os.path.exists(pinned))
+
+    def test_removes_abandoned_partial_files(self):
+        abandoned = self._write("a.mp4.part", age=2 * 24 * 3600)
+        claim = self._write("a.mp4.lock", age=2 * 24 * 3600)
+        resumable = self._write("b.mp4.part", age=3600)
+        video = self._write("c.mp4", age=2 * 24 * 3600)
+
+        # also without a budget
+        storage_manager.evict("cache_videos", budget=0)
+        self.assertFalse(os.path.exists(abandoned))
+        self.assertFalse(os.path.exists(claim))
+        self.assertTrue(os.path.exists(resumable))
+        self.assertTrue(os.path.exists(video))
+
+    def test_access_times_are_saved(self):
+        path = self._write("a.mp4")
+        storage_manager.touch([path], hit=False)
+        storage_manager.evict_all()
+        self.assertEqual(storage_manager.get_stats()["cache_videos"]["misses"], 1)
+
+        with mock.patch.object(storage_manager, "_access", None):
+            self.assertIn(os.path.abspath(path), storage_manager._load_access())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+import numpy as np
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import storage_manager, subtitle_overlay
+from app.utils import utils
+
+class TestSubtitleOverlay(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, "cache_subtitles")
+        os.makedirs(self.cache_dir)
+        self.dir_patch = mock.patch.object(subtitle_overlay, "cache_dir", return_value=self.cache_dir)
+        self.dir_patch.start()
+        # the eviction pass would run over the real storage directory
+        self.eviction_patch = mock.patch.object(storage_manager, "schedule_eviction")
+        self.eviction_patch.start()
+        # access times of cached files are saved under storage/
+        self.storage_patch = mock.patch.object(utils, "storage_dir", side_effect=self.storage_dir)
+        self.storage_patch.start()
+        subtitle_overlay._get_sprite.cache_clear()
+        self.font_path = os.path.join(utils.font_dir(), "Charm-Regular.ttf")
+
+    def tearDown(self):
+        self.dir_patch.stop()
+        self.eviction_patch.stop()
+        self.storage_patch.stop()
+        subtitle_overlay._get_sprite.cache_clear()
+        self.temp_dir.cleanup()
+
+    def storage_dir(self, sub_dir="", create=False):
+        d = os.path.join(self.temp_dir.name, "storage", sub_dir)
+        if create:
+            os.makedirs(d, exist_ok=True)
+        return d
+
+    def sprite(self, start, end, x, y, value):
+        image = np.zeros((4, 6, 4), dtype=np.uint8)
+        image[:, :, :3] = value
+        image[:, :, 3] = 255
+        return subtitle_overlay.SubtitleSprite(start=start, end=end, x=x, y=y, image=image)
+
+    def test_active_sprites(self):
+        overlay = subtitle_overlay.SubtitleOverlay([
+            self.sprite(0, 2, 0, 0, 10),
+            self.sprite(1, 5, 0, 0, 20),
+            self.sprite(2, 3, 0, 0, 30),
+            self.sprite(6, 7, 0, 0, 40),
+        ])
+        self.assertEqual(overlay.active_sprites(0.5), [0])
+        self.assertEqual(overlay.active_sprites(1.5), [0, 1])
+        self.assertEqual(overlay.active_sprites(2.5), [1, 2])
+        self.assertEqual(overlay.active_sprites(5.5), [])
+        self.assertEqual(overlay.active_sprites(6), [3])
+
+    def test_overlay_blends_sprite_area(self):
+        overlay = subtitle_overlay.SubtitleOverlay([self.sprite(0, 1, 8, 6, 200)])
+        frame = np.zeros((12, 16, 3), dtype=np.uint8)
+
+        result = overlay(lambda t: frame, 0.5)
+
+        self.assertTrue((result[6:10, 8:14] == 200).all())
+        self.assertEqual(int(result.sum()), 200 * 3 * 4 * 6)
+        # sprites partly outside of the frame are clipped
+        overlay = subtitle_overlay.SubtitleOverlay([self.sprite(0, 1, 12, 10, 200)])
+        self.assertEqual(int(overlay(lambda t: frame, 0.5).sum()), 200 * 3 * 2 * 4)
+        self.assertEqual(int(frame.sum()), 0)
+
+    def test_rasterize_text_is_cached(self):
+        kwargs = dict(
+            text="Hello",
+            font_path=self.font_path,
+            font_size=40,
+            color="#FFFFFF",
+            bg_color=None,
+            stroke_color="#000000",
+            stroke_width=1,
+            max_width=500,
+        )
+        image = subtitle_overlay.rasterize_text(**kwargs)
+        self.assertEqual(image.shape[2], 4)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # a new process loads the image from the disk cache without drawing it again
+        subtitle_overlay._get_sprite.cache_clear()
+        with mock.patch.object(subtitle_overlay, "TextClip") as text_clip:
+            np.testing.assert_array_equal(subtitle_overlay.rasterize_text(**kwargs), image)
+            text_clip.assert_not_called()
+
+        # the memory cache is bounded
+        self.assertEqual(subtitle_overlay._get_sprite.cache_info().maxsize, subtitle_overlay.sprite_cache_size)
+        self.assertEqual(subtitle_overlay._get_sprite.cache_info().currsize, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
 import os
 import sys
+import tempfile
 from pathlib import Path
+from unittest import mock
 
 # add project root to python path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
@@ -60,7 +62,41 @@ class TestTaskService(unittest.TestCase):
         )
         result = tm.start(task_id=task_id, params=params)
         print(result)
-    
+
+    def test_finalize_fails_when_draft_materials_are_gone(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            material = os.path.join(temp_dir, "material.mp4")
+            with open(material, "wb") as f:
+                f.write(b"video")
+            with open(os.path.join(temp_dir, "audio.mp3"), "wb") as f:
+                f.write(b"audio")
+            with mock.patch.object(tm.utils, "task_dir", return_value=temp_dir), \
+                    mock.patch.object(tm.sm, "state") as state, \
+                    mock.patch.object(tm, "generate_final_videos") as generate_final_videos:
+                tm.save_script_data(
+                    "task", "script", ["term"], VideoParams(video_subject="subject", subtitle_enabled=False),
+                    [material, os.path.join(temp_dir, "evicted.mp4")],
+                )
+                self.assertIsNone(tm.finalize("task"))
+                # the draft is not rendered with other clips
+                generate_final_videos.assert_not_called()
+                self.assertEqual(state.update_task.call_args.kwargs["state"], tm.const.TASK_STATE_FAILED)
+                self.assertFalse(tm.storage_manager.is_pinned(material))
+
+    def test_ai_materials_fail_when_no_image_renders(self):
+        from app.services import ai_material_generator
+
+        generator = mock.Mock()
+        generator.generate_materials = mock.AsyncMock(
+            return_value=mock.Mock(materials=[mock.Mock(image_path="image.png")])
+        )
+        params = VideoParams(video_subject="subject", video_source="ai_generated")
+        with mock.patch.object(ai_material_generator, "AIMaterialGenerator", return_value=generator), \
+                mock.patch.object(tm.video, "preprocess_video", return_value=[]), \
+                mock.patch.object(tm.sm, "state") as state:
+            self.assertIsNone(tm.get_video_materials("task", params, [], 10))
+        self.assertEqual(state.update_task.call_args.kwargs["state"], tm.const.TASK_STATE_FAILED)
+
 
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
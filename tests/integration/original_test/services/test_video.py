@@ -2,13 +2,16 @@
 import unittest
 import os
 import sys
+import tempfile
 from pathlib import Path
+from unittest import mock
 from moviepy import (
     VideoFileClip,
 )
 # add project root to python path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from app.models.schema import MaterialInfo
+from app.models.schema import MaterialInfo, RenderMode, VideoAspect, VideoConcatMode, VideoTransitionMode
+from app.services import clip_cache, probe, renderer, storage_manager
 from app.services import video as vd
 from app.utils import utils
 
@@ -17,9 +20,27 @@ resources_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "resour
 class TestVideoService(unittest.TestCase):
     def setUp(self):
         self.test_img_path = os.path.join(resources_dir, "1.png")
-    
+        # keep cached clips and probe results out of the real storage directory
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(clip_cache, "cache_dir", return_value=self.temp_dir.name),
+            mock.patch.object(probe, "db_file", return_value=os.path.join(self.temp_dir.name, "probe_index.db")),
+            mock.patch.object(storage_manager, "schedule_eviction"),
+            mock.patch.object(utils, "storage_dir", side_effect=self.storage_dir),
+        ]
+        for patch in self.patches:
+            patch.start()
+
     def tearDown(self):
-        pass
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def storage_dir(self, sub_dir="", create=False):
+        d = os.path.join(self.temp_dir.name, "storage", sub_dir)
+        if create:
+            os.makedirs(d, exist_ok=True)
+        return d
     
     def test_preprocess_video(self):
         if not os.path.exists(self.test_img_path):
@@ -46,7 +67,16 @@ class TestVideoService(unittest.TestCase):
         # clean generated test video file
         if os.path.exists(materials[0].url):
             os.remove(materials[0].url)
-    
+
+    def test_preprocess_video_drops_failed_images(self):
+        m = MaterialInfo()
+        m.url = self.test_img_path
+        m.provider = "local"
+
+        with mock.patch.object(vd.image_clip, "render_image_clip", side_effect=RuntimeError("broken")):
+            materials = vd.preprocess_video([m], clip_duration=4, workers=1)
+        self.assertEqual(materials, [])
+
     def test_wrap_text(self):
         """test text wrapping function"""
         try:
@@ -81,5 +111,172 @@ class TestVideoService(unittest.TestCase):
         except Exception as e:
             self.fail(f"test wrap_text failed: {str(e)}")
 
+    def test_plan_variant_timeline(self):
+        items = [
+            vd.SubClippedVideoClip(f"source-{i}.mp4", start_time=0, end_time=5, width=1280, height=720)
+            for i in range(6)
+        ]
+        timelines = [
+            vd.plan_variant_timeline(
+                items,
+                audio_duration=12,
+                seed=42,
+                variant=variant,
+                video_concat_mode=VideoConcatMode.random,
+                video_transition_mode=VideoTransitionMode.shuffle,
+                content_type="general",
+                enable_professional_effects=False,
+                effect_preset="auto",
+                crossfade=0,
+            )
+            for variant in range(3)
+        ]
+
+        # variants reorder the clips, but a clip keeps the same effects in every variant
+        self.assertNotEqual(
+            [item.file_path for item in timelines[0]],
+            [item.file_path for item in timelines[1]],
+        )
+        effects = {}
+        for timeline in timelines:
+            self.assertEqual(len(timeline), 3)
+            for item in timeline:
+                self.assertEqual(effects.setdefault(item.file_path, item.effects), item.effects)
+        # planning works on copies
+        self.assertTrue(all(item.effects == [] for item in items))
+
+    def test_plan_variant_timeline_folds_final_enhancement(self):
+        items = [vd.SubClippedVideoClip("source.mp4", start_time=0, end_time=5, width=1280, height=720)]
+        timeline = vd.plan_variant_timeline(
+            items,
+            audio_duration=4,
+            seed=42,
+            variant=0,
+            video_concat_mode=VideoConcatMode.sequential,
+            video_transition_mode=VideoTransitionMode.fade_in,
+            content_type="lifestyle",
+            enable_professional_effects=True,
+            effect_preset="auto",
+            crossfade=0,
+        )
+        # the whole-video enhancement is part of the clip's effect chain
+        self.assertEqual(timeline[0].effects[0], ("fade_in", 1))
+        self.assertEqual(timeline[0].effects[-4:], vd.video_effects.professional_enhancement_plan("medium"))
+
+    def test_draft_selects_the_clips_of_the_final_video(self):
+        items = [
+            vd.SubClippedVideoClip(f"source-{i}.mp4", start_time=0, end_time=3, width=1280, height=720)
+            for i in range(8)
+        ]
+        plans = {}
+        for render_mode in (RenderMode.draft, RenderMode.final):
+            with mock.patch.object(vd, "build_subclipped_items", return_value=items):
+                timelines, crossfade = vd.plan_video_variants(
+                    ["source.mp4"],
+                    audio_duration=10,
+                    video_count=2,
+                    video_transition_mode=VideoTransitionMode.shuffle,
+                    enable_professional_effects=True,
+                    seed=42,
+                    render_mode=render_mode,
+                )
+            plans[render_mode] = (
+                [[(item.file_path, item.start_time, item.end_time) for item in timeline] for timeline in timelines],
+                crossfade,
+            )
+        # the crossfade changes how many clips cover the audio, the draft plans with the final one
+        self.assertEqual(plans[RenderMode.draft], plans[RenderMode.final])
+        self.assertEqual(plans[RenderMode.final][1], 0.5)
+
+    def test_select_timeline_clips(self):
+        items = [vd.SubClippedVideoClip(f"source-{i}.mp4", start_time=1, end_time=5) for i in range(4)]
+        # the fewest clips that cover the audio, the last one ends with the audio
+        timeline = vd.select_timeline_clips(items, audio_duration=9)
+        self.assertEqual([item.file_path for item in timeline], ["source-0.mp4", "source-1.mp4", "source-2.mp4"])
+        self.assertEqual((timeline[-1].start_time, timeline[-1].end_time), (1, 2.1))
+        self.assertEqual(items[2].end_time, 5)
+
+        # clips are only repeated when the materials are too short
+        timeline = vd.select_timeline_clips(items[:2], audio_duration=10)
+        self.assertEqual(len(timeline), 3)
+        self.assertEqual(timeline[2].file_path, "source-0.mp4")
+
+    def test_get_render_resolution(self):
+        self.assertEqual(vd.get_render_resolution(VideoAspect.portrait), (1080, 1920))
+        self.assertEqual(vd.get_render_resolution(VideoAspect.portrait, RenderMode.draft), (360, 640))
+        self.assertEqual(vd.get_render_resolution(VideoAspect.landscape, "draft"), (640, 360))
+        self.assertEqual(vd.get_render_resolution(VideoAspect.square, RenderMode.draft), (360, 360))
+
+    def test_plan_encode_segments(self):
+        with mock.patch.object(probe, "keyframe_times", return_value=[0, 2.5, 4, 6.1, 9]):
+            ranges = vd.plan_encode_segments("video.mp4", 300, 30, 3)
+        # boundaries snap to the keyframes closest to 1/3 and 2/3 of the video
+        self.assertEqual(ranges, [(0, 120), (120, 183), (183, 300)])
+
+        with mock.patch.object(probe, "keyframe_times", return_value=[0, 0.5, 9.9]):
+            self.assertEqual(vd.plan_encode_segments("video.mp4", 300, 30, 3), [(0, 300)])
+
+    def test_encode_segmented(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_path = os.path.join(temp_dir, "combined.mp4")
+            audio_path = os.path.join(temp_dir, "audio.mp3")
+            renderer.run_ffmpeg([
+                "-f", "lavfi", "-i", "testsrc=size=160x90:rate=30", "-t", "6",
+                "-pix_fmt", "yuv420p", "-g", "60", video_path,
+            ])
+            renderer.run_ffmpeg(["-f", "lavfi", "-i", "sine=frequency=440", "-t", "5", audio_path])
+            audio_track = renderer.mix_audio(audio_path, os.path.join(temp_dir, "audio.m4a"), 6.5)
+            output_file = os.path.join(temp_dir, "final.mp4")
+
+            vd.encode_segmented(video_path, None, audio_track, output_file, 6, 3)
+
+            info = probe.probe_media(output_file, use_cache=False, with_keyframes=True)
+            self.assertAlmostEqual(info.duration, 6, delta=0.1)
+            self.assertEqual(len(info.audio_streams), 1)
+            self.assertEqual(info.keyframes, 3)
+            self.assertEqual(
+                sorted(os.listdir(temp_dir)), ["audio.m4a", "audio.mp3", "combined.mp4", "final.mp4"]
+            )
+
+    def test_combine_videos_replaces_failed_clips(self):
+        video_paths = []
+        for i in range(4):
+            video_path = os.path.join(self.temp_dir.name, f"source-{i}.mp4")
+            renderer.run_ffmpeg([
+                "-f", "lavfi", "-i", "testsrc=size=160x90:rate=30", "-t", "3",
+                "-pix_fmt", "yuv420p", video_path,
+            ])
+            video_paths.append(video_path)
+        audio_path = os.path.join(self.temp_dir.name, "audio.mp3")
+        renderer.run_ffmpeg(["-f", "lavfi", "-i", "sine=frequency=440", "-t", "7", audio_path])
+        combined_video_path = os.path.join(self.temp_dir.name, "combined.mp4")
+
+        render_subclip = vd.render_subclip
+
+        def render_or_fail(subclipped_item, *args):
+            if subclipped_item.file_path == video_paths[0]:
+                raise RuntimeError("broken material")
+            return render_subclip(subclipped_item, *args)
+
+        with mock.patch.object(vd, "render_subclip", side_effect=render_or_fail) as render, \
+                mock.patch.object(vd.clip_cache, "is_enabled", return_value=True), \
+                mock.patch.dict(vd.config.app, {"video_render_engine": "ffmpeg", "clip_render_workers": 1}):
+            vd.combine_videos(
+                combined_video_path,
+                video_paths,
+                audio_path,
+                video_concat_mode=VideoConcatMode.sequential,
+                video_transition_mode=VideoTransitionMode.none,
+                enable_professional_effects=False,
+                seed=1,
+            )
+
+        # the failed clip is replaced by the next material, the video still covers the audio
+        rendered_files = [call.args[0].file_path for call in render.call_args_list]
+        self.assertEqual(rendered_files.count(video_paths[0]), 1)
+        self.assertIn(video_paths[3], rendered_files)
+        info = probe.probe_media(combined_video_path, use_cache=False)
+        self.assertAlmostEqual(info.duration, 7.1, delta=0.2)
+
 if __name__ == "__main__":
-    unittest.main() 
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+from moviepy import (
+    ColorClip,
+    ImageClip,
+)
+from PIL import Image
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from app.services import probe
+from app.services.utils import video_effects
+
+class TestVideoEffects(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.frame = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+        self.effects = [
+            ("contrast", 1.1),
+            ("brightness", 1.05),
+            ("warm", 0.2),
+            ("saturation", 1.1),
+            ("cinematic", 0.3),
+        ]
+
+    def test_compile_color_effects_fuses_luts(self):
+        program = video_effects.compile_color_effects(self.effects)
+        # contrast + brightness + warm fuse into one table, saturation needs
+        # the matrix, cinematic fuses into the table after it
+        self.assertEqual([kind for kind, _ in program], ["lut", "matrix", "lut"])
+
+    def test_fused_program_matches_single_effects(self):
+        expected = self.frame
+        for effect in self.effects:
+            expected = video_effects.run_color_program(
+                expected, video_effects.compile_color_effects([effect])
+            )
+        fused = video_effects.run_color_program(
+            self.frame, video_effects.compile_color_effects(self.effects)
+        )
+        np.testing.assert_array_equal(fused, expected)
+
+    def test_apply_effect_plan(self):
+        clip = ColorClip(size=(64, 48), color=(100, 120, 140)).with_duration(1)
+        clip = video_effects.apply_effect_plan(clip, [("brightness", 1.5), ("fade_in", 0.5)])
+        frame = clip.get_frame(0.9)
+        np.testing.assert_array_equal(frame[0, 0], [150, 180, 210])
+
+    def test_motion_effects_to_ffmpeg(self):
+        for effect in [
+            ("slide_in", 1, "top"),
+            ("slide_out", 1, "right"),
+            ("zoom_in", 1.1, 1),
+            ("zoom", "in_out", 1.05),
+            ("rotate", 360, 1),
+            ("pan", "left", 50),
+            ("shake", 5.0, 10.0),
+        ]:
+            self.assertIsNotNone(video_effects.effect_to_ffmpeg(effect, 5, (1080, 1920)), effect)
+        # pan moves the frame by speed * duration, the canvas is padded by as much
+        pad, crop = video_effects.effect_to_ffmpeg(("pan", "left", 50), 5, (1080, 1920))
+        self.assertTrue(pad.startswith("pad=iw+250:ih+0:0:0"))
+        self.assertTrue(crop.startswith("crop=1080:1920:"))
+
+    def render_ffmpeg_frame(self, effect, duration, t, fps=10):
+        # the same frame rendered by the ffmpeg filters of the effect
+        h, w = self.frame.shape[:2]
+        filters = video_effects.effect_to_ffmpeg(effect, duration, (w, h), fps)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = f"{temp_dir}/frame.png"
+            Image.fromarray(self.frame).save(image_path)
+            output = subprocess.run(
+                [
+                    probe.get_ffmpeg_binary(), "-loglevel", "error", "-loop", "1", "-framerate", str(fps),
+                    "-i", image_path, "-t", str(duration), "-vf", ",".join(filters + ["format=rgb24"]),
+                    "-f", "rawvideo", "pipe:1",
+                ],
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+        frames = np.frombuffer(output, dtype=np.uint8).reshape(-1, h, w, 3)
+        return frames[int(round(t * fps))]
+
+    def test_motion_effects_match_ffmpeg(self):
+        # a smooth picture, resampling noise would hide the motion
+        y, x = np.mgrid[0:48, 0:64]
+        self.frame = np.stack([x * 4, y * 5, (x + y) * 2], axis=-1).astype(np.uint8)
+        for effect, t in [
+            (("pan", "left", 30), 0.5),
+            (("shake", 5.0, 1.0), 0.3),
+            (("slide_in", 1, "top"), 0.5),
+            (("zoom_in", 1.5, 1), 0.5),
+            (("zoom", "out", 1.3), 1.45),
+            (("rotate", 90, 1), 0.5),
+        ]:
+            clip = ImageClip(self.frame).with_duration(2).with_fps(10)
+            expected = self.render_ffmpeg_frame(effect, 2, t)
+            frame = video_effects.apply_effect_plan(clip, [effect]).get_frame(t)
+            self.assertEqual(frame.shape, expected.shape, effect)
+            # both engines move the picture the same way, only resampling differs
+            diff = np.abs(frame.astype(int) - expected.astype(int)).mean()
+            moved = np.abs(frame.astype(int) - self.frame.astype(int)).mean()
+            self.assertLess(diff, 6, effect)
+            self.assertGreater(moved, diff * 2, effect)
+
+if __name__ == "__main__":
+    unittest.main()